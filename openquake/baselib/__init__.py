@@ -110,6 +110,7 @@ def boolean(flag):
 
 
 config.read(soft_mem_limit=int, hard_mem_limit=int, port=int,
+            pmap_cache_mb=int, source_cache_mb=int, exposure_cache_mb=int,
             multi_user=boolean,
             serialize_jobs=boolean, strict=boolean, code=exec)
 
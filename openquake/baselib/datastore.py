@@ -26,11 +26,14 @@ import collections
 import numpy
 import h5py
 import pandas
+from pandas.core.internals import BlockManager, make_block
 
 from openquake.baselib import hdf5, config, performance
 
 
 CALC_REGEX = r'(calc|cache)_(\d+)\.hdf5'
+_df_cache = {}  # used in read_df with cache=True
+DF_CACHE_SIZE = 10  # maximum number of DataFrames in the cache
 
 
 def get_datadir():
@@ -430,12 +433,41 @@ class DataStore(collections.abc.MutableMapping):
         data = bytes(numpy.asarray(self[key][()]))
         return io.BytesIO(gzip.decompress(data))
 
-    def read_df(self, key, index=None):
+    def read_df(self, key, index=None, sel=(), slc=slice(None),
+                cache=False):
         """
         :param key: name of the structured dataset
         :param index: if given, name of the "primary key" field
+        :param sel: if given, names of the fields to read (plus the index)
+        :param slc: slice of the rows to read (default all)
+        :param cache: if True, keep the DataFrame in memory in the process
         :returns: pandas DataFrame associated to the dataset
-        """
+
+        The DataFrame is built field by field, directly from the HDF5
+        reads, with a block per field and without consolidating the blocks,
+        so that the numeric columns are not copied; a vector field `name`
+        is expanded into the columns `name_0`, `name_1`, ... which are
+        views of the same array. The cache is useful in long-lived workers
+        reading the same data again and again; it keeps up to
+        DF_CACHE_SIZE DataFrames, it is cleared when reading a different
+        file and it returns shallow copies of the cached DataFrames: the
+        columns can be replaced, but their data are read-only.
+        """
+        if sel and index is not None and index not in sel:
+            sel = [index] + list(sel)
+        if cache:
+            ckey = (self.filename, key, str(index), tuple(sel),
+                    slc.start, slc.stop, slc.step)
+            if _df_cache and next(iter(_df_cache))[0] != self.filename:
+                _df_cache.clear()
+            if ckey not in _df_cache:
+                if len(_df_cache) >= DF_CACHE_SIZE:  # discard the oldest
+                    del _df_cache[next(iter(_df_cache))]
+                df = self.read_df(key, index, sel, slc)
+                for block in df._data.blocks:
+                    block.values.flags.writeable = False
+                _df_cache[ckey] = df
+            return _df_cache[ckey].copy(deep=False)  # no data is copied
         try:
             dset = self.getitem(key)
         except KeyError:
@@ -447,26 +479,26 @@ class DataStore(collections.abc.MutableMapping):
             raise self.EmptyDataset('Dataset %s is empty' % key)
         if 'shape_descr' in dset.attrs:
             return dset2df(dset, index)
-        dtlist = []
-        for name in dset.dtype.names:
-            dt = dset.dtype[name]
-            if dt.shape:  # vector field
-                templ = name + '_%d' * len(dt.shape)
-                for i, _ in numpy.ndenumerate(numpy.zeros(dt.shape)):
-                    dtlist.append((templ % i, dt.base))
-            else:  # scalar field
-                dtlist.append((name, dt))
-        data = numpy.zeros(len(dset), dtlist)
-        for name in dset.dtype.names:
-            arr = dset[name]
-            dt = dset.dtype[name]
-            if dt.shape:  # vector field
-                templ = name + '_%d' * len(dt.shape)
-                for i, _ in numpy.ndenumerate(numpy.zeros(dt.shape)):
-                    data[templ % i] = arr[(slice(None),) + i]
+        columns, blocks = [], []
+        for name in sel or dset.dtype.names:
+            arr = dset[slc, name]
+            if arr.dtype.kind in 'SU':  # strings are stored as objects
+                arr = arr.astype(object)
+            if arr.ndim > 1:  # vector field
+                templ = name + '_%d' * (arr.ndim - 1)
+                names = [templ % i for i in numpy.ndindex(arr.shape[1:])]
+                values = arr.reshape(len(arr), -1).T  # a view
             else:  # scalar field
-                data[name] = arr
-        return pandas.DataFrame.from_records(data, index=index)
+                names = [name]
+                values = arr[None]
+            place = range(len(columns), len(columns) + len(names))
+            blocks.append(make_block(values, placement=place))
+            columns.extend(names)
+        df = pandas.DataFrame(BlockManager(
+            blocks, [pandas.Index(columns), pandas.RangeIndex(len(arr))]))
+        if index is not None:
+            df.set_index(index, inplace=True)
+        return df
 
     @property
     def metadata(self):
@@ -23,6 +23,8 @@ import os
 import sys
 import copy
 import math
+import pickle
+import hashlib
 import socket
 import random
 import atexit
@@ -406,6 +408,107 @@ def removetmp():
                 pass
 
 
+class DiskCache(object):
+    """
+    A cache of pickled objects stored in a directory. The keys are
+    checksums of the engine version, of the given objects and of the
+    contents of the given files. Reading an entry updates its modification
+    time, so that the least recently used entries are the first to be
+    removed by .evict() when the cache exceeds its maximum size.
+
+    :param dirname: the directory of the cache
+    :param maxsize: maximum size of the cache in bytes
+
+    >>> cache = DiskCache(tempfile.mkdtemp(), maxsize=10 ** 6)
+    >>> key = cache.get_key('some', 'args')
+    >>> cache.get(key) is None
+    True
+    >>> cache.put(key, [1, 2, 3])
+    >>> cache.get(key)
+    [1, 2, 3]
+    """
+    def __init__(self, dirname, maxsize):
+        self.dirname = dirname
+        self.maxsize = maxsize
+
+    def get_key(self, *args, fnames=()):
+        """
+        :param args: picklable objects
+        :param fnames: names of files
+        :returns: a checksum of the objects and of the file contents
+        """
+        from openquake.baselib import __version__
+        h = hashlib.sha1(pickle.dumps((__version__,) + args,
+                                      pickle.HIGHEST_PROTOCOL))
+        for fname in fnames:
+            with open(fname, 'rb') as f:
+                for block in iter(lambda: f.read(2 ** 20), b''):
+                    h.update(block)
+        return h.hexdigest()
+
+    def get_path(self, key):
+        """
+        :returns: the path to the cache entry for the given key
+        """
+        return os.path.join(self.dirname, key + '.pik')
+
+    def get(self, key):
+        """
+        :returns: the cached object or None
+        """
+        path = self.get_path(key)
+        try:
+            with open(path, 'rb') as f:
+                obj = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:  # removed by another process
+            pass
+        return obj
+
+    def put(self, key, obj):
+        """
+        Store the object atomically
+        """
+        path = self.get_path(key)
+        os.makedirs(self.dirname, exist_ok=True)
+        tmp = '%s.%d' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def evict(self):
+        """
+        Remove the least recently used entries exceeding the maximum size
+
+        :returns: the number of removed entries
+        """
+        if not os.path.exists(self.dirname):
+            return 0
+        stats = []
+        for fname in os.listdir(self.dirname):
+            path = os.path.join(self.dirname, fname)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:  # removed by another process
+                continue
+            stats.append((st.st_mtime, st.st_size, path))
+        size = sum(st[1] for st in stats)
+        removed = 0
+        for _mtime, nbytes, path in sorted(stats):
+            if size <= self.maxsize:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= nbytes
+            removed += 1
+        return removed
+
+
 def git_suffix(fname):
     """
     :returns: `<short git hash>` if Git repository found
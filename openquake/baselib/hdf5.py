@@ -19,6 +19,7 @@
 import os
 import ast
 import csv
+import codecs
 import inspect
 import logging
 import tempfile
@@ -663,6 +664,33 @@ def _read_csv(fileobj, compositedt):
     return numpy.array(rows, compositedt)
 
 
+def split_csv(fname, blocksize):
+    """
+    Split a CSV file in slices of complete lines of approximately
+    `blocksize` bytes, skipping the initial comment lines starting with #,
+    so that the slices can be parsed in parallel.
+
+    :param fname: a CSV file with a header
+    :param blocksize: approximate number of bytes in each slice
+    :returns: the fields in the header and a list of (start, stop) offsets
+    """
+    with open(fname, 'rb') as f:
+        for line in f:
+            if not line.startswith((b'#', codecs.BOM_UTF8 + b'#')):
+                break
+        [header] = csv.reader([line.decode('utf-8-sig')])
+        start = f.tell()
+        size = os.fstat(f.fileno()).st_size
+        slices = []
+        while start < size:
+            f.seek(start + blocksize)
+            f.readline()  # go to the end of the line
+            stop = min(f.tell(), size)
+            slices.append((start, stop))
+            start = stop
+    return [field.strip() for field in header], slices
+
+
 # NB: it would be nice to use numpy.loadtxt(
 #  f, build_dt(dtypedict, header), delimiter=sep, ndmin=1, comments=None)
 # however numpy does not support quoting, and "foo,bar" would be split :-(
@@ -807,7 +807,8 @@ def context(fname, node):
 class ValidatingXmlParser(object):
     """
     Validating XML Parser based on Expat. It has two methods `.parse_file`
-    and `.parse_bytes` returning a validated :class:`Node` object.
+    and `.parse_bytes` returning a validated :class:`Node` object, and a
+    method `.parse_iter` to parse large files incrementally.
 
     :param validators: a dictionary of validation functions
     :param stop: the tag where to stop the parsing (if any)
@@ -820,13 +821,15 @@ class ValidatingXmlParser(object):
         self.stop = stop
 
     @contextmanager
-    def _context(self):
+    def _context(self, select=None):
         self.p = ParserCreate(namespace_separator='}')
         self.p.StartElementHandler = self._start_element
         self.p.EndElementHandler = self._end_element
         self.p.CharacterDataHandler = self._char_data
         self._ancestors = []
         self._root = None
+        self._select = select
+        self._selected = []
         try:
             yield
         except ExpatError as err:
@@ -871,6 +874,36 @@ class ValidatingXmlParser(object):
                     self.p.ParseFile(f)
         return self._root
 
+    def parse_iter(self, file_or_fname, select, blocksize=2 ** 20):
+        """
+        Parse a file or a filename incrementally and yield pairs
+        (ancestors, node) for each node satisfying `select(ancestors, node)`
+        as soon as it is complete. Such nodes are not attached to their
+        parent, so the memory occupation is bounded by the size of the
+        largest of them. The ancestors have validated attributes but only
+        the subnodes parsed so far. The last pair is ((), root).
+        """
+        with self._context(select):
+            if hasattr(file_or_fname, 'read'):
+                self.filename = getattr(
+                    file_or_fname, 'name', file_or_fname.__class__.__name__)
+                f = file_or_fname
+            else:
+                self.filename = file_or_fname
+                f = open(file_or_fname, 'rb')
+            try:
+                while True:
+                    data = f.read(blocksize)
+                    self.p.Parse(data, not data)
+                    yield from self._selected
+                    del self._selected[:]
+                    if not data:
+                        break
+            finally:
+                if f is not file_or_fname:
+                    f.close()
+        yield (), self._root
+
     def _start_element(self, longname, attrs):
         try:
             xmlns, name = longname.split('}')
@@ -878,8 +911,10 @@ class ValidatingXmlParser(object):
             name = tag = longname
         else:  # fix the tag with an opening brace
             tag = '{' + longname
-        self._ancestors.append(
-            Node(tag, attrs, lineno=self.p.CurrentLineNumber))
+        node = Node(tag, attrs, lineno=self.p.CurrentLineNumber)
+        with context(self.filename, node):
+            self._set_attribs(node)
+        self._ancestors.append(node)
         if self.stop and name == self.stop:
             for anc in reversed(self._ancestors):
                 self._end_element(anc.tag)
@@ -890,8 +925,12 @@ class ValidatingXmlParser(object):
         with context(self.filename, node):
             self._root = self._literalnode(node)
         del self._ancestors[-1]
-        if self._ancestors:
-            self._ancestors[-1].append(self._root)
+        if not self._ancestors:
+            return
+        if self._select and self._select(self._ancestors, node):
+            self._selected.append((tuple(self._ancestors), node))
+        else:
+            self._ancestors[-1].append(node)
 
     def _char_data(self, data):
         if data:
@@ -924,16 +963,15 @@ class ValidatingXmlParser(object):
                 (tn, val.__name__, exc, node.lineno))
 
     def _literalnode(self, node):
-        tag = striptag(node.tag)
-
-        # cast the text
-        self._set_text(node, node.text, tag)
+        # cast the text; the attributes are cast in _start_element
+        self._set_text(node, node.text, striptag(node.tag))
+        return node
 
-        # cast the attributes
+    def _set_attribs(self, node):
+        tag = striptag(node.tag)
         for n, v in node.attrib.items():
             tn = '%s.%s' % (tag, n)
             if tn in self.validators:
                 self._set_attrib(node, n, tn, v)
             elif n in self.validators:
                 self._set_attrib(node, n, n, v)
-        return node
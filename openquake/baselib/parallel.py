@@ -90,6 +90,16 @@ no pool, but it is still better to call it: in the future, you may change
 idea and use another parallelization strategy requiring cleanup. In this
 way your code is future-proof.
 
+Shared arrays
+=============================
+
+Large read-only arrays needed by all tasks (the site collection, the
+assets, the events) should not be pickled in each task, nor read again
+from the datastore by each task. Instead they can be published with
+`Starmap.share`, which stores them in memory-mapped .npy files and
+returns :class:`openquake.baselib.parallel.Shared` objects; such objects
+are cheap to pickle and the workers attach to the data without copying it.
+
 Monitoring
 =============================
 
@@ -146,6 +156,8 @@ import time
 import socket
 import signal
 import pickle
+import heapq
+import numbers
 import inspect
 import logging
 import operator
@@ -242,6 +254,7 @@ class Pickled(object):
     def __init__(self, obj):
         self.clsname = obj.__class__.__name__
         self.calc_id = str(getattr(obj, 'calc_id', ''))  # for monitors
+        self.weight = get_weight(obj)  # used to prioritize the tasks
         try:
             self.pik = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
         except TypeError as exc:  # can't pickle, show the obj in the message
@@ -261,6 +274,87 @@ class Pickled(object):
         return pickle.loads(self.pik)
 
 
+class Shared(object):
+    """
+    A read-only numpy array published by the master in a memory-mapped
+    .npy file. Pickling a Shared instance sends only the file name, so
+    the workers attach to the data with `numpy.load(..., mmap_mode='c')`
+    without copying it and without going through zmq. The mapping is
+    copy-on-write, so a worker modifying the array does not affect the
+    other workers. The file must be on a filesystem visible to the
+    workers, i.e. the directory of the datastore.
+
+    :param array: the array to publish (it cannot contain objects)
+    :param dirname: the directory where to save the .npy file
+
+    >>> sh = Shared(numpy.arange(3))
+    >>> list(sh.get())
+    [0, 1, 2]
+    >>> sh.close()
+
+    A Shared array can also be created empty by the master and filled
+    by a task, so that the data are never sent back to the master:
+
+    >>> sh = Shared.empty((2, 2), float)
+    >>> sh.set(numpy.eye(2))
+    >>> sh.get().tolist()
+    [[1.0, 0.0], [0.0, 1.0]]
+    >>> sh.close()
+    """
+    def __init__(self, array, dirname=None):
+        self.fname = gettemp(dir=dirname, prefix='shared_', suffix='.npy')
+        numpy.save(self.fname, array)
+        self.__dict__['array'] = array
+
+    @classmethod
+    def empty(cls, shape, dtype, dirname=None):
+        """
+        :returns: a Shared instance with a .npy file of the given shape and
+                  dtype, to be filled with :meth:`set`
+        """
+        self = cls.__new__(cls)
+        self.fname = gettemp(dir=dirname, prefix='shared_', suffix='.npy')
+        numpy.lib.format.open_memmap(self.fname, 'w+', dtype, shape).flush()
+        return self
+
+    def set(self, array):
+        """
+        Write the given array in the .npy file, without keeping it in memory
+        """
+        arr = numpy.load(self.fname, mmap_mode='r+')
+        arr[:] = array
+        arr.flush()
+
+    def __getstate__(self):
+        return dict(fname=self.fname)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.fname)
+
+    def get(self):
+        """
+        :returns: the underlying array, memory-mapped in the workers
+        """
+        if 'array' not in vars(self):
+            self.__dict__['array'] = numpy.load(self.fname, mmap_mode='c')
+        return self.__dict__['array']
+
+    def close(self):
+        """
+        Remove the underlying file
+        """
+        if os.path.exists(self.fname):
+            os.remove(self.fname)
+
+
+def get_weight(obj):
+    """
+    :returns: the .weight attribute of the object if numeric, else 1
+    """
+    weight = getattr(obj, 'weight', 1.)
+    return weight if isinstance(weight, numbers.Real) else 1.
+
+
 def get_pickled_sizes(obj):
     """
     Return the pickled sizes of an object and its direct attributes,
@@ -480,14 +574,18 @@ class IterResult(object):
         a logging function for the progress report
     :param hdf5path:
         a path where to store persistently the performance info
+    :param num_cores:
+        the number of cores used, to compute the core utilization
      """
-    def __init__(self, iresults, taskname, argnames, sent, h5):
+    def __init__(self, iresults, taskname, argnames, sent, h5, num_cores=1):
         self.iresults = iresults
         self.name = taskname
         self.argnames = ' '.join(argnames)
         self.sent = sent
         self.received = []
         self.h5 = h5
+        self.num_cores = num_cores
+        self.busy = 0  # total time spent in the tasks
 
     def _iter(self):
         first_time = True
@@ -524,6 +622,7 @@ class IterResult(object):
                 del self.h5['task_sent']
                 self.h5['task_sent'] = str(task_sent)
                 name = result.mon.operation[6:]  # strip 'total '
+                self.busy += result.mon.duration
                 result.mon.save_task_info(self.h5, result, name, mem_gb)
                 result.mon.flush(self.h5)
                 self.h5.flush()
@@ -539,6 +638,8 @@ class IterResult(object):
         try:
             yield from self._iter()
         finally:
+            if hasattr(self.iresults, 'close'):  # stop the generator
+                self.iresults.close()
             tot = sum(self.received)
             max_per_output = max(self.received) if self.received else 0
             logging.info(
@@ -549,6 +650,23 @@ class IterResult(object):
                 nb = {k: humansize(v) for k, v in self.nbytes.items()}
                 if len(nb) < 10:
                     logging.info('Received %s', nb)
+            elapsed = time.time() - t0
+            if self.busy and elapsed:
+                self.save_utilization(self.busy / elapsed)
+
+    def save_utilization(self, busy_cores):
+        """
+        Log the core utilization and store it in the task_utilization
+        dictionary taskname -> fraction of the cores kept busy
+        """
+        util = min(busy_cores / self.num_cores, 1.)
+        logging.info('Core utilization for %s: %d%% of %d core(s)',
+                     self.name, util * 100, self.num_cores)
+        if 'task_utilization' in self.h5:  # not in old performance files
+            dic = ast.literal_eval(self.h5['task_utilization'][()])
+            dic[self.name] = round(util, 3)
+            del self.h5['task_utilization']
+            self.h5['task_utilization'] = str(dic)
 
     def reduce(self, agg=operator.add, acc=None):
         if acc is None:
@@ -711,6 +829,7 @@ class Starmap(object):
             config.dbserver.listen, config.dbserver.receiver_ports)
         self.monitor.backurl = None  # overridden later
         self.tasks = []  # populated by .submit
+        self.shared = []  # populated by .share
         self.task_no = 0
         if self.distribute == 'zmq':  # add a check
             err = workerpool.check_status()
@@ -738,6 +857,23 @@ class Starmap(object):
             self.prev_percent = percent
         return done
 
+    def share(self, **arrays):
+        """
+        Publish large read-only arrays as memory-mapped files in the
+        directory of the performance file, so that the tasks can attach
+        to them instead of reading them from the datastore. The files are
+        removed when all the tasks are done.
+
+        :param arrays: a dictionary name -> array
+        :returns: a dictionary name -> :class:`Shared` instance
+        """
+        dirname = os.path.dirname(os.path.abspath(self.h5.filename))
+        dic = {}
+        for name, array in arrays.items():
+            dic[name] = Shared(array, dirname)
+            self.shared.append(dic[name])
+        return dic
+
     def submit(self, args, func=None, monitor=None):
         """
         Submit the given arguments to the underlying task
@@ -787,8 +923,10 @@ class Starmap(object):
         """
         :returns: an :class:`IterResult` instance
         """
+        num_cores = 1 if self.distribute == 'no' else (
+            self.num_cores or CT // 2)
         return IterResult(self._loop(), self.name, self.argnames,
-                          self.sent, self.h5)
+                          self.sent, self.h5, num_cores)
 
     def reduce(self, agg=operator.add, acc=None):
         """
@@ -799,22 +937,37 @@ class Starmap(object):
     def __iter__(self):
         return iter(self.submit_all())
 
+    def _push(self, func, args):
+        # the task queue is a heap, so that the heaviest tasks are
+        # submitted first and the light ones fill the idle cores at the end
+        heapq.heappush(self.task_queue, (
+            -get_weight(args[0]), next(self._counter), func, args))
+
     def _submit_many(self, howmany):
         for _ in range(howmany):
             if self.task_queue:
-                # remove in LIFO order
-                func, args = self.task_queue[0]
-                del self.task_queue[0]
+                _w, _n, func, args = heapq.heappop(self.task_queue)
                 self.submit(args, func=func)
                 self.todo += 1
 
     def _loop(self):
+        try:
+            yield from self._loop_results()
+        finally:  # also if there are no tasks or a task failed
+            for shared in self.shared:
+                shared.close()
+            self.shared.clear()
+
+    def _loop_results(self):
         num_cores = self.num_cores or CT // 2
-        if self.task_queue:
-            first_args = self.task_queue[:num_cores]
-            self.task_queue[:] = self.task_queue[num_cores:]
-            for func, args in first_args:
-                self.submit(args, func=func)
+        queue = self.task_queue
+        self.task_queue = []
+        self._counter = itertools.count()
+        for func, args in queue:
+            self._push(func, args)
+        for _ in range(min(num_cores, len(queue))):
+            _w, _n, func, args = heapq.heappop(self.task_queue)
+            self.submit(args, func=func)
         if not hasattr(self, 'socket'):  # no submit was ever made
             return ()
 
@@ -833,7 +986,7 @@ class Starmap(object):
                 self.log_percent()
                 yield res
             elif res.func:  # add subtask
-                self.task_queue.append((res.func, res.pik))
+                self._push(res.func, res.pik)
                 if self.num_cores is None:
                     self._submit_many(1)  # oversubmit
                 elif self.todo < self.num_cores:
@@ -869,22 +1022,37 @@ def split_task(func, *args, duration=1000,
     :param args: arguments of the task function
     :param duration: split the task if it exceeds the duration
     :param weight: weight function for the elements in args[0]
-    :yields: a partial result, 0 or more task objects, 0 or 1 partial result
+    :yields:
+        the results of `func` on the heaviest elements, one at the time,
+        0 or more subtasks (func, block, *args[1:-1]) and the result of
+        `func` on the last block
     """
-    elements = numpy.array(sorted(args[0], key=weight, reverse=True))
+    elements = sorted(args[0], key=weight, reverse=True)
     n = len(elements)
     # print('task_no=%d, num_elements=%d' % (args[-1].task_no, n))
     assert n > 0, 'Passed an empty sequence!'
-    if n == 1:
+    left = sum(weight(el) for el in elements)
+    if n == 1 or left == 0:  # nothing to split or no weights to use
         yield func(*args)
         return
-    first, *other = elements
-    first_weight = weight(first)
+    # the time per unit of weight is estimated on the heaviest elements,
+    # one at the time, until the remaining elements fit in the duration
+    # or the estimate is based on at least 1/10 of the duration
     t0 = time.time()
-    res = func(*([first],) + args[1:])
-    dt = (time.time() - t0) / first_weight  # time per unit of weight
-    yield res
-    blocks = list(block_splitter(other, duration, lambda el: weight(el) * dt))
+    done = 0
+    for i, el in enumerate(elements[:-1]):
+        yield func(*([el],) + args[1:])
+        done += weight(el)
+        left -= weight(el)
+        elapsed = time.time() - t0
+        dt = elapsed / done  # time per unit of weight
+        if left * dt <= duration or elapsed > duration / 10:
+            break
+    other = elements[i + 1:]
+    # the blocks keep the weight of the elements, like the top level tasks,
+    # since the task queue is ordered by weight
+    max_weight = duration / dt if dt else numpy.inf
+    blocks = list(block_splitter(other, max_weight, weight))
     for block in blocks[:-1]:
         yield (func, block) + args[1:-1]
     yield func(*(blocks[-1],) + args[1:])
@@ -51,6 +51,8 @@ def init_performance(hdf5file, swmr=False):
         hdf5.create(h5, 'task_info', task_info_dt)
     if 'task_sent' not in h5:
         h5['task_sent'] = '{}'
+    if 'task_utilization' not in h5:
+        h5['task_utilization'] = '{}'
     if swmr:
         try:
             h5.swmr_mode = True
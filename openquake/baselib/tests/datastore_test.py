@@ -61,6 +61,41 @@ class DataStoreTestCase(unittest.TestCase):
         self.dstore['a/b'] = 42
         self.assertTrue('a/b' in self.dstore)
 
+    def test_read_df(self):
+        dt = [('id', numpy.uint32), ('v', (numpy.float32, (2,)))]
+        arr = numpy.zeros(4, dt)
+        arr['id'] = [13, 12, 11, 10]
+        arr['v'] = numpy.arange(8).reshape(4, 2)
+        self.dstore['arr'] = arr
+        df = self.dstore.read_df('arr')
+        self.assertEqual(list(df.columns), ['id', 'v_0', 'v_1'])
+        numpy.testing.assert_equal(df['v_1'].to_numpy(), [1, 3, 5, 7])
+        # the components of a vector field are views of the same array
+        self.assertTrue(numpy.may_share_memory(
+            df['v_0'].to_numpy(), df['v_1'].to_numpy()))
+
+        # selecting fields and rows, with an index
+        df = self.dstore.read_df('arr', 'id', sel=['id', 'v'],
+                                 slc=slice(1, 3))
+        self.assertEqual(list(df.index), [12, 11])
+        numpy.testing.assert_equal(df['v_0'].to_numpy(), [2, 4])
+
+        # the index is read even if not in sel
+        df = self.dstore.read_df('arr', 'id', sel=['v'])
+        self.assertEqual(list(df.index), [13, 12, 11, 10])
+        self.assertEqual(list(df.columns), ['v_0', 'v_1'])
+
+        # reading from the cache returns shallow copies of read-only data
+        df = self.dstore.read_df('arr', cache=True)
+        df2 = self.dstore.read_df('arr', cache=True)
+        self.assertTrue(numpy.shares_memory(
+            df['v_0'].to_numpy(), df2['v_0'].to_numpy()))
+        with self.assertRaises(ValueError):
+            df.iloc[0, 1] = 42.
+        df['v_0'] = 42.
+        df = self.dstore.read_df('arr', cache=True)
+        numpy.testing.assert_equal(df['v_0'].to_numpy(), [0, 2, 4, 6])
+
     def test_export_path(self):
         path = self.dstore.export_path('hello.txt', tempfile.mkdtemp())
         mo = re.search(r'hello_\d+', path)
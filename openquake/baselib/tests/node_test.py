@@ -190,3 +190,27 @@ param=yyy
     def test_can_pickle(self):
         node = n.Node('tag')
         self.assertEqual(pickle.loads(pickle.dumps(node)), node)
+
+    def test_parse_iter(self):
+        # the selected nodes are yielded and not attached to the parent
+        xmlfile = io.BytesIO(b"""\
+<root>
+<group name="g1">
+<src id="1"><a>1</a></src>
+<src id="2"><a>2</a></src>
+</group>
+<other>3</other>
+</root>
+""")
+        vparser = n.ValidatingXmlParser({'a': int, 'src.id': int})
+        pairs = list(vparser.parse_iter(
+            xmlfile, lambda ancestors, node: node.tag == 'src', blocksize=8))
+        self.assertEqual([node['id'] for _, node in pairs[:-1]], [1, 2])
+        self.assertEqual([~node.a for _, node in pairs[:-1]], [1, 2])
+        ancestors, _ = pairs[0]
+        self.assertEqual([anc.tag for anc in ancestors], ['root', 'group'])
+        self.assertEqual(ancestors[1]['name'], 'g1')
+        ancestors, root = pairs[-1]
+        self.assertEqual(ancestors, ())
+        self.assertEqual([node.tag for node in root], ['group', 'other'])
+        self.assertEqual(len(root.group), 0)
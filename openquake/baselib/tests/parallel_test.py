@@ -17,6 +17,7 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import ast
 import unittest.mock as mock
 import time
 import shutil
@@ -58,6 +59,38 @@ def supertask(text, monitor):
             yield get_length, k * v
 
 
+def sum_shared(shared, slc, monitor):
+    arr = shared.get()
+    return {'n': arr[slc].sum(), 'memmap': isinstance(arr, numpy.memmap)}
+
+
+class FakeClock(object):
+    """
+    A clock advancing only when the tasks run, .01 s per unit of weight
+    """
+    def __init__(self):
+        self.now = 0
+
+    def time(self):
+        return self.now
+
+    def run(self, weights):
+        self.now += sum(weights) * .01
+        return sum(weights)
+
+
+clock = FakeClock()
+
+
+def clocked_sum(weights, monitor):
+    return clock.run(weights)
+
+
+def split_sum(weights, monitor):
+    yield from parallel.split_task(clocked_sum, weights, monitor,
+                                   duration=.05, weight=lambda x: x)
+
+
 def countletters(text1, text2, monitor):
     for block in general.block_splitter(text1 + text2, 5):
         yield get_length, ''.join(block)
@@ -142,6 +175,8 @@ class StarmapTestCase(unittest.TestCase):
             dic = dict(general.fast_agg3(info, 'taskname', ['received']))
             self.assertGreater(dic[b'get_length'], 0)
             self.assertGreater(dic[b'supertask'], 0)
+            util = ast.literal_eval(h5['task_utilization'][()])
+            self.assertGreater(util['supertask'], 0)
         shutil.rmtree(tmpdir)
 
     def test_countletters(self):
@@ -149,11 +184,81 @@ class StarmapTestCase(unittest.TestCase):
         smap = parallel.Starmap(countletters, data)
         self.assertEqual(smap.reduce(), {'n': 19})
 
+    def test_shared(self):
+        smap = parallel.Starmap(sum_shared)
+        shared = smap.share(arr=numpy.arange(100))['arr']
+        self.assertLess(len(parallel.Pickled(shared)), 200)
+        for start in range(0, 100, 25):
+            smap.submit((shared, slice(start, start + 25)))
+        res = smap.reduce()
+        self.assertEqual(res['n'], 4950)
+        if parallel.oq_distribute() != 'no':
+            self.assertEqual(res['memmap'], 4)  # attached in the workers
+        self.assertFalse(os.path.exists(shared.fname))  # removed at the end
+
+        # the file is removed also if a task fails
+        smap = parallel.Starmap(sum_shared)
+        shared = smap.share(arr=numpy.arange(100))['arr']
+        smap.submit((shared, 'bad slice'))
+        with self.assertRaises(IndexError):
+            smap.reduce()
+        self.assertFalse(os.path.exists(shared.fname))
+
+        # and if there are no tasks
+        smap = parallel.Starmap(sum_shared)
+        shared = smap.share(arr=numpy.arange(100))['arr']
+        self.assertEqual(smap.reduce(), {})
+        self.assertFalse(os.path.exists(shared.fname))
+
     @classmethod
     def tearDownClass(cls):
         parallel.Starmap.shutdown()
 
 
+class SplitTaskTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(parallel, 'time', clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test(self):
+        # the time per unit of weight is .01 s, so the elements
+        # after the first one are split in subtasks of at most .05 s
+        res = list(parallel.split_task(
+            clocked_sum, [1, 2, 3, 4, 5], parallel.Monitor(),
+            duration=.05, weight=lambda x: x))
+        self.assertEqual(res[0], 5)  # the heaviest element
+        subtasks = [r[1] for r in res[1:-1]]
+        self.assertEqual(subtasks, [[4], [3, 2]])
+        for block in subtasks:
+            self.assertEqual(block.weight, sum(block))
+        self.assertEqual(res[-1], 1)  # the last block
+
+    def test_queue_order(self):
+        # the subtasks have the weight of their elements, so they are
+        # ordered together with the top level tasks
+        [heavy] = general.block_splitter([1, 2, 3, 4, 5], 100, lambda x: x)
+        [light] = general.block_splitter([.5], 100, lambda x: x)
+        smap = parallel.Starmap(split_sum, [(light,), (heavy,)],
+                                distribute='no')
+        res = list(smap)
+        self.assertEqual(sorted(res), [.5, 1, 4, 5, 5])
+        self.assertEqual(res[-1], .5)  # the light task runs last
+
+    def test_no_split(self):
+        # the task is fast enough, so there are no subtasks
+        res = list(parallel.split_task(
+            clocked_sum, [1, 2, 3, 4, 5], parallel.Monitor(),
+            weight=lambda x: x))
+        self.assertEqual(res, [5, 10])
+
+    def test_zero_weights(self):
+        # there is no way to estimate the speed, so the task is not split
+        res = list(parallel.split_task(
+            clocked_sum, [0, 0, 0], parallel.Monitor(), weight=lambda x: x))
+        self.assertEqual(res, [0])
+
+
 class ThreadPoolTestCase(unittest.TestCase):
     def test(self):
         monitor = parallel.Monitor()
@@ -15,6 +15,7 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+import io
 import os
 import sys
 import abc
@@ -26,6 +27,7 @@ import traceback
 from datetime import datetime
 from shapely import wkt
 import numpy
+import pandas
 
 from openquake.baselib import (
     general, hdf5, datastore, __version__ as engine_version)
@@ -35,7 +37,10 @@ from openquake.hazardlib import InvalidFile, site
 from openquake.hazardlib.site_amplification import Amplifier
 from openquake.hazardlib.calc.filters import SourceFilter
 from openquake.hazardlib.source import rupture
-from openquake.hazardlib.shakemap import get_sitecol_shakemap, to_gmfs
+from openquake.hazardlib.imt import from_string
+from openquake.hazardlib.shakemap import (
+    get_sitecol_shakemap, get_imts, spatial_factors, sample_gmfs,
+    cross_correlation_matrix, MAX_DENSE_SITES)
 from openquake.risklib import riskinput, riskmodels
 from openquake.commonlib import readinput, logictree, source, calc, util
 from openquake.calculators.ucerf_base import UcerfFilter
@@ -53,6 +58,8 @@ U32 = numpy.uint32
 F32 = numpy.float32
 TWO16 = 2 ** 16
 TWO32 = 2 ** 32
+GMF_BLOCK = 2 ** 20  # max number of GMF rows stored/reordered at once
+CSV_BLOCK = 2 ** 26  # number of bytes of a GMF CSV file parsed per task
 
 stats_dt = numpy.dtype([('mean', F32), ('std', F32),
                         ('min', F32), ('max', F32), ('len', U16)])
@@ -114,9 +121,8 @@ def fix_ones(pmap):
     Here we solve the issue by replacing the unphysical probabilities 1
     with .9999999999999999 (the float64 closest to 1).
     """
-    for sid in pmap:
-        array = pmap[sid].array
-        array[array == 1.] = .9999999999999999
+    array = pmap.array
+    array[array == 1.] = .9999999999999999
     return pmap
 
 
@@ -897,13 +903,64 @@ class RiskCalculator(HazardCalculator):
 
         logging.info('Building GMFs')
         with self.monitor('building/saving GMFs'):
-            imts, gmfs = to_gmfs(
-                shakemap, oq.spatial_correlation, oq.cross_correlation,
-                oq.site_effects, oq.truncation_level, E, oq.random_seed,
-                oq.imtls)
-            save_gmf_data(self.datastore, sitecol, gmfs, imts)
+            self.save_shakemap_gmfs(sitecol, shakemap, E)
         return sitecol, assetcol
 
+    def save_shakemap_gmfs(self, sitecol, shakemap, E):
+        """
+        Build the spatial factors of the shakemap in parallel by IMT,
+        then sample the GMFs in parallel by blocks of events, storing
+        them in a temporary file and finally in `gmf_data`, ordered by
+        site. In this way the memory is bounded even for shakemaps with
+        hundreds of thousands of sites. The shakemap is published to the
+        tasks as a shared array and the dense factors are written by the
+        tasks building them directly in shared files, so that they are
+        never sent back to the master nor again for each block of events.
+        """
+        oq = self.oqparam
+        h5 = self.datastore.hdf5
+        imts = get_imts(shakemap, oq.imtls)
+        imts_ = [from_string(im) for im in imts]
+        N, M = len(shakemap), len(imts)
+        nn = oq.ground_motion_correlation_neighbours
+        smap = parallel.Starmap(sample_shakemap_gmfs, h5=h5)
+        shared = smap.share(shakemap=shakemap)
+        if oq.spatial_correlation == 'yes' and not nn and N <= MAX_DENSE_SITES:
+            dirname = os.path.dirname(self.datastore.filename)
+            smap.shared.extend(parallel.Shared.empty((N, N), float, dirname)
+                               for im in imts)  # removed after sampling
+            factors = smap.shared[-M:]
+        else:  # sparse factors, sent back by the tasks
+            factors = [None] * M
+        try:
+            for im, factor in parallel.Starmap(
+                    build_spatial_factor,
+                    [(shakemap['lon'], shakemap['lat'], im,
+                      oq.spatial_correlation, nn, factors[m])
+                     for m, im in enumerate(imts)], h5=h5):
+                if factor is not None:
+                    factors[imts.index(im)] = factor
+        except Exception:  # the sampling will not run
+            for sh in smap.shared:
+                sh.close()
+            raise
+        cross_corr = cross_correlation_matrix(imts_, oq.cross_correlation)
+        ne = max(GMF_BLOCK // N, 1)  # events per block
+        for b, e0 in enumerate(range(0, E, ne)):
+            smap.submit((shared['shakemap'], imts_, factors, cross_corr,
+                         oq.site_effects, oq.truncation_level, e0,
+                         min(e0 + ne, E), oq.random_seed + b))
+        fname = general.gettemp(prefix='gmf_', suffix='.hdf5',
+                                dir=os.path.dirname(self.datastore.filename))
+        try:
+            with hdf5.File(fname, 'w') as tmp:
+                dset = tmp.create_dataset('gmfs', (N, E, M), F32)
+                for e0, gmfs in smap:
+                    dset[:, e0:e0 + gmfs.shape[1]] = gmfs
+                save_gmf_data(self.datastore, sitecol, dset, imts)
+        finally:
+            os.remove(fname)
+
     def build_riskinputs(self, kind):
         """
         :param kind:
@@ -1004,11 +1061,41 @@ class RiskCalculator(HazardCalculator):
         return acc + res
 
 
+def build_spatial_factor(lons, lats, imt, spatialcorr, num_neighbours,
+                         shared, monitor):
+    """
+    :param shared: a Shared instance where to write a dense factor, or None
+    :returns:
+        the IMT string and the spatial factor of the shakemap, or None
+        if the factor was written in the shared file
+    """
+    [factor] = spatial_factors(lons, lats, [from_string(imt)], spatialcorr,
+                               num_neighbours=num_neighbours)
+    if shared is None:
+        return imt, factor
+    shared.set(factor)
+    return imt, None
+
+
+def sample_shakemap_gmfs(shakemap, imts, factors, cross_corr, site_effects,
+                         trunclevel, e0, e1, seed, monitor):
+    """
+    :param shakemap: the shakemap array, shared by the master
+    :param factors: spatial factors, the dense ones shared by the master
+    :returns: the first event index and the GMFs of shape (N, e1 - e0, M)
+    """
+    factors = [f.get() if isinstance(f, parallel.Shared) else f
+               for f in factors]
+    gmfs = sample_gmfs(shakemap.get(), imts, factors, cross_corr,
+                       site_effects, trunclevel, e1 - e0, seed)
+    return e0, gmfs.astype(F32)
+
+
 def save_gmf_data(dstore, sitecol, gmfs, imts, events=()):
     """
     :param dstore: a :class:`openquake.baselib.datastore.DataStore` instance
     :param sitecol: a :class:`openquake.hazardlib.site.SiteCollection` instance
-    :param gmfs: an array of shape (N, E, M)
+    :param gmfs: an array (or dataset) of shape (N, E, M)
     :param imts: a list of IMT strings
     :param events: E event IDs or the empty tuple
     """
@@ -1017,86 +1104,96 @@ def save_gmf_data(dstore, sitecol, gmfs, imts, events=()):
         events = numpy.zeros(E, rupture.events_dt)
         events['id'] = numpy.arange(E, dtype=U32)
     dstore['events'] = events
-    offset = 0
-    # convert an array of shape (N, E, M) into an array of type gmv_data_dt
+    # convert an array of shape (N, E, M) into an array of type gmv_data_dt,
+    # ordered by site, by writing GMF_BLOCK rows at a time
     N, E, M = gmfs.shape
-    lst = [(sitecol.sids[s], ei, gmfs[s, ei])
-           for s in numpy.arange(N, dtype=U32)
-           for ei, event in enumerate(events)]
-    gmfa = numpy.array(lst, dstore['oqparam'].gmf_data_dt())
-    dstore['gmf_data/data'] = gmfa
-    dic = general.group_array(gmfa, 'sid')
-    lst = []
+    dt = dstore['oqparam'].gmf_data_dt()
+    dset = dstore.create_dset('gmf_data/data', dt, (N * E,), fillvalue=None)
+    eids = numpy.arange(E, dtype=U32)
+    nsites = max(GMF_BLOCK // E, 1)
+    for s0 in range(0, N, nsites):
+        s1 = min(s0 + nsites, N)
+        gmfa = numpy.zeros((s1 - s0) * E, dt)
+        gmfa['sid'] = numpy.repeat(sitecol.sids[s0:s1], E)
+        gmfa['eid'] = numpy.tile(eids, s1 - s0)
+        gmfa['gmv'] = gmfs[s0:s1].reshape(-1, M)
+        dset[s0 * E:s1 * E] = gmfa
     all_sids = sitecol.complete.sids
-    for sid in all_sids:
-        rows = dic.get(sid, ())
-        n = len(rows)
-        lst.append((offset, offset + n))
-        offset += n
+    nrows = numpy.zeros(len(all_sids), U32)
+    nrows[numpy.searchsorted(all_sids, sitecol.sids)] = E
+    stops = numpy.cumsum(nrows)
     dstore['gmf_data/imts'] = ' '.join(imts)
-    dstore['gmf_data/indices'] = numpy.array(lst, U32)
+    dstore['gmf_data/indices'] = numpy.array([stops - nrows, stops], U32).T
+
+
+def read_gmfs_csv(fname, start, stop, names, imts, monitor):
+    """
+    :param fname: a CSV file with GMFs
+    :param start: byte offset of the first line to read
+    :param stop: byte offset after the last line to read
+    :param names: the field names in the header of the file
+    :param imts: the IMTs required by the calculation
+    :param monitor: Monitor instance
+    :returns: (start, array of type gmf_data_dt)
+    """
+    with open(fname, 'rb') as f:
+        f.seek(start)
+        data = f.read(stop - start)
+    df = pandas.read_csv(io.BytesIO(data), header=None, names=names,
+                         dtype={'sid': U32, 'eid': U32})
+    arr = numpy.zeros(len(df), [('sid', U32), ('eid', U32),
+                                ('gmv', (F32, (len(imts),)))])
+    arr['sid'] = df['sid']
+    arr['eid'] = df['eid']
+    for m, imt in enumerate(imts):
+        arr['gmv'][:, m] = df['gmv_' + imt]
+    return start, arr
 
 
 def import_gmfs(dstore, fname, sids):
     """
-    Import in the datastore a ground motion field CSV file.
+    Import in the datastore a ground motion field CSV file. The file is
+    split in blocks of CSV_BLOCK bytes which are parsed in parallel.
 
     :param dstore: the datastore
     :param fname: the CSV file
     :param sids: the site IDs (complete)
     :returns: event_ids, num_rlzs
     """
-    array = hdf5.read_csv(fname, {'sid': U32, 'eid': U32, None: F32},
-                          renamedict=dict(site_id='sid', event_id='eid',
-                                          rlz_id='rlzi')).array
-    names = array.dtype.names
-    if names[0] == 'rlzi':  # backward compatbility
-        names = names[1:]  # discard the field rlzi
-    imts = [name[4:] for name in names[2:]]
+    renamedict = dict(site_id='sid', event_id='eid', rlz_id='rlzi')
+    header, slices = hdf5.split_csv(fname, CSV_BLOCK)
+    names = [renamedict.get(name, name) for name in header]
+    imts = [name[4:] for name in names if name.startswith('gmv_')]
     oq = dstore['oqparam']
     missing = set(oq.imtls) - set(imts)
     if missing:
         raise ValueError('The calculation needs %s which is missing from %s' %
                          (', '.join(missing), fname))
-    imt2idx = {imt: i for i, imt in enumerate(oq.imtls)}
-    arr = numpy.zeros(len(array), oq.gmf_data_dt())
-    for name in names:
-        if name.startswith('gmv_'):
-            try:
-                m = imt2idx[name[4:]]
-            except KeyError:  # the file contains more than enough IMTs
-                pass
-            else:
-                arr['gmv'][:, m] = array[name]
-        else:
-            arr[name] = array[name]
-
-    n = len(numpy.unique(array[['sid', 'eid']]))
-    if n != len(array):
+    allargs = [(fname, start, stop, names, list(oq.imtls))
+               for start, stop in slices]
+    # the slices are returned in order of completion
+    arrays = dict(parallel.Starmap(read_gmfs_csv, allargs, h5=dstore.hdf5))
+    if sum(len(array) for array in arrays.values()) == 0:
+        raise InvalidFile('%s: there are no ground motion fields' % fname)
+    arr = numpy.concatenate([arrays[start] for start, _stop in slices])
+    keys = arr['sid'].astype(numpy.uint64) << 32 | arr['eid']
+    if len(numpy.unique(keys)) != len(arr):
         raise ValueError('Duplicated site_id, event_id in %s' % fname)
     # store the events
-    eids = numpy.unique(array['eid'])
-    eids.sort()
+    eids = numpy.unique(arr['eid'])
     if eids[0] != 0:
         raise ValueError('The event_id must start from zero in %s' % fname)
     E = len(eids)
     events = numpy.zeros(E, rupture.events_dt)
     events['id'] = eids
     dstore['events'] = events
-    # store the GMFs
-    dic = general.group_array(arr, 'sid')
-    lst = []
-    offset = 0
-    gmvlst = []
-    for sid in sids:
-        n = len(dic.get(sid, []))
-        lst.append((offset, offset + n))
-        if n:
-            offset += n
-            gmvs = dic[sid]
-            gmvlst.append(gmvs)
-    dstore['gmf_data/data'] = numpy.concatenate(gmvlst)
-    dstore['gmf_data/indices'] = numpy.array(lst, U32)
+    # store the GMFs ordered by site
+    arr = arr[numpy.isin(arr['sid'], sids)]
+    arr = arr[numpy.argsort(arr['sid'], kind='stable')]
+    starts = numpy.searchsorted(arr['sid'], sids)
+    stops = numpy.searchsorted(arr['sid'], sids, 'right')
+    dstore['gmf_data/data'] = arr
+    dstore['gmf_data/indices'] = numpy.array([starts, stops], U32).T
     dstore['gmf_data/imts'] = ' '.join(imts)
     dstore['weights'] = numpy.ones(1)
     return eids
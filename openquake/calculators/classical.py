@@ -24,13 +24,15 @@ from datetime import datetime
 import itertools
 import numpy
 
-from openquake.baselib import parallel, hdf5
-from openquake.baselib.general import AccumDict, block_splitter
+from openquake.baselib import parallel, hdf5, datastore, config
+from openquake.baselib.general import AccumDict, DiskCache, block_splitter
 from openquake.hazardlib import mfd
 from openquake.hazardlib.contexts import ContextMaker
 from openquake.hazardlib.calc.filters import split_sources
-from openquake.hazardlib.calc.hazard_curve import classical
-from openquake.hazardlib.probability_map import ProbabilityMap
+from openquake.hazardlib.calc import hazard_curve
+from openquake.hazardlib.stats import StreamingStats
+from openquake.hazardlib.probability_map import (
+    ProbabilityMap, ProbabilityCurve)
 from openquake.commonlib import calc, util, logs
 from openquake.commonlib.source_reader import random_filtered_sources
 from openquake.calculators import getters
@@ -41,11 +43,57 @@ U32 = numpy.uint32
 F32 = numpy.float32
 F64 = numpy.float64
 MINWEIGHT = 1000
+RLZS_PER_BLOCK = 1000  # used when streaming the realizations
+MB = 1024 ** 2
 weight = operator.attrgetter('weight')
 grp_extreme_dt = numpy.dtype([('grp_id', U16), ('grp_trt', hdf5.vstr),
                              ('extreme_poe', F32)])
 
 
+class PmapCache(DiskCache):
+    """
+    A content-addressed cache of the outputs of the classical tasks, stored
+    in the directory `pmap_cache` next to the calculations. The keys are
+    checksums of the sources, of the GSIMs and of the parameters common to
+    all tasks (site collection, imtls, maximum_distance, truncation_level,
+    ...).
+
+    :param sitecol: the complete site collection
+    :param param: the dictionary of parameters passed to the tasks
+    :param maxsize: maximum size of the cache in bytes
+    """
+    def __init__(self, sitecol, param, maxsize):
+        super().__init__(
+            os.path.join(datastore.get_datadir(), 'pmap_cache'), maxsize)
+        self.checksum = self.get_key(
+            sitecol.array.tobytes(), sorted(param.items()))
+
+    def get_task_key(self, srcs, gsims):
+        """
+        :returns: the key of the cache entry for the given sources
+        """
+        return self.get_key(self.checksum, srcs, gsims)
+
+
+def classical(srcs, srcfilter, gsims, params, monitor):
+    """
+    Call :func:`openquake.hazardlib.calc.hazard_curve.classical`, reusing
+    the output stored in the pmap cache, if enabled and available
+    """
+    cache = params.get('pmap_cache')
+    if cache is None:
+        return hazard_curve.classical(srcs, srcfilter, gsims, params, monitor)
+    key = cache.get_task_key(srcs, gsims)
+    with monitor('reading pmap cache', measuremem=False):
+        res = cache.get(key)
+    if res is None:
+        res = hazard_curve.classical(srcs, srcfilter, gsims, params, monitor)
+        with monitor('saving pmap cache', measuremem=False):
+            cache.put(key, res)
+    res['extra']['task_no'] = getattr(monitor, 'task_no', 0)
+    return res
+
+
 def get_src_ids(sources):
     """
     :returns:
@@ -77,7 +125,8 @@ def classical_split_filter(srcs, srcfilter, gsims, params, monitor):
     """
     Split the given sources, filter the subsources and the compute the
     PoEs. Yield back subtasks if the split sources contain more than
-    maxweight ruptures.
+    maxweight ruptures, or if they would take more than task_duration
+    seconds when that parameter is set.
     """
     # first check if we are sampling the sources
     ss = int(os.environ.get('OQ_SAMPLE_SOURCES', 0))
@@ -94,6 +143,11 @@ def classical_split_filter(srcs, srcfilter, gsims, params, monitor):
     if not sources:
         yield {'pmap': {}}
         return
+    if params.get('task_duration'):  # split on the measured speed
+        yield from parallel.split_task(
+            classical, sources, srcfilter, gsims, params, monitor,
+            duration=params['task_duration'], weight=weight)
+        return
     maxw = min(sum(src.weight for src in sources)/5, params['max_weight'])
     if maxw < MINWEIGHT*5:  # task too small to be resubmitted
         yield classical(sources, srcfilter, gsims, params, monitor)
@@ -182,6 +236,7 @@ class ClassicalCalculator(base.HazardCalculator):
         with self.monitor('aggregate curves'):
             extra = dic['extra']
             self.totrups += extra['totrups']
+            self.avoided += extra.get('avoided', 0)
             d = dic['calc_times']  # srcid -> eff_rups, eff_sites, dt
             self.calc_times += d
             srcids = []
@@ -254,6 +309,7 @@ class ClassicalCalculator(base.HazardCalculator):
             self.datastore.create_dset('rup/' + k, dt)
         self.by_task = {}  # task_no => src_ids
         self.totrups = 0  # total number of ruptures before collapsing
+        self.avoided = 0  # rupture-site distances skipped by the prefilter
         return zd
 
     def execute(self):
@@ -280,7 +336,7 @@ class ClassicalCalculator(base.HazardCalculator):
         smap = parallel.Starmap(
             self.core_task.__func__, h5=self.datastore.hdf5,
             num_cores=oq.num_cores)
-        smap.task_queue = list(self.gen_task_queue())  # really fast
+        smap.task_queue = list(self.gen_task_queue(smap))  # really fast
         acc0 = self.acc0()  # create the rup/ datasets BEFORE swmr_on()
         self.datastore.swmr_on()
         smap.h5 = self.datastore.hdf5
@@ -289,6 +345,11 @@ class ClassicalCalculator(base.HazardCalculator):
             acc = smap.get_results().reduce(self.agg_dicts, acc0)
             self.store_rlz_info(acc.eff_ruptures)
         finally:
+            if hasattr(self, 'pmap_cache'):
+                removed = self.pmap_cache.evict()
+                if removed:
+                    logging.info('Removed %d entries from the pmap cache',
+                                 removed)
             with self.monitor('store source_info'):
                 self.store_source_info(self.calc_times)
             if self.by_task:
@@ -313,12 +374,17 @@ class ClassicalCalculator(base.HazardCalculator):
                      self.numrups, self.totrups)
         logging.info('Effective number of sites per rupture: %d',
                      numsites / self.numrups)
+        if self.avoided:
+            logging.info('Rupture-site distances avoided by the prefilter: '
+                         '%d', self.avoided)
         self.calc_times.clear()  # save a bit of memory
         return acc
 
-    def gen_task_queue(self):
+    def gen_task_queue(self, smap):
         """
         Build a task queue to be attached to the Starmap instance
+
+        :param smap: the Starmap instance where to publish the site array
         """
         oq = self.oqparam
         gsims_by_trt = self.csm_info.get_gsims_by_trt()
@@ -337,8 +403,14 @@ class ClassicalCalculator(base.HazardCalculator):
             maximum_distance=oq.maximum_distance,
             pointsource_distance=oq.pointsource_distance,
             shift_hypo=oq.shift_hypo, max_weight=oq.max_weight,
-            max_sites_disagg=oq.max_sites_disagg)
-        srcfilter = self.src_filter(self.datastore.tempname)
+            max_sites_disagg=oq.max_sites_disagg,
+            truncnorm_table=oq.truncnorm_table,
+            task_duration=oq.task_duration)
+        srcfilter = self.src_filter(self.datastore.tempname).share(smap)
+        if oq.pmap_cache and oq.calculation_mode != 'preclassical':
+            maxsize = int(config.directory.get('pmap_cache_mb', 1000)) * MB
+            param['pmap_cache'] = self.pmap_cache = PmapCache(
+                self.sitecol.complete, param, maxsize)
         if oq.calculation_mode == 'preclassical':
             f1 = f2 = preclassical
         else:
@@ -388,13 +460,13 @@ class ClassicalCalculator(base.HazardCalculator):
                     # pmaps is a list of R pmaps
                     dset = self.datastore.getitem(kind)
                     for r, pmap in enumerate(pmaps):
-                        for s in pmap:
-                            dset[s, r] = pmap[s].array  # shape (M, P)
+                        if pmap:
+                            dset[pmap.sids, r] = pmap.array  # shape (M, P)
                 elif kind in ('hcurves-rlzs', 'hcurves-stats'):
                     dset = self.datastore.getitem(kind)
                     for r, pmap in enumerate(pmaps):
-                        for s in pmap:
-                            dset[s, r] = pmap[s].array[:, 0]  # shape L
+                        if pmap:
+                            dset[pmap.sids, r] = pmap.array[:, :, 0]
             self.datastore.flush()
 
     def post_execute(self, pmap_by_grp_id):
@@ -415,9 +487,8 @@ class ClassicalCalculator(base.HazardCalculator):
                     key = 'poes/grp-%02d' % grp_id
                     self.datastore[key] = pmap
                     self.datastore.set_attrs(key, trt=trt)
-                    extreme = max(
-                        get_extreme_poe(pmap[sid].array, oq.imtls)
-                        for sid in pmap)
+                    extreme = get_extreme_poe(
+                        pmap.array.max(axis=0), oq.imtls)
                     data.append((grp_id, trt_by_grp[grp_id], extreme))
         if oq.hazard_calculation_id is None and 'poes' in self.datastore:
             self.datastore['disagg_by_grp'] = numpy.array(
@@ -451,7 +522,7 @@ class ClassicalCalculator(base.HazardCalculator):
         allargs = [  # this list is very fast to generate
             (getters.PmapGetter(self.datastore, weights, t.sids, oq.poes),
              N, hstats, oq.individual_curves, oq.max_sites_disagg,
-             self.amplifier)
+             self.amplifier, oq.quantile_error)
             for t in self.sitecol.split_in_tiles(ct)]
         if N <= oq.max_sites_disagg:  # few sites
             dist = 'no'
@@ -472,8 +543,35 @@ class PreCalculator(ClassicalCalculator):
     core_task = preclassical
 
 
+def get_level_weights(weights, imtls, num_amplevels=0):
+    """
+    :param weights: a list of R IMT-dependent weights
+    :param imtls: DictArray imt -> levels
+    :param num_amplevels: the number of levels per IMT of amplified curves
+    :returns: an array of shape (R, L) with the weight of each level
+
+    >>> from openquake.baselib.general import DictArray
+    >>> imtls = DictArray({'PGA': [.1, .2], 'SA(1.0)': [.1, .2, .3]})
+    >>> ws = [{'PGA': .6, 'SA(1.0)': .5}, {'PGA': .4, 'SA(1.0)': .5}]
+    >>> get_level_weights(ws, imtls)
+    array([[0.6, 0.6, 0.5, 0.5, 0.5],
+           [0.4, 0.4, 0.5, 0.5, 0.5]])
+    >>> get_level_weights(ws, imtls, num_amplevels=1)
+    array([[0.6, 0.5],
+           [0.4, 0.5]])
+    """
+    A = num_amplevels
+    L = len(imtls.array) if A == 0 else A * len(imtls)
+    ws = numpy.zeros((len(weights), L))
+    for m, imt in enumerate(imtls):
+        # the amplified curves have A levels per IMT, in the order of imtls
+        slc = imtls(imt) if A == 0 else slice(m * A, (m + 1) * A)
+        ws[:, slc] = [[w[imt]] for w in weights]
+    return ws
+
+
 def build_hazard(pgetter, N, hstats, individual_curves,
-                 max_sites_disagg, amplifier, monitor):
+                 max_sites_disagg, amplifier, quantile_error, monitor):
     """
     :param pgetter: an :class:`openquake.commonlib.getters.PmapGetter`
     :param N: the total number of sites
@@ -481,11 +579,15 @@ def build_hazard(pgetter, N, hstats, individual_curves,
     :param individual_curves: if True, also build the individual curves
     :param max_sites_disagg: if there are less sites than this, store rup info
     :param amplifier: instance of Amplifier or None
+    :param quantile_error: if nonzero, relative accuracy of the quantiles
     :param monitor: instance of Monitor
     :returns: a dictionary kind -> ProbabilityMap
 
     The "kind" is a string of the form 'rlz-XXX' or 'mean' of 'quantile-XXX'
-    used to specify the kind of output.
+    used to specify the kind of output. If `quantile_error` is nonzero and
+    the individual curves are not required the realizations are consumed
+    in blocks of RLZS_PER_BLOCK and the quantiles are estimated with a
+    :class:`openquake.hazardlib.stats.QuantileSketch`.
     """
     with monitor('read PoEs'):
         pgetter.init()
@@ -502,9 +604,40 @@ def build_hazard(pgetter, N, hstats, individual_curves,
     if hstats:
         pmap_by_kind['hcurves-stats'] = [ProbabilityMap(L) for r in range(S)]
         if poes:
-            pmap_by_kind['hmaps-stats'] = [ProbabilityMap(L) for r in range(S)]
+            pmap_by_kind['hmaps-stats'] = [
+                ProbabilityMap(M, len(poes)) for r in range(S)]
     combine_mon = monitor('combine pmaps', measuremem=False)
     compute_mon = monitor('compute stats', measuremem=False)
+    if hstats and quantile_error and not (R > 1 and individual_curves):
+        if isinstance(weights, list):  # IMT-dependent weights
+            ws = get_level_weights(weights, imtls, amplifier and len(
+                amplifier.amplevels) or 0)
+        else:
+            ws = weights
+        for sid in pgetter.sids:
+            with compute_mon:
+                streaming = StreamingStats(
+                    list(hstats), (L,), quantile_error)
+                start = 0
+                for block in pgetter.gen_pcurves(sid, RLZS_PER_BLOCK):
+                    if amplifier:
+                        block = numpy.array([pc.array[:, 0] for pc in (
+                            amplifier.amplify(ampcode[sid], [
+                                ProbabilityCurve(a.reshape(-1, 1))
+                                for a in block]))])
+                    stop = start + len(block)
+                    streaming.update(block, ws[start:stop])
+                    start = stop
+            if (streaming.max <= 0).all():  # no data
+                continue
+            with compute_mon:
+                for s, arr in enumerate(streaming.result()):
+                    pc = ProbabilityCurve(arr.reshape(L, 1))
+                    pmap_by_kind['hcurves-stats'][s][sid] = pc
+                    if poes:
+                        hmap = calc.make_hmap(pc, pgetter.imtls, poes, sid)
+                        pmap_by_kind['hmaps-stats'][s].update(hmap)
+        return pmap_by_kind
     for sid in pgetter.sids:
         with combine_mon:
             pcurves = pgetter.get_pcurves(sid)
@@ -37,9 +37,12 @@ from openquake.commonlib import util
 from openquake.calculators import getters
 from openquake.calculators import base
 
+U32 = numpy.uint32
+F64 = numpy.float64
 weight = operator.attrgetter('weight')
 DISAGG_RES_FMT = 'rlz-%(rlz)s-%(imt)s-%(sid)s-%(poe)s/'
 BIN_NAMES = 'mag', 'dist', 'lon', 'lat', 'eps', 'trt'
+SITES_PER_TASK = 10  # max number of sites disaggregated by a single task
 POE_TOO_BIG = '''\
 Site #%d: you are trying to disaggregate for poe=%s.
 However the source model produces at most probabilities
@@ -62,13 +65,26 @@ def _check_curves(sid, rlzs, curves, imtls, poes_disagg):
     return bool(bad)
 
 
-def _trt_matrix(matrices, num_trts):
-    # convert a dict trti -> matrix into a single matrix of shape (T, ...)
-    trti = next(iter(matrices))
-    mat = numpy.zeros((num_trts,) + matrices[trti].shape)
-    for trti in matrices:
-        mat[trti] = matrices[trti]
-    return mat
+def _trt_coo(coos):
+    # convert a dict trti -> (coords, pnes) into a single pair with
+    # coords (trti, mag, dist, lon, lat, z)
+    coords = numpy.concatenate([
+        numpy.concatenate([numpy.full((len(c), 1), trti), c], 1)
+        for trti, (c, _) in sorted(coos.items())])
+    pnes = numpy.concatenate([p for _, (_, p) in sorted(coos.items())])
+    return coords, pnes
+
+
+def _sparse_pmf(pmf, label):
+    # convert a PMF into an array with the indices of the nonzero bins,
+    # one field per dimension, and the corresponding probabilities
+    idxs = pmf.nonzero()
+    dt = [(name, U32) for name in label.lower().split('_')] + [('poe', F64)]
+    arr = numpy.zeros(len(idxs[0]), dt)
+    for name, idx in zip(arr.dtype.names, idxs):
+        arr[name] = idx
+    arr['poe'] = pmf[idxs]
+    return arr
 
 
 def _iml4(rlzs, iml_disagg, imtls, poes_disagg, curves):
@@ -92,7 +108,7 @@ def _iml4(rlzs, iml_disagg, imtls, poes_disagg, curves):
         iml4, dict(imts=[from_string(imt) for imt in imtls], rlzs=rlzs))
 
 
-def compute_disagg(dstore, idxs, cmaker, iml4, trti, bin_edges,
+def compute_disagg(dstore, idxs, cmaker, iml4, trti, bin_edges, sids,
                    monitor):
     # see https://bugs.launchpad.net/oq-engine/+bug/1279247 for an explanation
     # of the algorithm used
@@ -111,10 +127,12 @@ def compute_disagg(dstore, idxs, cmaker, iml4, trti, bin_edges,
         tectonic region type index
     :param bin_egdes:
         a quintet (mag_edges, dist_edges, lon_edges, lat_edges, eps_edges)
+    :param sids:
+        the IDs of the sites to disaggregate
     :param monitor:
         monitor of the currently running job
     :returns:
-        a dictionary sid -> 8D-array
+        a dictionary sid -> (coords, pnes) with the nonzero bins
     """
     dstore.open('r')
     oq = dstore['oqparam']
@@ -125,20 +143,10 @@ def compute_disagg(dstore, idxs, cmaker, iml4, trti, bin_edges,
     pne_mon = monitor('disaggregate_pne', measuremem=False)
     mat_mon = monitor('build_disagg_matrix', measuremem=True)
     gmf_mon = monitor('computing mean_std', measuremem=False)
-    for sid, mat in disagg.build_matrices(
-            rupdata, sitecol, cmaker, iml4, oq.num_epsilon_bins,
+    for sid, coo in disagg.build_matrices(
+            rupdata, sitecol, cmaker, iml4, sids, oq.num_epsilon_bins,
             bin_edges, pne_mon, mat_mon, gmf_mon):
-        yield {'trti': trti, sid: mat}
-
-
-def agg_probs(*probs):
-    """
-    Aggregate probabilities withe the usual formula 1 - (1 - P1) ... (1 - Pn)
-    """
-    acc = 1. - probs[0]
-    for prob in probs[1:]:
-        acc *= 1. - prob
-    return 1. - acc
+        yield {'trti': trti, sid: coo}
 
 
 def get_indices(dstore, concurrent_tasks):
@@ -315,10 +323,14 @@ class DisaggregationCalculator(base.HazardCalculator):
                     for m, imt in enumerate(oq.imtls):
                         self.imldict[s, rlz, poe, imt] = self.iml4[s, m, p, z]
 
-        # submit #groups disaggregation tasks
+        # submit disaggregation tasks by blocks of ruptures and sites,
+        # so that the memory used by each task scales with the sites
         dstore = (self.datastore.parent if self.datastore.parent
                   else self.datastore)
-        indices = get_indices(dstore, oq.concurrent_tasks or 1)
+        site_blocks = [numpy.array(sids) for sids in block_splitter(
+            self.sitecol.sids, SITES_PER_TASK)]
+        indices = get_indices(
+            dstore, max((oq.concurrent_tasks or 1) // len(site_blocks), 1))
         self.datastore.swmr_on()
         smap = parallel.Starmap(compute_disagg, h5=self.datastore.hdf5)
         for grp_id, trt in self.csm_info.trt_by_grp.items():
@@ -328,24 +340,30 @@ class DisaggregationCalculator(base.HazardCalculator):
                 trt, self.csm_info.get_rlzs_by_gsim(grp_id),
                 {'truncation_level': oq.truncation_level,
                  'maximum_distance': src_filter.integration_distance,
-                 'filter_distance': oq.filter_distance, 'imtls': oq.imtls})
+                 'filter_distance': oq.filter_distance, 'imtls': oq.imtls,
+                 'truncnorm_table': oq.truncnorm_table})
             for idxs in indices[grp_id]:
-                smap.submit((dstore, idxs, cmaker, self.iml4, trti,
-                             self.bin_edges))
+                for sids in site_blocks:
+                    smap.submit((dstore, idxs, cmaker, self.iml4, trti,
+                                 self.bin_edges, sids))
         results = smap.reduce(self.agg_result, AccumDict(accum={}))
-        return results  # sid -> trti-> 8D array
+        return results  # sid -> trti-> (coords, pnes)
 
     def agg_result(self, acc, result):
         """
         Collect the results coming from compute_disagg into self.results.
 
-        :param acc: dictionary sid -> trti -> 8D array
+        :param acc: dictionary sid -> trti -> (coords, pnes)
         :param result: dictionary with the result coming from a task
         """
         with self.monitor('aggregating disagg matrices'):
             trti = result.pop('trti')
-            for sid, arr in result.items():
-                acc[sid][trti] = agg_probs(acc[sid].get(trti, 0), arr)
+            for sid, (coords, pnes) in result.items():
+                if trti in acc[sid]:
+                    coords0, pnes0 = acc[sid][trti]
+                    coords = numpy.concatenate([coords0, coords])
+                    pnes = numpy.concatenate([pnes0, pnes])
+                acc[sid][trti] = disagg.reduce_coo(coords, pnes)
         return acc
 
     def save_bin_edges(self):
@@ -379,11 +397,11 @@ class DisaggregationCalculator(base.HazardCalculator):
         to save is #sites * #rlzs * #disagg_poes * #IMTs.
 
         :param results:
-            a dictionary sid -> trti -> disagg matrix
+            a dictionary sid -> trti -> (coords, pnes)
         """
-        T = len(self.trts)
-        # build a dictionary sid -> 9D matrix of shape (T, ..., E, M, P)
-        results = {sid: _trt_matrix(dic, T) for sid, dic in results.items()}
+        # build a dictionary sid -> (coords, pnes) with coords
+        # (trti, mag, dist, lon, lat, z) and pnes of shape (K, E, M, P)
+        results = {sid: _trt_coo(dic) for sid, dic in results.items()}
 
         # get the number of outputs
         shp = (self.N, len(self.poes_disagg), len(self.imts), self.Z)
@@ -396,26 +414,29 @@ class DisaggregationCalculator(base.HazardCalculator):
         Save the computed PMFs in the datastore
 
         :param results:
-            an 8D-matrix of shape (T, .., E, M, P)
+            a dictionary sid -> (coords, pnes) with the nonzero bins of
+            the matrices of shape (T, Ma, D, Lo, La, E, M, P, Z)
         :param attrs:
             dictionary of attributes to add to the dataset
         """
-        for sid, mat9 in results.items():
+        T = len(self.trts)
+        for sid, (coords, pnes) in results.items():
             rlzs = self.rlzs[sid]
-            for m, imt in enumerate(self.imts):
-                # NB: here is how to compute the stats:
-                # weights = numpy.array([self.ws[r][imt] for r in rlzs]
-                # weights /= weights.sum()  # normalize to 1
-                # mean = numpy.average(mat7, -1, weights)
-                for p, poe in enumerate(self.poes_disagg):
-                    mat7 = mat9[..., m, p, :]
-                    for z in range(self.Z):
-                        mat6 = mat7[..., z]
-                        if mat6.any():  # nonzero
-                            self._save('disagg', sid, rlzs[z], poe, imt, mat6)
+            bins = disagg.get_bins(self.bin_edges, sid)
+            shape = [T] + [len(b) - 1 for b in bins]
+            for z in range(self.Z):
+                ok = coords[:, 5] == z
+                coords5, pnes4 = coords[ok, :5], pnes[ok]
+                for m, imt in enumerate(self.imts):
+                    for p, poe in enumerate(self.poes_disagg):
+                        pnes2 = pnes4[:, :, m, p]
+                        if (pnes2 < 1).any():  # nonzero
+                            self._save('disagg', sid, rlzs[z], poe, imt,
+                                       coords5, pnes2, shape)
         self.datastore.set_attrs('disagg', **attrs)
 
-    def _save(self, dskey, site_id, rlz_id, poe, imt_str, matrix6):
+    def _save(self, dskey, site_id, rlz_id, poe, imt_str,
+              coords, pnes, shape):
         disagg_outputs = self.oqparam.disagg_outputs
         lon = self.sitecol.lons[site_id]
         lat = self.sitecol.lats[site_id]
@@ -426,11 +447,12 @@ class DisaggregationCalculator(base.HazardCalculator):
         lons, lats = lonsd[site_id], latsd[site_id]
         with self.monitor('extracting PMFs'):
             poe_agg = []
-            aggmatrix = agg_probs(*matrix6)
-            for key, fn in disagg.pmf_map.items():
+            for key, axes in disagg.pmf_axes.items():
                 if not disagg_outputs or key in disagg_outputs:
-                    pmf = fn(matrix6 if key.endswith('TRT') else aggmatrix)
-                    self.datastore[disp_name + key] = pmf
+                    pmf = disagg.coo_pmf(coords, pnes, shape, axes)
+                    self.datastore[disp_name + key] = _sparse_pmf(pmf, key)
+                    self.datastore.set_attrs(disp_name + key,
+                                             shape=pmf.shape)
                     poe_agg.append(1. - numpy.prod(1. - pmf))
 
         attrs = self.datastore.hdf5[disp_name].attrs
@@ -45,6 +45,18 @@ gmf_info_dt = numpy.dtype([('rup_id', U32), ('task_no', U16),
                            ('nsites', U16), ('gmfbytes', F32), ('dt', F32)])
 
 
+def get_slices(values):
+    """
+    :param values: a sorted array of integers
+    :yields: triples (value, start, stop) for each distinct value
+    """
+    if len(values) == 0:
+        return
+    uniq, starts = numpy.unique(values, return_index=True)
+    stops = numpy.append(starts[1:], len(values))
+    yield from zip(uniq, starts, stops)
+
+
 def calc_risk(gmfs, param, monitor):
     """
     :param gmfs: an array of GMFs with fields sid, eid, gmv
@@ -57,24 +69,27 @@ def calc_risk(gmfs, param, monitor):
     eids = numpy.unique(gmfs['eid'])
     dstore = datastore.read(param['hdf5path'])
     with monitor('getting assets'):
-        assets_df = dstore.read_df('assetcol/array', 'ordinal')
+        # the assets are published by the master as a shared array,
+        # already sorted by site_id
+        assets = param['assetcol'].get()
     with monitor('getting crmodel'):
         crmodel = riskmodels.CompositeRiskModel.read(dstore)
-        events = dstore['events'][list(eids)]
-        weights = dstore['weights'][()]
+        events = param['events'].get()[eids]
+        weights = param['weights']
     E = len(eids)
     L = len(param['lba'].loss_names)
     elt_dt = [('event_id', U32), ('rlzi', U16), ('loss', (F32, (L,)))]
-    # aggkey -> eid -> loss
     acc = dict(events_per_sid=0, numlosses=numpy.zeros(2, int))  # (kept, tot)
     lba = param['lba']
-    lba.alt = general.AccumDict(
-        accum=general.AccumDict(accum=numpy.zeros(L, F32)))
+    lba.alt = []  # triples (keys, lni, losses)
     lba.losses_by_E = numpy.zeros((E, L), F32)
     tempname = param['tempname']
-    eid2rlz = dict(events[['id', 'rlz_id']])
-    eid2idx = {eid: idx for idx, eid in enumerate(eids)}
     aggby = param['aggregate_by']
+    if aggby:  # aggregation keys and key index for each asset
+        tagidxs = param['tagidxs']
+        kidxs = param['kidxs'].get()
+    else:
+        kidxs = None
 
     minimum_loss = []
     for lt, lti in crmodel.lti.items():
@@ -83,35 +98,47 @@ def calc_risk(gmfs, param, monitor):
         if lt in lba.policy_dict:  # same order as in lba.compute
             minimum_loss.append(val)
 
-    haz_by_sid = general.group_array(gmfs, 'sid')
-    for sid, asset_df in assets_df.groupby('site_id'):
+    # sorting by site and event allows to work on contiguous slices
+    gmfs.sort(order=['sid', 'eid'])
+    asset_slices = {sid: (start, stop) for sid, start, stop in get_slices(
+        assets['site_id'])}
+    for sid, start, stop in get_slices(gmfs['sid']):
         try:
-            haz = haz_by_sid[sid]
-        except KeyError:  # no hazard here
+            a0, a1 = asset_slices[sid]
+        except KeyError:  # no assets here
             continue
+        haz = gmfs[start:stop]  # sorted by eid
         with mon_risk:
-            assets = asset_df.to_records()  # fast
             acc['events_per_sid'] += len(haz)
+            eidx = numpy.searchsorted(eids, haz['eid'])
             if param['avg_losses']:
-                ws = weights[[eid2rlz[eid] for eid in haz['eid']]]
+                ws = weights[events['rlz_id'][eidx]]
             else:
                 ws = None
-            assets_by_taxo = get_assets_by_taxo(assets, tempname)  # fast
-            eidx = numpy.array([eid2idx[eid] for eid in haz['eid']])  # fast
+            assets_by_taxo = get_assets_by_taxo(
+                assets[a0:a1], tempname)  # fast
             out = get_output(crmodel, assets_by_taxo, haz)  # slow
         with mon_agg:
-            tagidxs = assets[aggby] if aggby else None
             acc['numlosses'] += lba.aggregate(
-                out, eidx, minimum_loss, tagidxs, ws)
+                out, eidx, minimum_loss,
+                None if kidxs is None else kidxs[a0:a1], ws)
     if len(gmfs):
         acc['events_per_sid'] /= len(gmfs)
-    acc['elt'] = numpy.fromiter(  # this is ultra-fast
-        ((event['id'], event['rlz_id'], losses)
-         for event, losses in zip(events, lba.losses_by_E) if losses.sum()),
-        elt_dt)
-    acc['alt'] = {idx: numpy.fromiter(  # already sorted by aid, ultra-fast
-        ((eid, eid2rlz[eid], loss) for eid, loss in lba.alt[idx].items()),
-        elt_dt) for idx in lba.alt}
+    ok = lba.losses_by_E.sum(axis=1) != 0
+    acc['elt'] = elt = numpy.zeros(ok.sum(), elt_dt)
+    elt['event_id'] = events['id'][ok]
+    elt['rlzi'] = events['rlz_id'][ok]
+    elt['loss'] = lba.losses_by_E[ok]
+    acc['alt'] = {}
+    keys, losses = lba.get_alt()
+    kidx, eidx = numpy.divmod(keys, E)
+    for k, start, stop in get_slices(kidx):  # sorted by event
+        idx = ','.join(map(str, tagidxs[k]))
+        acc['alt'][idx] = alt = numpy.zeros(stop - start, elt_dt)
+        alt['event_id'] = events['id'][eidx[start:stop]]
+        alt['rlzi'] = events['rlz_id'][eidx[start:stop]]
+        alt['loss'] = losses[start:stop]
+    lba.alt = None
     if param['avg_losses']:
         acc['losses_by_A'] = param['lba'].losses_by_A * param['ses_ratio']
         # without resetting the cache the sequential avg_losses would be wrong!
@@ -231,6 +258,16 @@ class EbriskCalculator(event_based.EventBasedCalculator):
         self.indices = general.AccumDict(accum=[])  # rlzi -> [(start, stop)]
         smap = parallel.Starmap(
             self.core_task.__func__, h5=self.datastore.hdf5)
+        assets = self.datastore['assetcol/array'][()]
+        assets = assets[numpy.argsort(assets['site_id'], kind='stable')]
+        self.param.update(smap.share(
+            assetcol=assets, events=self.datastore['events'][()]))
+        if oq.aggregate_by:
+            # the aggregation keys are computed once, not in every task
+            self.param['tagidxs'], kidxs = numpy.unique(
+                assets[oq.aggregate_by], return_inverse=True)
+            self.param.update(smap.share(kidxs=kidxs))
+        self.param['weights'] = self.datastore['weights'][()]
         for rgetter in getters.gen_rupture_getters(self.datastore, srcfilter):
             smap.submit((rgetter, srcfilter, self.param))
         smap.reduce(self.agg_dicts)
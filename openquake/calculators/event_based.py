@@ -22,7 +22,8 @@ import operator
 import numpy
 
 from openquake.baselib import hdf5
-from openquake.baselib.general import AccumDict, get_indices, block_splitter
+from openquake.baselib.general import (
+    AccumDict, get_indices, block_splitter, gettemp)
 from openquake.hazardlib.probability_map import ProbabilityMap
 from openquake.hazardlib.stats import compute_pmap_stats
 from openquake.hazardlib.calc.stochastic import sample_ruptures
@@ -68,6 +69,27 @@ def compute_gmfs(rupgetter, srcfilter, param, monitor):
     return getter.compute_gmfs_curves(param.get('rlz_by_event'), monitor)
 
 
+def split_gmf_reads(slices, nrows, max_rows):
+    """
+    :param slices: a dictionary site ID -> list of (start, stop) pairs
+    :param nrows: an array with the number of rows of each site
+    :param max_rows: maximum number of rows in a block of sites
+    :yields: for each block of contiguous sites, a list of (start, stop)
+             pairs, with the adjacent slices merged; the sites without
+             rows are skipped
+    """
+    sids, = numpy.where(nrows)
+    for block in block_splitter(sids, max_rows, nrows.__getitem__):
+        rows = sorted(s for sid in block for s in slices[sid])
+        merged = [list(rows[0])]
+        for start, stop in rows[1:]:
+            if start == merged[-1][1]:  # adjacent slices
+                merged[-1][1] = stop
+            else:
+                merged.append([start, stop])
+        yield merged
+
+
 @base.calculators.add('event_based')
 class EventBasedCalculator(base.HazardCalculator):
     """
@@ -199,7 +221,7 @@ class EventBasedCalculator(base.HazardCalculator):
                 times = result.pop('times')
                 rupids = list(times['rup_id'])
                 self.datastore['gmf_data/time_by_rup'][rupids] = times
-                hdf5.extend(self.datastore['gmf_data/data'], data)
+                hdf5.extend(self.gmf_tmp['data'], data)
                 sig_eps = result.pop('sig_eps')
                 hdf5.extend(self.datastore['gmf_data/sigma_epsilon'], sig_eps)
                 for sid, start, stop in result['indices']:
@@ -329,47 +351,74 @@ class EventBasedCalculator(base.HazardCalculator):
         N = len(self.sitecol.complete)
         if oq.ground_motion_fields:
             nrups = len(self.datastore['ruptures'])
-            self.datastore.create_dset('gmf_data/data', oq.gmf_data_dt())
+            self.datastore.create_dset(
+                'gmf_data/data', oq.gmf_data_dt(), compression='lzf')
             self.datastore.create_dset('gmf_data/sigma_epsilon',
                                        sig_eps_dt(oq.imtls))
-            self.datastore.create_dset(
-                'gmf_data/indices', hdf5.vuint32, shape=(N, 2), fillvalue=None)
+            self.datastore.create_dset('gmf_data/indices', U32, (N, 2))
             self.datastore.create_dset('gmf_data/events_by_sid', U32, (N,))
             self.datastore.create_dset('gmf_data/time_by_rup',
                                        time_dt, (nrups,), fillvalue=None)
         if oq.hazard_curves_from_gmfs:
             self.param['rlz_by_event'] = self.datastore['events']['rlz_id']
 
-        # compute_gmfs in parallel
+        # compute_gmfs in parallel; the GMFs are stored in the order they
+        # arrive in a temporary file and reordered by site at the end
+        gmf_tmp = gettemp(prefix='gmf_', suffix='.hdf5',
+                          dir=os.path.dirname(self.datastore.filename))
+        self.gmf_tmp = hdf5.File(gmf_tmp, 'w')
+        hdf5.create(self.gmf_tmp, 'data', oq.gmf_data_dt())
         self.datastore.swmr_on()
         logging.info('Reading %d ruptures', len(self.datastore['ruptures']))
         iterargs = ((rgetter, srcfilter, self.param)
                     for rgetter in gen_rupture_getters(
                             self.datastore, srcfilter))
-        acc = parallel.Starmap(
-            self.core_task.__func__, iterargs, h5=self.datastore.hdf5,
-            num_cores=oq.num_cores
-        ).reduce(self.agg_dicts, self.acc0())
-
+        try:
+            acc = parallel.Starmap(
+                self.core_task.__func__, iterargs, h5=self.datastore.hdf5,
+                num_cores=oq.num_cores
+            ).reduce(self.agg_dicts, self.acc0())
+            if self.indices:
+                logging.info('Saving gmf_data ordered by site')
+                with self.monitor('saving gmf_data/indices', measuremem=True):
+                    self.datastore['gmf_data/imts'] = ' '.join(oq.imtls)
+                    self.store_gmf_data()
+        finally:
+            self.gmf_tmp.close()
+            os.remove(gmf_tmp)
         if self.indices:
-            dset = self.datastore['gmf_data/indices']
-            num_evs = self.datastore['gmf_data/events_by_sid']
-            logging.info('Saving gmf_data/indices')
-            with self.monitor('saving gmf_data/indices', measuremem=True):
-                self.datastore['gmf_data/imts'] = ' '.join(oq.imtls)
-                for sid in self.sitecol.complete.sids:
-                    start = numpy.array(self.indices[sid, 0])
-                    stop = numpy.array(self.indices[sid, 1])
-                    dset[sid, 0] = start
-                    dset[sid, 1] = stop
-                    num_evs[sid] = (stop - start).sum()
-            avg_events_by_sid = num_evs[()].sum() / N
-            logging.info('Found ~%d GMVs per site', avg_events_by_sid)
+            num_evs = self.datastore['gmf_data/events_by_sid'][()]
+            logging.info('Found ~%d GMVs per site', num_evs.sum() / N)
         elif oq.ground_motion_fields:
             raise RuntimeError('No GMFs were generated, perhaps they were '
                                'all below the minimum_intensity threshold')
         return acc
 
+    def store_gmf_data(self):
+        """
+        Copy the GMFs from the temporary file into `gmf_data/data`,
+        ordered by site ID, so that the GMVs of a site (or of a range of
+        sites) can be read with a single slice. The copy is performed on
+        blocks of contiguous sites with less than base.GMF_BLOCK rows; for
+        each block the slices coming from the same task are adjacent, so
+        the number of reads is of the order of the number of tasks.
+        """
+        data = self.gmf_tmp['data']
+        dset = self.datastore['gmf_data/data']
+        N = len(self.sitecol.complete)
+        slices = {sid: list(zip(self.indices[sid, 0], self.indices[sid, 1]))
+                  for sid in range(N)}
+        nrows = numpy.array([sum(stop - start for start, stop in slices[sid])
+                             for sid in range(N)], U32)
+        self.datastore['gmf_data/events_by_sid'][:] = nrows
+        stops = numpy.cumsum(nrows)
+        self.datastore['gmf_data/indices'][:] = numpy.array(
+            [stops - nrows, stops], U32).T
+        for reads in split_gmf_reads(slices, nrows, base.GMF_BLOCK):
+            arr = numpy.concatenate([data[start:stop]
+                                     for start, stop in reads])
+            hdf5.extend(dset, arr[numpy.argsort(arr['sid'], kind='stable')])
+
     def post_execute(self, result):
         oq = self.oqparam
         if not oq.ground_motion_fields and not oq.hazard_curves_from_gmfs:
@@ -406,13 +455,11 @@ class EventBasedCalculator(base.HazardCalculator):
                         'hmaps-rlzs', nbytes=N * R * P * M * 4)
                 for r, pmap in enumerate(pmaps):
                     arr = numpy.zeros((N, L), F32)
-                    for sid in pmap:
-                        arr[sid] = pmap[sid].array[:, 0]
+                    arr[pmap.sids] = pmap.array[:, :, 0]
                     self.datastore['hcurves-rlzs'][:, r] = arr
-                    if oq.poes:
+                    if oq.poes and pmap:
                         hmap = calc.make_hmap(pmap, oq.imtls, oq.poes)
-                        for sid in hmap:
-                            ds[sid, r] = hmap[sid].array
+                        ds[hmap.sids, r] = hmap.array
 
             if S:
                 logging.info('Computing statistical hazard curves')
@@ -429,13 +476,11 @@ class EventBasedCalculator(base.HazardCalculator):
                     pmap = compute_pmap_stats(
                         pmaps, [hstats[stat]], weights, oq.imtls)
                     arr = numpy.zeros((N, L), F32)
-                    for sid in pmap:
-                        arr[sid] = pmap[sid].array[:, 0]
+                    arr[pmap.sids] = pmap.array[:, :, 0]
                     self.datastore['hcurves-stats'][:, s] = arr
-                    if oq.poes:
+                    if oq.poes and pmap:
                         hmap = calc.make_hmap(pmap, oq.imtls, oq.poes)
-                        for sid in hmap:
-                            ds[sid, s] = hmap[sid].array
+                        ds[hmap.sids, s] = hmap.array
 
         if self.datastore.parent:
             self.datastore.parent.open('r')
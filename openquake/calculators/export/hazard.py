@@ -28,7 +28,8 @@ from openquake.baselib.general import (
 from openquake.hazardlib.imt import from_string
 from openquake.hazardlib.calc import disagg
 from openquake.calculators.views import view
-from openquake.calculators.extract import extract, get_mesh, get_info
+from openquake.calculators.extract import (
+    extract, get_mesh, get_info, disagg_pmf)
 from openquake.calculators.export import export
 from openquake.calculators.getters import gen_rgetters
 from openquake.commonlib import writers, hazard_writers, calc, util
@@ -503,7 +504,8 @@ def export_disagg_xml(ekey, dstore):
             tectonic_region_types=trts)
         data = []
         for poe, k in zip(poe_agg, oq.disagg_outputs or disagg.pmf_map):
-            data.append(DisaggMatrix(poe, iml, k.split('_'), matrix[k]))
+            data.append(DisaggMatrix(poe, iml, k.split('_'),
+                                     disagg_pmf(matrix[k])))
         writer.serialize(data)
         fnames.append(fname)
     return sorted(fnames)
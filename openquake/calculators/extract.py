@@ -1110,6 +1110,20 @@ def disagg_outputs(dstore, imt, sid, poe_id, rlz=None):
     return outs
 
 
+def disagg_pmf(dset):
+    """
+    :param dset: a disaggregation PMF stored as an array of nonzero bins
+                 or as a dense array (datastores of older versions)
+    :returns: the corresponding dense PMF
+    """
+    arr = dset[()]
+    if arr.dtype.names is None:  # already dense
+        return arr
+    pmf = numpy.zeros(dset.attrs['shape'])
+    pmf[tuple(arr[name] for name in arr.dtype.names[:-1])] = arr['poe']
+    return pmf
+
+
 @extract.add('disagg')
 def extract_disagg(dstore, what):
     """
@@ -1127,7 +1141,7 @@ def extract_disagg(dstore, what):
     allnames = []
     allvalues = []
     for dset in disagg_outputs(dstore, imt, sid, poe_idx, rlz):
-        matrix = dset[label][()]
+        matrix = disagg_pmf(dset[label])
 
         # adapted from the nrml_converters
         disag_tup = tuple(label.split('_'))
@@ -1173,13 +1187,13 @@ def extract_disagg_layer(dstore, what):
     [imt] = qdict['imt']
     poe_id = int(qdict['poe_id'][0])
     grp = disagg_outputs(dstore, imt, 0, poe_id)[0]
-    dset = grp[label]
+    pmf = disagg_pmf(grp[label])
     edges = {k: grp.attrs[k] for k in grp.attrs if k.endswith('_edges')}
     dt = [('site_id', U32), ('lon', F32), ('lat', F32), ('rlz', U32),
-          ('poes', (dset.dtype, dset.shape))]
+          ('poes', (pmf.dtype, pmf.shape))]
     sitecol = dstore['sitecol']
     out = numpy.zeros(len(sitecol), dt)
-    out[0] = (0, sitecol.lons[0], sitecol.lats[0], grp.attrs['rlzi'], dset[()])
+    out[0] = (0, sitecol.lons[0], sitecol.lats[0], grp.attrs['rlzi'], pmf)
     for sid, lon, lat, rec in zip(
             sitecol.sids, sitecol.lons, sitecol.lats, out):
         if sid > 0:
@@ -1188,7 +1202,7 @@ def extract_disagg_layer(dstore, what):
             rec['lon'] = lon
             rec['lat'] = lat
             rec['rlz'] = grp.attrs['rlzi']
-            rec['poes'] = grp[label][()]
+            rec['poes'] = disagg_pmf(grp[label])
     return ArrayWrapper(out, edges)
 
 # ######################### extracting ruptures ##############################
@@ -114,14 +114,18 @@ class PmapGetter(object):
         self._pmap_by_grp = {}
         if 'poes' in self.dstore:
             # build probability maps restricted to the given sids
-            ok_sids = set(self.sids)
             for grp, dset in self.dstore['poes'].items():
                 ds = dset['array']
-                L, G = ds.shape[1:]
-                pmap = probability_map.ProbabilityMap(L, G)
-                for idx, sid in enumerate(dset['sids'][()]):
-                    if sid in ok_sids:
-                        pmap[sid] = probability_map.ProbabilityCurve(ds[idx])
+                sids = dset['sids'][()]
+                ok = numpy.isin(sids, self.sids)
+                idxs, = numpy.where(ok)
+                if len(idxs):  # read the slice containing the sids
+                    start, stop = idxs[0], idxs[-1] + 1
+                    array = ds[start:stop][ok[start:stop]]
+                else:
+                    array = numpy.zeros((0,) + ds.shape[1:])
+                pmap = probability_map.ProbabilityMap.from_array(
+                    array, sids[ok])
                 self._pmap_by_grp[grp] = pmap
                 self.nbytes += pmap.nbytes
         return self._pmap_by_grp
@@ -171,6 +175,35 @@ class PmapGetter(object):
                     pcurves[rlzi] |= c
         return pcurves
 
+    def gen_pcurves(self, sid, blocksize):  # used in classical
+        """
+        :param sid: site ID
+        :param blocksize: maximum number of realizations per block
+        :yields: arrays of shape (C, L) with the PoEs of C realizations
+        """
+        pmap_by_grp = self.init()
+        L = len(self.imtls.array)
+        R = self.num_rlzs
+        arrays, gsim_idxs = [], []
+        for grp, pmap in pmap_by_grp.items():
+            try:
+                pc = pmap[sid]
+            except KeyError:  # no hazard for sid
+                continue
+            # the realizations not in the group get the last column of zeros
+            gidx = numpy.full(R, -1)
+            for gsim_idx, rlzis in enumerate(self.rlzs_by_grp[grp]):
+                gidx[rlzis] = gsim_idx
+            arrays.append(numpy.concatenate(
+                [pc.array, numpy.zeros((L, 1))], axis=1))
+            gsim_idxs.append(gidx)
+        for start in range(0, R, blocksize):
+            stop = min(start + blocksize, R)
+            qs = numpy.ones((stop - start, L))
+            for array, gidx in zip(arrays, gsim_idxs):
+                qs *= 1. - array[:, gidx[start:stop]].T
+            yield 1. - qs
+
     def get_pcurve(self, s, r, g):  # used in disaggregation
         """
         :param s: site ID
@@ -233,12 +266,7 @@ class PmapGetter(object):
         self.init()
         if len(self.weights) == 1:  # one realization
             # the standard deviation is zero
-            pmap = self.get(0, grp)
-            for sid, pcurve in pmap.items():
-                array = numpy.zeros(pcurve.array.shape)
-                array[:, 0] = pcurve.array[:, 0]
-                pcurve.array = array
-            return pmap
+            return self.get(0, grp)
         elif grp:
             raise NotImplementedError('multiple realizations')
         L = len(self.imtls.array)
@@ -250,6 +278,34 @@ class PmapGetter(object):
         return pmap
 
 
+def read_gmf_data(dstore, start, stop):
+    """
+    :param dstore: a DataStore instance containing `gmf_data`
+    :param start: first site ID
+    :param stop: last site ID + 1
+    :returns: the GMF rows for the sites in the range [start, stop)
+
+    Since engine 3.9 the GMFs are ordered by site ID and the indices
+    are (start, stop) pairs, so that the GMVs of a range of sites can be
+    read with a single slice; older datastores contain lists of slices
+    per site, which are read and concatenated.
+    """
+    dset = dstore['gmf_data/data']
+    idxs = dstore['gmf_data/indices'][start:stop]
+    if idxs.dtype.name == 'uint32':  # engine >= 3.9 and scenario
+        if len(idxs) == 0:
+            return dset[0:0]
+        return dset[idxs[0, 0]:idxs[-1, 1]]
+    data = []
+    for idx in idxs:
+        if not idxs.dtype.names:  # engine >= 3.2
+            idx = zip(*idx)
+        data.extend(dset[i0:i1] for i0, i1 in idx)
+    if not data:
+        return dset[0:0]
+    return numpy.concatenate(data)
+
+
 class GmfDataGetter(collections.abc.Mapping):
     """
     A dictionary-like object {sid: dictionary by realization index}
@@ -268,7 +324,9 @@ class GmfDataGetter(collections.abc.Mapping):
             self.imts = self.dstore['gmf_data/imts'][()].split()
         except KeyError:  # engine < 3.3
             self.imts = list(self.dstore['oqparam'].imtls)
-        self.rlzs = self.dstore['events']['rlz_id']
+        # the same for all sites, so it is read only once per process
+        self.rlzs = self.dstore.read_df(
+            'events', sel=['rlz_id'], cache=True)['rlz_id'].to_numpy()
         self.data = self[self.sids[0]]
         if not self.data:  # no GMVs, return 0, counted in no_damage
             self.data = {rlzi: 0 for rlzi in range(self.num_rlzs)}
@@ -285,16 +343,10 @@ class GmfDataGetter(collections.abc.Mapping):
         return self.data
 
     def __getitem__(self, sid):
-        dset = self.dstore['gmf_data/data']
-        idxs = self.dstore['gmf_data/indices'][sid]
-        if idxs.dtype.name == 'uint32':  # scenario
-            idxs = [idxs]
-        elif not idxs.dtype.names:  # engine >= 3.2
-            idxs = zip(*idxs)
-        data = [dset[start:stop] for start, stop in idxs]
+        data = read_gmf_data(self.dstore, sid, sid + 1)
         if len(data) == 0:  # site ID with no data
             return {}
-        return group_by_rlz(numpy.concatenate(data), self.rlzs)
+        return group_by_rlz(data, self.rlzs)
 
     def __iter__(self):
         return iter(self.sids)
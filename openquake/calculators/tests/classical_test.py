@@ -17,6 +17,8 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import shutil
+import tempfile
 import unittest
 import unittest.mock as mock
 import numpy
@@ -81,6 +83,25 @@ class ClassicalTestCase(CalculatorTestCase):
             self.run_calc(case_1.__file__, 'job.ini', minimum_magnitude='4.5')
         self.assertEqual(str(ctx.exception), 'All sources were discarded!?')
 
+        # check the tabulated survival function against the exact one
+        self.assert_curves_ok(
+            ['hazard_curve-PGA.csv', 'hazard_curve-SA(0.1).csv'],
+            case_1.__file__, delta=1E-6, truncnorm_table='true')
+
+    def test_pmap_cache(self):
+        # the second calculation reads the ProbabilityMaps from the cache
+        datadir = tempfile.mkdtemp()
+        with mock.patch.dict(os.environ, OQ_DATADIR=datadir):
+            for _ in range(2):
+                self.assert_curves_ok(
+                    ['hazard_curve-PGA.csv', 'hazard_curve-SA(0.1).csv'],
+                    case_1.__file__, pmap_cache='true')
+            perf = view('performance', self.calc.datastore)
+            self.assertTrue(os.listdir(os.path.join(datadir, 'pmap_cache')))
+        self.assertIn('reading pmap cache', perf)
+        self.assertNotIn('saving pmap cache', perf)
+        shutil.rmtree(datadir)
+
     def test_wrong_smlt(self):
         with self.assertRaises(InvalidFile):
             self.run_calc(case_1.__file__, 'job_wrong.ini')
@@ -275,6 +296,14 @@ hazard_uhs-std.csv
             export(('hcurves/rlz-3', 'csv'), self.calc.datastore)
         self.assertIn("No 'hcurves-rlzs' found", str(ctx.exception))
 
+        # test the streaming quantiles, within 1% from the exact ones
+        exact = self.calc.datastore['hcurves-stats'][()]
+        self.run_calc(case_16.__file__, 'job.ini', quantile_error='.01')
+        approx = self.calc.datastore['hcurves-stats'][()]
+        numpy.testing.assert_allclose(approx[:, 0], exact[:, 0])  # mean
+        numpy.testing.assert_allclose(
+            approx[:, 1:], exact[:, 1:], rtol=.01)
+
     def test_case_17(self):  # oversampling
         self.assert_curves_ok(
             ['hazard_curve-smltp_b1-gsimltp_b1-ltr_0.csv',
@@ -379,6 +408,13 @@ hazard_uhs-std.csv
             'hazard_curve-mean-SA(1.0).csv', 'hazard_curve-mean-SA(2.0).csv',
         ], case_22.__file__, delta=1E-6)
 
+        # check the splitting on the measured task duration
+        self.assert_curves_ok([
+            '/hazard_curve-mean-PGA.csv', 'hazard_curve-mean-SA(0.1)',
+            'hazard_curve-mean-SA(0.2).csv', 'hazard_curve-mean-SA(0.5).csv',
+            'hazard_curve-mean-SA(1.0).csv', 'hazard_curve-mean-SA(2.0).csv',
+        ], case_22.__file__, delta=1E-6, task_duration='1E-6')
+
     def test_case_23(self):  # filtering away on TRT
         self.assert_curves_ok(['hazard_curve.csv'], case_23.__file__)
         checksum = self.calc.datastore['/'].attrs['checksum32']
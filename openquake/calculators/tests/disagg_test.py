@@ -19,12 +19,13 @@ import os
 import sys
 import unittest
 import numpy
+import h5py
 from openquake.baselib.general import gettemp
 from openquake.hazardlib.probability_map import combine
 from openquake.calculators import getters
 from openquake.calculators.views import view
 from openquake.calculators.export import export
-from openquake.calculators.extract import extract
+from openquake.calculators.extract import extract, disagg_pmf
 from openquake.calculators.tests import CalculatorTestCase, strip_calc_id
 from openquake.qa_tests_data.disagg import (
     case_1, case_2, case_3, case_4, case_5, case_6, case_master)
@@ -140,6 +141,13 @@ class DisaggregationTestCase(CalculatorTestCase):
         for fname in fnames:
             self.assertEqualFiles('expected/%s' % strip_calc_id(fname), fname)
 
+        # the tabulated truncated normal gives the same PoEs
+        self.run_calc(case_6.__file__, 'job.ini', truncnorm_table='true')
+        fnames = export(('disagg', 'csv'), self.calc.datastore)
+        for fname in fnames:
+            self.assertEqualFiles('expected/%s' % strip_calc_id(fname), fname,
+                                  delta=1E-5)
+
     def test_case_master(self):
         # this tests exercise the case of a complex logic tree; it also
         # prints the warning on poe_agg very different from the expected poe
@@ -148,6 +156,20 @@ class DisaggregationTestCase(CalculatorTestCase):
         self.assertEqualFiles('expected/mean_disagg.rst', fname)
         os.remove(fname)
 
+        # the PMFs are stored as arrays of nonzero bins
+        grp = self.calc.datastore['disagg']
+        dset = grp[sorted(grp)[0]]['Mag_Lon_Lat']
+        self.assertEqual(dset.dtype.names, ('mag', 'lon', 'lat', 'poe'))
+        self.assertLess(len(dset), numpy.prod(dset.attrs['shape']))
+
+        # the dense PMFs of older datastores are read as they are
+        pmf = disagg_pmf(dset)
+        fname = gettemp(suffix='.hdf5')
+        with h5py.File(fname, 'w') as f:
+            numpy.testing.assert_equal(
+                disagg_pmf(f.create_dataset('dense', data=pmf)), pmf)
+        os.remove(fname)
+
         fnames = export(('disagg', 'csv'), self.calc.datastore)
         self.assertEqual(len(fnames), 64)  # 2 sid x 8 keys x 2 poe x 2 imt
         for fname in fnames:
@@ -20,6 +20,7 @@ import io
 import os
 import re
 import math
+from unittest import mock
 
 import numpy.testing
 
@@ -32,7 +33,9 @@ from openquake.commonlib.util import max_rel_diff_index
 from openquake.calculators.views import view
 from openquake.calculators.export import export
 from openquake.calculators.extract import extract
-from openquake.calculators.event_based import get_mean_curves
+from openquake.calculators.event_based import (
+    get_mean_curves, split_gmf_reads)
+from openquake.calculators.getters import read_gmf_data
 from openquake.calculators.tests import CalculatorTestCase
 from openquake.qa_tests_data.classical import case_18 as gmpe_tables
 from openquake.qa_tests_data.event_based import (
@@ -127,6 +130,40 @@ class EventBasedTestCase(CalculatorTestCase):
         self.assertEqualFiles('expected/gmf-data.csv', fname)
         self.assertEqualFiles('expected/sig-eps.csv', sig_eps)
 
+    def test_gmf_data_by_site(self):
+        # reordering the GMFs in small blocks of sites
+        with mock.patch('openquake.calculators.base.GMF_BLOCK', 50):
+            out = self.run_calc(blocksize.__file__, 'job.ini',
+                                concurrent_tasks='4', exports='csv')
+        [fname, _, _] = out['gmf_data', 'csv']
+        self.assertEqualFiles('expected/gmf-data.csv', fname)
+
+        # the GMFs are ordered by site and there is a slice per site
+        dstore = self.calc.datastore
+        data = dstore['gmf_data/data'][()]
+        idxs = dstore['gmf_data/indices'][()]
+        numpy.testing.assert_equal(data['sid'], numpy.sort(data['sid']))
+        for sid, (start, stop) in enumerate(idxs):
+            self.assertTrue((data['sid'][start:stop] == sid).all())
+        self.assertEqual(idxs[-1, 1], len(data))
+
+        # reading a range of sites
+        N = len(idxs)
+        arr = read_gmf_data(dstore, 1, N - 1)
+        numpy.testing.assert_equal(
+            arr, data[(data['sid'] >= 1) & (data['sid'] < N - 1)])
+        self.assertEqual(len(read_gmf_data(dstore, 0, 0)), 0)
+
+    def test_split_gmf_reads(self):
+        # a site without GMFs after a site exceeding the block size
+        slices = {0: [(0, 5)], 1: [(5, 100), (130, 155)], 2: [],
+                  3: [(100, 130)]}
+        nrows = numpy.array([5, 120, 0, 30])
+        reads = list(split_gmf_reads(slices, nrows, 50))
+        self.assertEqual(reads, [[[0, 5]], [[5, 100], [130, 155]],
+                                 [[100, 130]]])
+        self.assertEqual(list(split_gmf_reads({0: []}, nrows[2:3], 50)), [])
+
     def test_case_1(self):
         out = self.run_calc(case_1.__file__, 'job.ini', exports='csv,xml')
 
@@ -16,6 +16,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
+import os
+from unittest import mock
 import numpy
 from openquake.qa_tests_data.scenario_risk import (
     case_1, case_2, case_2d, case_1g, case_1h, case_3, case_4, case_5,
@@ -178,6 +180,22 @@ class ScenarioRiskTestCase(CalculatorTestCase):
         tot20 = tot_loss(self.calc.datastore)
         aac(tot10, tot20, atol=.0001)  # must be around 230.0107
 
+        # check independence from the number of blocks in the GMF importer
+        with mock.patch('openquake.calculators.base.CSV_BLOCK', 1000):
+            self.run_calc(case_7.__file__, 'job.ini', concurrent_tasks='10')
+        aac(tot_loss(self.calc.datastore), tot10, atol=.0001)
+
+        # a GMF file with a header and no rows
+        fname = gettemp('rlzi,sid,eid,gmv_PGA\n', suffix='.csv',
+                        dir=os.path.dirname(case_7.__file__))
+        try:
+            with self.assertRaises(InvalidFile) as ctx:
+                self.run_calc(case_7.__file__, 'job.ini',
+                              gmfs_csv=os.path.basename(fname))
+            self.assertIn(fname, str(ctx.exception))
+        finally:
+            os.remove(fname)
+
     def test_case_8(self):
         # a complex scenario_risk from GMFs where the hazard sites are
         # not in the asset locations
@@ -195,8 +213,13 @@ class ScenarioRiskTestCase(CalculatorTestCase):
 
     def test_case_shakemap(self):
         self.run_calc(case_shakemap.__file__, 'pre-job.ini')
+        dirname = os.path.dirname(self.calc.datastore.filename)
+        before = set(os.listdir(dirname))
         self.run_calc(case_shakemap.__file__, 'job.ini',
                       hazard_calculation_id=str(self.calc.datastore.calc_id))
+        # the dense spatial factors written by the tasks are removed
+        self.assertFalse([f for f in set(os.listdir(dirname)) - before
+                          if f.startswith('shared_')])
         sitecol = self.calc.datastore['sitecol']
         self.assertEqual(len(sitecol), 9)
         gmfdict = dict(extract(self.calc.datastore, 'gmf_data'))
@@ -34,7 +34,7 @@ from openquake.hazardlib.gsim.base import ContextMaker
 from openquake.commonlib import util, calc
 from openquake.commonlib.writers import build_header, scientificformat
 from openquake.calculators import getters
-from openquake.calculators.extract import extract
+from openquake.calculators.extract import extract, disagg_pmf
 
 FLOAT = (float, numpy.float32, numpy.float64)
 INT = (int, numpy.int32, numpy.uint32, numpy.int64, numpy.uint64)
@@ -682,7 +682,7 @@ def view_global_poes(token, dstore):
     for grp in sorted(dstore['poes']):
         poes = dstore['poes/' + grp]
         nsites = len(poes)
-        site_avg = sum(poes[sid].array for sid in poes) / nsites
+        site_avg = poes.array.sum(axis=0) / nsites
         gsim_avg = site_avg.sum(axis=1) / poes.shape_z
         tbl.append([grp] + list(gsim_avg))
     return rst_table(tbl, header=header)
@@ -738,7 +738,7 @@ def view_mean_disagg(token, dstore):
     """
     tbl = []
     for key, dset in sorted(dstore['disagg'].items()):
-        vals = [ds[()].mean() for k, ds in sorted(dset.items())]
+        vals = [disagg_pmf(ds).mean() for k, ds in sorted(dset.items())]
         tbl.append([key] + vals)
     header = ['key'] + sorted(dset)
     return rst_table(sorted(tbl), header=header)
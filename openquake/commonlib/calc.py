@@ -59,13 +59,14 @@ def convert_to_array(pmap, nsites, imtls, inner_idx=0):
         for iml in imls:
             lst.append(('%s-%s' % (imt, iml), F32))
     curves = numpy.zeros(nsites, numpy.dtype(lst))
-    for sid, pcurve in pmap.items():
-        curve = curves[sid]
-        idx = 0
-        for imt, imls in imtls.items():
-            for iml in imls:
-                curve['%s-%s' % (imt, iml)] = pcurve.array[idx, inner_idx]
-                idx += 1
+    if not pmap:
+        return curves
+    sids, array = pmap.sids, pmap.array
+    idx = 0
+    for imt, imls in imtls.items():
+        for iml in imls:
+            curves['%s-%s' % (imt, iml)][sids] = array[:, idx, inner_idx]
+            idx += 1
     return curves
 
 
@@ -181,21 +182,17 @@ def make_hmap(pmap, imtls, poes, sid=None):
     :returns: a ProbabilityMap with size (N, M, P)
     """
     if sid is None:
-        sids = pmap.sids
+        sids, array = pmap.sids, pmap.array
     else:  # passed a probability curve
-        pmap = {sid: pmap}
-        sids = [sid]
+        sids, array = [sid], pmap.array[None]
     M, P = len(imtls), len(poes)
     hmap = probability_map.ProbabilityMap.build(M, P, sids, dtype=F32)
-    if len(pmap) == 0:
+    if len(sids) == 0:
         return hmap  # empty hazard map
     for i, imt in enumerate(imtls):
-        curves = numpy.array([pmap[sid].array[imtls(imt), 0] for sid in sids])
-        data = compute_hazard_maps(curves, imtls[imt], poes)  # array (N, P)
-        for sid, value in zip(sids, data):
-            array = hmap[sid].array
-            for j, val in enumerate(value):
-                array[i, j] = val
+        curves = array[:, imtls(imt), 0]
+        # array of shape (N, P)
+        hmap.array[:, i] = compute_hazard_maps(curves, imtls[imt], poes)
     return hmap
 
 
@@ -119,10 +119,12 @@ class OqParam(valid.ParamSet):
     export_dir = valid.Param(valid.utf8, '.')
     export_multi_curves = valid.Param(valid.boolean, False)
     exports = valid.Param(valid.export_formats, ())
+    exposure_cache = valid.Param(valid.boolean, False)  # used in readinput
     filter_distance = valid.Param(valid.Choice('rrup'), None)
     ground_motion_correlation_model = valid.Param(
         valid.NoneOr(valid.Choice(*GROUND_MOTION_CORRELATION_MODELS)), None)
     ground_motion_correlation_params = valid.Param(valid.dictionary, {})
+    ground_motion_correlation_neighbours = valid.Param(valid.positiveint, 0)
     ground_motion_fields = valid.Param(valid.boolean, True)
     gsim = valid.Param(valid.utf8, '[FromFile]')
     hazard_calculation_id = valid.Param(valid.NoneOr(valid.positiveint), None)
@@ -162,10 +164,13 @@ class OqParam(valid.ParamSet):
     num_cores = valid.Param(valid.positiveint, None)
     num_epsilon_bins = valid.Param(valid.positiveint)
     num_rlzs_disagg = valid.Param(valid.positiveint, 1)
+    pmap_cache = valid.Param(valid.boolean, False)  # used in classical
     poes = valid.Param(valid.probabilities, [])
     poes_disagg = valid.Param(valid.probabilities, [])
     pointsource_distance = valid.Param(valid.floatdict, {'default': {}})
     quantile_hazard_curves = quantiles = valid.Param(valid.probabilities, [])
+    quantile_error = valid.Param(
+        valid.FloatRange(0, .5, 'quantile_error'), 0)
     random_seed = valid.Param(valid.positiveint, 42)
     reference_depth_to_1pt0km_per_sec = valid.Param(
         valid.positivefloat, numpy.nan)
@@ -198,14 +203,17 @@ class OqParam(valid.ParamSet):
     sites_slice = valid.Param(valid.simple_slice, (None, None))
     sm_lt_path = valid.Param(valid.logic_tree_path, None)
     soil_intensities = valid.Param(valid.positivefloats, None)
+    source_cache = valid.Param(valid.boolean, False)
     source_id = valid.Param(valid.namelist, [])
     spatial_correlation = valid.Param(valid.Choice('yes', 'no', 'full'), 'yes')
     specific_assets = valid.Param(valid.namelist, [])
     ebrisk_maxsize = valid.Param(valid.positivefloat, 5E7)  # used in ebrisk
     max_weight = valid.Param(valid.positiveint, 1E6)  # used in classical
     taxonomies_from_model = valid.Param(valid.boolean, False)
+    task_duration = valid.Param(valid.positivefloat, 0)  # used in classical
     time_event = valid.Param(str, None)
     truncation_level = valid.Param(valid.NoneOr(valid.positivefloat), None)
+    truncnorm_table = valid.Param(valid.boolean, False)  # classical, disagg
     uniform_hazard_spectra = valid.Param(valid.boolean, False)
     vs30_tolerance = valid.Param(valid.positiveint, 0)
     width_of_mfd_bin = valid.Param(valid.positivefloat, None)
@@ -606,7 +614,9 @@ class OqParam(valid.ParamSet):
             return
         correl_model_cls = getattr(
             correlation, '%sCorrelationModel' % correl_name)
-        return correl_model_cls(**self.ground_motion_correlation_params)
+        return correl_model_cls(
+            num_neighbours=self.ground_motion_correlation_neighbours,
+            **self.ground_motion_correlation_params)
 
     def get_kinds(self, kind, R):
         """
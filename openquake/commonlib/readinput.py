@@ -716,8 +716,7 @@ def get_crmodel(oqparam):
 
 def get_exposure(oqparam):
     """
-    Read the full exposure in memory and build a list of
-    :class:`openquake.risklib.asset.Asset` instances.
+    Read the full exposure in memory as an array of assets.
 
     :param oqparam:
         an :class:`openquake.commonlib.oqvalidation.OqParam` instance
@@ -727,7 +726,8 @@ def get_exposure(oqparam):
     exposure = asset.Exposure.read(
         oqparam.inputs['exposure'], oqparam.calculation_mode,
         oqparam.region, oqparam.ignore_missing_costs,
-        by_country='country' in oqparam.aggregate_by)
+        by_country='country' in oqparam.aggregate_by,
+        cache=oqparam.exposure_cache)
     exposure.mesh, exposure.assets_by_site = exposure.get_mesh_assets_by_site()
     return exposure
 
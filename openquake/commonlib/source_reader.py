@@ -25,12 +25,14 @@ import logging
 import zlib
 import numpy
 
-from openquake.baselib import hdf5, parallel
+from openquake.baselib import hdf5, parallel, datastore, config
+from openquake.baselib.general import DiskCache
 from openquake.hazardlib import nrml, sourceconverter, calc
 from openquake.commonlib.logictree import get_effective_rlzs
 
 
 TWO16 = 2 ** 16  # 65,536
+MB = 1024 ** 2
 source_info_dt = numpy.dtype([
     ('sm_id', numpy.uint16),           # 0
     ('grp_id', numpy.uint16),          # 1
@@ -80,6 +82,7 @@ class SourceReader(object):
         mags = set()
         sm = apply_unc(path, fname, self.converter)
         fname_hits[fname] += 1
+        cache_hits = collections.Counter({sm.cached: 1})
         for sg in sm:
             # sample a source for each group
             if os.environ.get('OQ_SAMPLE_SOURCES'):
@@ -98,7 +101,16 @@ class SourceReader(object):
                     pickle.dumps(dic, pickle.HIGHEST_PROTOCOL))
                 src._wkt = src.wkt()
         return dict(fname_hits=fname_hits, sm=sm, mags=mags,
-                    ordinal=ordinal, fileno=fileno)
+                    ordinal=ordinal, fileno=fileno, cache_hits=cache_hits)
+
+
+def get_source_cache():
+    """
+    :returns: the DiskCache of the converted source models
+    """
+    maxsize = int(config.directory.get('source_cache_mb', 1000)) * MB
+    return DiskCache(
+        os.path.join(datastore.get_datadir(), 'source_cache'), maxsize)
 
 
 def get_sm_rlzs(oq, gsim_lt, source_model_lt, h5=None):
@@ -121,7 +133,8 @@ def get_sm_rlzs(oq, gsim_lt, source_model_lt, h5=None):
         oq.investigation_time, oq.rupture_mesh_spacing,
         oq.complex_fault_mesh_spacing, oq.width_of_mfd_bin,
         oq.area_source_discretization, oq.minimum_magnitude,
-        not spinning_off, oq.source_id, discard_trts=oq.discard_trts)
+        not spinning_off, oq.source_id, discard_trts=oq.discard_trts,
+        cache=get_source_cache() if oq.source_cache else None)
     rlzs = get_effective_rlzs(source_model_lt)
     if not source_model_lt.num_samples:
         num_gsim_rlzs = gsim_lt.get_num_paths()
@@ -166,17 +179,24 @@ def get_sm_rlzs(oq, gsim_lt, source_model_lt, h5=None):
         SourceReader(converter, smlt_dir, h5),
         allargs, distribute=dist, h5=h5 if h5 else None)
     # NB: h5 is None in logictree_test.py
-    return _store_results(smap, sm_rlzs, source_model_lt, gsim_lt, oq, h5)
+    sm_rlzs = _store_results(smap, sm_rlzs, source_model_lt, gsim_lt, oq, h5)
+    if converter.cache:
+        removed = converter.cache.evict()
+        if removed:
+            logging.info('Removed %d entries from the source cache', removed)
+    return sm_rlzs
 
 
 def _store_results(smap, sm_rlzs, source_model_lt, gsim_lt, oq, h5):
     mags = set()
     changes = 0
     fname_hits = collections.Counter()
+    cache_hits = collections.Counter()  # cached -> number of files
     for dic in sorted(smap, key=operator.itemgetter('fileno')):
         sm_rlz = sm_rlzs[dic['ordinal']]
         sm_rlz.src_groups.extend(dic['sm'])
         fname_hits += dic['fname_hits']
+        cache_hits += dic['cache_hits']
         changes += dic['sm'].changes
         mags.update(dic['mags'])
         gsim_file = oq.inputs.get('gsim_logic_tree')
@@ -226,4 +246,7 @@ def _store_results(smap, sm_rlzs, source_model_lt, gsim_lt, oq, h5):
     if changes:
         logging.info('Applied %d changes to the composite source model',
                      changes)
+    if oq.source_cache:
+        logging.info('Source cache: %d hit(s), %d miss(es)',
+                     cache_hits[True], cache_hits[False])
     return sm_rlzs
@@ -21,6 +21,7 @@ import tempfile
 import unittest.mock as mock
 import unittest
 from io import BytesIO
+import numpy
 
 from openquake.baselib import general, datastore
 from openquake.hazardlib import InvalidFile
@@ -440,6 +441,36 @@ Missing: {'lon'}''', str(ctx.exception))
         self.assertIn('''\
 Found case-duplicated fields [['ID', 'id']] in ''', str(ctx.exception))
 
+    def test_csv_slices(self):
+        # reading the CSV in small slices gives the same assets
+        fname = os.path.join(os.path.dirname(case_16.__file__),
+                             'exposure.xml')
+        exp = asset.Exposure.read([fname])
+        with mock.patch.object(asset, 'CSV_BLOCK', 500):
+            exp2 = asset.Exposure.read([fname])
+        self.assertEqual(exp2.asset_refs, exp.asset_refs)
+        self.assertEqual(list(exp2.tagcol), list(exp.tagcol))
+        numpy.testing.assert_equal(exp2.assets, exp.assets)
+
+    def test_exposure_cache(self):
+        fname = os.path.join(os.path.dirname(case_16.__file__),
+                             'exposure.xml')
+        datadir = tempfile.mkdtemp()
+        with mock.patch.dict(os.environ, OQ_DATADIR=datadir):
+            exp = asset.Exposure.read([fname], cache=True)
+            [pik] = os.listdir(os.path.join(datadir, 'exposure_cache'))
+            self.assertTrue(pik.endswith('.pik'))
+            with mock.patch.object(asset, 'read_assets_csv') as read:
+                exp2 = asset.Exposure.read([fname], cache=True)
+            self.assertFalse(read.called)  # the CSV was not parsed
+
+            # a change in the code of the reader invalidates the cache
+            with mock.patch.object(asset, '__file__', fname):
+                asset.Exposure.read([fname], cache=True)
+            self.assertEqual(
+                len(os.listdir(os.path.join(datadir, 'exposure_cache'))), 2)
+        numpy.testing.assert_equal(exp2.assets, exp.assets)
+
 
 class GetCompositeSourceModelTestCase(unittest.TestCase):
 
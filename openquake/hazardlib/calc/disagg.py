@@ -35,7 +35,7 @@ from openquake.hazardlib.geo.utils import get_longitudinal_extent
 from openquake.hazardlib.geo.utils import cross_idl
 from openquake.hazardlib.site import SiteCollection
 from openquake.hazardlib.gsim.base import (
-    ContextMaker, get_mean_std, to_distribution_values)
+    ContextMaker, get_mean_std, to_distribution_values, _truncnorm_sf_tab)
 
 
 def _eps3(truncation_level, n_epsilons):
@@ -46,93 +46,95 @@ def _eps3(truncation_level, n_epsilons):
     return tn, eps, eps_bands
 
 
-def _site_indices(sids_by_rup, N):
-    # an array of indices of shape (N, U)
-    U = len(sids_by_rup)
-    mat = -numpy.ones((N, U), numpy.int16)
-    for ridx, sids in enumerate(sids_by_rup):
-        for sidx, sid in enumerate(sids):
-            mat[sid, ridx] = sidx
-    return mat
-
-
-def _disaggregate(cmaker, sitecol, rupdata, indices, iml2, eps3,
-                  pne_mon=performance.Monitor(),
-                  gmf_mon=performance.Monitor()):
-    # disaggregate (separate) PoE in different contributions
-    # returns AccumDict with keys (poe, imt) and mags, dists, lons, lats
-    [sid] = sitecol.sids
-    acc = dict(pnes=[], mags=[], dists=[], lons=[], lats=[])
-    try:
-        gsim = cmaker.gsim_by_rlzi[iml2.rlzi]
-    except KeyError:
-        return pack(acc, 'mags dists lons lats pnes'.split())
+def _mean_std_cache(cmaker, sitecol, rupdata, sids, gsims, imts,
+                    gmf_mon=performance.Monitor()):
+    # compute the means and stddevs once per rupture, site and gsim;
+    # returns the ruptures and a compact dictionary with an element per
+    # pair rupture-site close to the given sids
     maxdist = cmaker.maximum_distance(cmaker.trt)
     fildist = rupdata[cmaker.filter_distance + '_']
-    for ridx, sidx in enumerate(indices):
-        if sidx == -1:  # no contribution for this site
+    rctxs = []
+    acc = dict(ridx=[], sid=[], mag=[], dist=[], lon=[], lat=[], mean_std=[])
+    for ridx, rsids in enumerate(rupdata['sid_']):
+        ok = numpy.isin(rsids, sids) & (fildist[ridx] < maxdist)
+        if not ok.any():
             continue
-        dist = fildist[ridx][sidx]
-        if dist >= maxdist:
-            continue
-        elif gsim.minimum_distance and dist < gsim.minimum_distance:
-            dist = gsim.minimum_distance
         rctx = contexts.RuptureContext(
             (par, val[ridx]) for par, val in rupdata.items())
         dctx = contexts.DistancesContext(
-            (param, getattr(rctx, param + '_')[[sidx]])
+            (param, getattr(rctx, param + '_')[ok])
             for param in cmaker.REQUIRES_DISTANCES)
-        acc['mags'].append(rctx.mag)
-        acc['lons'].append(rctx.lon_[sidx])
-        acc['lats'].append(rctx.lat_[sidx])
-        acc['dists'].append(dist)
         with gmf_mon:
-            mean_std = get_mean_std(
-                sitecol, rctx, dctx, iml2.imts, [gsim])[..., 0]  # (2, N, M)
-        with pne_mon:
-            iml = numpy.array(
-                [to_distribution_values(lvl, imt) for imt, lvl in zip(
-                    iml2.imts, iml2)])  # shape (M, P)
-            pne = _disaggregate_pne(rctx, mean_std, iml, *eps3)
-            acc['pnes'].append(pne)
-    return pack(acc, 'mags dists lons lats pnes'.split())
-
-
-def _disaggregate_pne(rupture, mean_std, imls, truncnorm, epsilons, eps_bands):
+            mean_std = get_mean_std(  # shape (2, n, M, G)
+                sitecol.filtered(rsids[ok]), rctx, dctx, imts, gsims)
+        n = ok.sum()
+        acc['ridx'].append(numpy.repeat(len(rctxs), n))
+        acc['sid'].append(rsids[ok])
+        acc['mag'].append(numpy.repeat(rctx.mag, n))
+        acc['dist'].append(fildist[ridx][ok])
+        acc['lon'].append(rctx.lon_[ok])
+        acc['lat'].append(rctx.lat_[ok])
+        acc['mean_std'].append(mean_std.transpose(1, 0, 2, 3))
+        rctxs.append(rctx)
+    if not rctxs:
+        return rctxs, {}
+    return rctxs, {k: numpy.concatenate(v) for k, v in acc.items()}
+
+
+def _disaggregate(rctxs, cache, gsim, g, iml2, eps3,
+                  pne_mon=performance.Monitor(), tabulated=False):
+    # disaggregate (separate) PoE in different contributions, starting
+    # from the elements of the cache relative to a single site
+    # returns AccumDict with keys (poe, imt) and mags, dists, lons, lats
+    dists = cache['dist']
+    if gsim.minimum_distance:
+        dists = numpy.maximum(dists, gsim.minimum_distance)
+    with pne_mon:
+        iml = numpy.array(
+            [to_distribution_values(lvl, imt) for imt, lvl in zip(
+                iml2.imts, iml2)])  # shape (M, P)
+        poes = _disaggregate_poes(  # shape (U, M, P, E)
+            cache['mean_std'][:, :, :, g], iml, *eps3, tabulated=tabulated)
+        pnes = numpy.array([rctxs[ridx].get_probability_no_exceedance(poe)
+                            for ridx, poe in zip(cache['ridx'], poes)])
+    return pack(dict(mags=cache['mag'], dists=dists, lons=cache['lon'],
+                     lats=cache['lat'], pnes=pnes.reshape(poes.shape)),
+                'mags dists lons lats pnes'.split())
+
+
+def _disaggregate_poes(mean_std, imls, truncnorm, epsilons, eps_bands,
+                       tabulated=False):
     """
-    Disaggregate (separate) PoE of ``iml`` in different contributions
+    Disaggregate (separate) PoE of ``imls`` in different contributions
     each coming from ``epsilons`` distribution bins.
+
+    :param mean_std: array of shape (U, 2, M)
+    :param imls: array of shape (M, P)
+    :param tabulated: if True, use the tabulated survival function
     :returns:
-        Contribution to probability of exceedance of ``iml`` coming
-        from different sigma bands in the form of a 2D numpy array of
-        probabilities with shape (n_sites, n_epsilons)
-    """
-    n_epsilons = len(epsilons) - 1
-    poes = numpy.zeros(imls.shape + (n_epsilons,))
-    for (m, p), iml in numpy.ndenumerate(imls):
-        # compute iml value with respect to standard (mean=0, std=1)
-        # normal distributions
-        [lvl] = (iml - mean_std[0, :, m]) / mean_std[1, :, m]
-        # take the minimum epsilon larger than standard_iml
-        bin = numpy.searchsorted(epsilons, lvl)
-        if bin == 0:
-            poes[m, p] = eps_bands
-        elif bin > n_epsilons:
-            poes[m, p] = numpy.zeros(n_epsilons)
-        else:
-            # for other cases (when ``lvl`` falls somewhere in the
-            # histogram):
-            poes[m, p] = numpy.concatenate([
-                # take zeros for bins that are on the left hand side
-                # from the bin ``lvl`` falls into,
-                numpy.zeros(bin - 1),
-                # ... area of the portion of the bin containing ``lvl``
-                # (the portion is limited on the left hand side by
-                # ``lvl`` and on the right hand side by the bin edge),
-                [truncnorm.sf(lvl) - eps_bands[bin:].sum()],
-                # ... and all bins on the right go unchanged.
-                eps_bands[bin:]])
-    return rupture.get_probability_no_exceedance(poes)
+        Contribution to probability of exceedance of ``imls`` coming
+        from different sigma bands in the form of an array of
+        probabilities with shape (U, M, P, E)
+    """
+    # compute the iml values with respect to standard (mean=0, std=1)
+    # normal distributions, shape (U, M, P)
+    mean, std = mean_std[:, 0, :, None], mean_std[:, 1, :, None]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        lvls = (imls - mean) / std
+    # with std=0 the levels below the mean get all the bands and the others
+    # (including iml == mean, which would give NaN) get zero contributions
+    lvls = numpy.where(
+        std == 0, numpy.where(imls < mean, -numpy.inf, numpy.inf), lvls)
+    # the contribution of each band is the area of the portion of the band
+    # on the right hand side of the level, i.e. zero for the bands on the
+    # left hand side of the level and eps_bands for the bands on the right
+    cdfs = truncnorm.cdf(epsilons)
+    if tabulated:  # the truncation level is the last epsilon
+        lvl_cdfs = 1. - _truncnorm_sf_tab(epsilons[-1], lvls)[..., None]
+    else:
+        lvl_cdfs = truncnorm.cdf(lvls)[..., None]
+    return numpy.maximum(
+        cdfs[1:] - numpy.maximum(cdfs[:-1], lvl_cdfs), 0.)
 
 
 def lon_lat_bins(bb, coord_bin_width):
@@ -165,23 +167,15 @@ def get_bins(bin_edges, sid):
     return mag_bins, dist_bins, lon_bins[sid], lat_bins[sid], eps_bins
 
 
-# this is fast
-def _build_disagg_matrix(bdata, bins):
-    """
-    :param bdata: a dictionary of probabilities of no exceedence
-    :param bins: bin edges
-    :returns: a 7D-matrix of shape (#magbins, #distbins, #lonbins,
-                                    #latbins, #epsbins, #imts, #poes)
-    """
-    mag_bins, dist_bins, lon_bins, lat_bins, eps_bins = bins
-    dim1, dim2, dim3, dim4, dim5 = shape = [len(b)-1 for b in bins]
-
+def _bin_indices(bdata, bins):
     # find bin indexes of rupture attributes; bins are assumed closed
     # on the lower bound, and open on the upper bound, that is [ )
     # longitude values need an ad-hoc method to take into account
     # the 'international date line' issue
     # the 'minus 1' is needed because the digitize method returns the
     # index of the upper bound of the bin
+    mag_bins, dist_bins, lon_bins, lat_bins, eps_bins = bins
+    dim1, dim2, dim3, dim4, dim5 = [len(b)-1 for b in bins]
     mags_idx = numpy.digitize(bdata.mags+pmf.PRECISION, mag_bins) - 1
     dists_idx = numpy.digitize(bdata.dists, dist_bins) - 1
     lons_idx = _digitize_lons(bdata.lons, lon_bins)
@@ -195,17 +189,72 @@ def _build_disagg_matrix(bdata, bins):
     dists_idx[dists_idx == dim2] = dim2 - 1
     lons_idx[lons_idx == dim3] = dim3 - 1
     lats_idx[lats_idx == dim4] = dim4 - 1
+    return mags_idx, dists_idx, lons_idx, lats_idx
 
+
+# this is fast
+def _build_disagg_matrix(bdata, bins):
+    """
+    :param bdata: a dictionary of probabilities of no exceedence
+    :param bins: bin edges
+    :returns: a 7D-matrix of shape (#magbins, #distbins, #lonbins,
+                                    #latbins, #epsbins, #imts, #poes)
+    """
+    shape = [len(b)-1 for b in bins]
     U, M, P, E = bdata.pnes.shape
     mat7D = numpy.ones(shape + [M, P])
-    for i_mag, i_dist, i_lon, i_lat, pne in zip(
-            mags_idx, dists_idx, lons_idx, lats_idx, bdata.pnes):
-        mat7D[i_mag, i_dist, i_lon, i_lat] *= pne.transpose(2, 0, 1)  # E, M, P
+    numpy.multiply.at(mat7D, _bin_indices(bdata, bins),
+                      bdata.pnes.transpose(0, 3, 1, 2))  # U, E, M, P
     return 1. - mat7D
 
 
+def _build_disagg_coo(bdata, bins):
+    # returns the indices (mag, dist, lon, lat) of the nonzero bins,
+    # with shape (K, 4), and the probabilities of no exceedence in
+    # each bin, with shape (K, E, M, P)
+    coords = numpy.array(_bin_indices(bdata, bins)).T
+    return reduce_coo(coords, bdata.pnes.transpose(0, 3, 1, 2))
+
+
+def reduce_coo(coords, pnes):
+    """
+    Multiply the probabilities of no exceedence in the same bin.
+
+    :param coords: an array of bin indices of shape (K, D)
+    :param pnes: an array of probabilities of no exceedence of shape (K, ...)
+    :returns: the unique bin indices and the corresponding probabilities
+    """
+    uniq, inv = numpy.unique(coords, axis=0, return_inverse=True)
+    out = numpy.ones((len(uniq),) + pnes.shape[1:])
+    numpy.multiply.at(out, inv, pnes)
+    return uniq, out
+
+
+def coo_pmf(coords, pnes, shape, axes):
+    """
+    Fold a sparse disaggregation matrix into a PMF, without building
+    the full matrix.
+
+    :param coords:
+        an array of shape (K, 5) with the indices (trt, mag, dist, lon, lat)
+        of the nonzero bins
+    :param pnes:
+        an array of shape (K, E) with the probabilities of no exceedence
+        in each bin, by epsilon
+    :param shape: the shape (T, Ma, D, Lo, La, E) of the full matrix
+    :param axes: the axes of the full matrix to keep, see `pmf_axes`
+    :returns: an array with the shape of the kept axes
+    """
+    K, E = pnes.shape
+    coords = numpy.concatenate([numpy.repeat(coords, E, axis=0),
+                                numpy.tile(numpy.arange(E), K)[:, None]], 1)
+    out = numpy.ones([shape[a] for a in axes])
+    numpy.multiply.at(out, tuple(coords[:, a] for a in axes), pnes.flatten())
+    return 1. - out
+
+
 # called by the engine
-def build_matrices(rupdata, sitecol, cmaker, iml4,
+def build_matrices(rupdata, sitecol, cmaker, iml4, sids,
                    num_epsilon_bins, bin_edges,
                    pne_mon, mat_mon, gmf_mon):
     """
@@ -213,36 +262,63 @@ def build_matrices(rupdata, sitecol, cmaker, iml4,
     :param sitecol: a site collection of N elements
     :param cmaker: a ContextMaker
     :param iml4: an array of shape (N, M, P, Z)
+    :param sids: the IDs of the sites to disaggregate
     :param num_epsilon_bins: number of epsilons bins
     :param bin_edges: edges of the bins
-    :yield: (sid, 8dmatrix) if the matrix is nonzero
+    :yield:
+        pairs (sid, (coords, pnes)) where coords are the indices
+        (mag, dist, lon, lat, z) of the nonzero bins and pnes the
+        probabilities of no exceedence, of shape (K, E, M, P)
     """
     if len(sitecol) >= 32768:
         raise ValueError('You can disaggregate at max 32,768 sites')
-    indices = _site_indices(rupdata['sid_'], len(sitecol))
     eps3 = _eps3(cmaker.trunclevel, num_epsilon_bins)  # this is slow
-    M, P, Z = iml4.shape[1:]
-    for sid, iml3 in zip(sitecol.sids, iml4):
-        singlesitecol = sitecol.filtered([sid])
+    Z = iml4.shape[3]
+    gsims = sorted(set(cmaker.gsim_by_rlzi[rlz]
+                       for rlz in iml4.rlzs[sids].flat
+                       if rlz in cmaker.gsim_by_rlzi))
+    if not gsims:
+        return
+    rctxs, cache = _mean_std_cache(
+        cmaker, sitecol, rupdata, sids, gsims, iml4.imts, gmf_mon)
+    if not rctxs:
+        return
+    # split the cache by site
+    order = numpy.argsort(cache['sid'], kind='stable')
+    cache = {k: v[order] for k, v in cache.items()}
+    stops = numpy.searchsorted(cache['sid'], sids, 'right')
+    starts = numpy.searchsorted(cache['sid'], sids)
+    for sid, start, stop in zip(sids, starts, stops):
+        if start == stop:  # no contribution for this site
+            continue
+        cache1 = {k: v[start:stop] for k, v in cache.items()}
         bins = get_bins(bin_edges, sid)
-        arr = numpy.zeros([len(b) - 1 for b in bins] + [M, P, Z])
+        coos = []
         for z in range(Z):
             rlz = iml4.rlzs[sid, z]
+            try:
+                gsim = cmaker.gsim_by_rlzi[rlz]
+            except KeyError:
+                continue
             iml2 = hdf5.ArrayWrapper(
-                iml3[:, :, z], dict(rlzi=rlz, imts=iml4.imts))
+                iml4[sid, :, :, z], dict(rlzi=rlz, imts=iml4.imts))
             try:
-                bdata = _disaggregate(
-                    cmaker, singlesitecol, rupdata,
-                    indices[sid], iml2, eps3, pne_mon, gmf_mon)
+                bdata = _disaggregate(rctxs, cache1, gsim, gsims.index(gsim),
+                                      iml2, eps3, pne_mon,
+                                      cmaker.truncnorm_table)
                 if bdata.pnes.sum():
                     with mat_mon:
-                        arr[..., z] = _build_disagg_matrix(bdata, bins)
+                        coords, pnes = _build_disagg_coo(bdata, bins)
+                        coords = numpy.concatenate(
+                            [coords, numpy.full((len(coords), 1), z)], 1)
+                        coos.append((coords, pnes))
             except Exception as exc:
                 msg = 'Error in task %s for site #%d, rlz #%d: %s' % (
                     getattr(pne_mon, 'task_no', 0), sid, rlz, exc)
                 raise exc.__class__(msg) from exc
-        if arr.any():  # nonzero
-            yield sid, arr
+        if coos:
+            yield sid, (numpy.concatenate([c for c, _ in coos]),
+                        numpy.concatenate([p for _, p in coos]))
 
 
 def _digitize_lons(lons, lon_bins):
@@ -358,8 +434,11 @@ def disaggregation(
         contexts.RuptureContext.temporal_occurrence_model = (
             srcs[0].temporal_occurrence_model)
         rdata = contexts.RupData(cmaker).from_srcs(srcs, sitecol)
-        idxs = _site_indices(rdata['sid_'], 1)[0]
-        bdata[trt] = _disaggregate(cmaker, sitecol, rdata, idxs, iml2, eps3)
+        gsim = gsim_by_trt[trt]
+        rctxs, cache = _mean_std_cache(
+            cmaker, sitecol, rdata, sitecol.sids, [gsim], [imt])
+        if rctxs:
+            bdata[trt] = _disaggregate(rctxs, cache, gsim, 0, iml2, eps3)
 
     if sum(len(bd.mags) for bd in bdata.values()) == 0:
         warnings.warn(
@@ -566,3 +645,15 @@ pmf_map = dict([
     ('Mag_Lon_Lat', mag_lon_lat_pmf),
     ('Lon_Lat_TRT', lon_lat_trt_pmf),
 ])
+
+#: axes of the PMFs in a full matrix of shape (T, Ma, D, Lo, La, E)
+pmf_axes = dict([
+    ('Mag', (1,)),
+    ('Dist', (2,)),
+    ('TRT', (0,)),
+    ('Mag_Dist', (1, 2)),
+    ('Mag_Dist_Eps', (1, 2, 5)),
+    ('Lon_Lat', (3, 4)),
+    ('Mag_Lon_Lat', (1, 3, 4)),
+    ('Lon_Lat_TRT', (3, 4, 0)),
+])
@@ -22,16 +22,19 @@ import operator
 import collections.abc
 from contextlib import contextmanager
 import numpy
-from scipy.spatial import cKDTree, distance
+from scipy.spatial import distance
 
 from openquake.baselib import hdf5
+from openquake.baselib.general import block_splitter
 from openquake.baselib.python3compat import raise_
+from openquake.hazardlib.site import SiteCollection
 from openquake.hazardlib.geo.utils import (
     KM_TO_DEGREES, angular_distance, fix_lon, get_bounding_box, cross_idl,
     get_longitudinal_extent, BBoxError, spherical_to_cartesian)
 
 U32 = numpy.uint32
 MAX_DISTANCE = 2000  # km, ultra big distance used if there is no filter
+FILTER_BLOCK = 1000  # number of sources filtered together
 src_group_id = operator.attrgetter('src_group_id')
 
 
@@ -245,8 +248,25 @@ class SourceFilter(object):
         if not filename:  # keep the sitecol in memory
             self.__dict__['sitecol'] = sitecol
 
+    def share(self, smap):
+        """
+        :param smap: a :class:`openquake.baselib.parallel.Starmap` instance
+        :returns:
+            a copy of the filter sending to the tasks a shared memory-mapped
+            site array instead of re-reading the .hdf5 cache file
+        """
+        if self.sitecol is None:  # nothing to share
+            return self
+        new = object.__new__(self.__class__)
+        vars(new).update(vars(self))
+        new.shared = smap.share(sitecol=self.sitecol.array)['sitecol']
+        return new
+
     def __getstate__(self):
-        if self.filename:
+        if getattr(self, 'shared', None):
+            return dict(filename=self.filename, shared=self.shared,
+                        integration_distance=self.integration_distance)
+        elif self.filename:
             # in the engine self.filename is the .hdf5 cache file
             return dict(filename=self.filename,
                         integration_distance=self.integration_distance)
@@ -262,6 +282,11 @@ class SourceFilter(object):
         """
         if 'sitecol' in vars(self):
             return self.__dict__['sitecol']
+        if getattr(self, 'shared', None):  # attach to the shared array
+            sc = object.__new__(SiteCollection)
+            sc.__fromh5__(self.shared.get(), {})
+            self.__dict__['sitecol'] = sc
+            return sc
         if self.filename is None:
             return
         elif not os.path.exists(self.filename):
@@ -328,14 +353,13 @@ class SourceFilter(object):
             return []
         elif not self.integration_distance:  # do not filter
             return self.sitecol.sids
-        if not hasattr(self, 'kdt'):
-            self.kdt = cKDTree(self.sitecol.xyz)
         xyz = spherical_to_cartesian(*rec['hypo'])
         dlon = get_longitudinal_extent(rec['minlon'], rec['maxlon'])
         dlat = rec['maxlat'] - rec['minlat']
         delta = max(dlon, dlat) / KM_TO_DEGREES
         maxradius = self.integration_distance(trt) + delta
-        sids = U32(self.kdt.query_ball_point(xyz, maxradius, eps=.001))
+        kdt = self.sitecol.kdtree('xyz')
+        sids = U32(kdt.query_ball_point(xyz, maxradius, eps=.001))
         sids.sort()
         return sids
 
@@ -352,20 +376,24 @@ class SourceFilter(object):
         :param sources: a sequence of sources
         :yields: sources with .indices
         """
-        for src in sources:
-            if hasattr(src, 'indices'):   # already filtered
-                yield src
-                continue
-            try:
-                box = self.integration_distance.get_affected_box(src)
-            except BBoxError:  # too large, don't filter
-                src.indices = self.sitecol.sids
-                yield src
-                continue
-            indices = self.sitecol.within_bbox(box)
-            if len(indices):
-                src.indices = indices
-                yield src
+        # the bounding boxes are queried in blocks, see within_bboxes
+        for block in block_splitter(sources, FILTER_BLOCK):
+            boxes = {}  # position in the block -> bounding box
+            for i, src in enumerate(block):
+                if hasattr(src, 'indices'):   # already filtered
+                    continue
+                try:
+                    boxes[i] = self.integration_distance.get_affected_box(src)
+                except BBoxError:  # too large, don't filter
+                    src.indices = self.sitecol.sids
+            indices = dict(zip(boxes, self.sitecol.within_bboxes(
+                list(boxes.values())))) if boxes else {}
+            for i, src in enumerate(block):
+                if i not in indices:
+                    yield src
+                elif len(indices[i]):
+                    src.indices = indices[i]
+                    yield src
 
     def within_bbox(self, srcs):
         """
@@ -132,12 +132,13 @@ class GmfComputer(object):
 
     def compute_all(self, min_iml, rlzs_by_gsim, sig_eps=None):
         """
-        :returns: [(sid, eid, gmv), ...], dt
+        :returns: an array with fields (sid, eid, gmv) and the time spent
         """
         t0 = time.time()
         rup = self.rupture
         sids = self.sids
         eids_by_rlz = rup.get_eids_by_rlz(rlzs_by_gsim)
+        gmf_dt = [('sid', U32), ('eid', U32), ('gmv', (F32, (len(min_iml),)))]
         data = []
         for gs, rlzs in rlzs_by_gsim.items():
             num_events = sum(len(eids_by_rlz[rlzi]) for rlzi in rlzs)
@@ -146,28 +147,26 @@ class GmfComputer(object):
             # it is better to have few calls producing big arrays
             array, sig, eps = self.compute(gs, num_events)
             array = array.transpose(1, 0, 2)  # from M, N, E to N, M, E
-            for i, miniml in enumerate(min_iml):  # gmv < minimum
-                arr = array[:, i, :]
-                arr[arr < miniml] = 0
-            n = 0
-            for rlzi in rlzs:
-                eids = eids_by_rlz[rlzi] + self.e0
-                e = len(eids)
-                for ei, eid in enumerate(eids):
-                    gmf = array[:, :, n + ei]  # shape (N, M)
-                    tot = gmf.sum(axis=0)  # shape (M,)
-                    if not tot.sum():
-                        continue
-                    if sig_eps is not None:
-                        tup = tuple([eid, rlzi] + list(sig[:, n + ei]) +
-                                    list(eps[:, n + ei]))
-                        sig_eps.append(tup)
-                    for sid, gmv in zip(sids, gmf):
-                        if gmv.sum():
-                            data.append((sid, eid, gmv))
-                n += e
-        m = (len(min_iml),)
-        d = numpy.array(data, [('sid', U32), ('eid', U32), ('gmv', (F32, m))])
+            array[array < numpy.array(min_iml)[:, None]] = 0  # gmv < minimum
+            eids = numpy.concatenate(
+                [eids_by_rlz[rlzi] + self.e0 for rlzi in rlzs])
+            ok = array.sum(axis=1) != 0  # shape (N, E)
+            if sig_eps is not None:
+                rlzis = numpy.concatenate(
+                    [numpy.full(len(eids_by_rlz[rlzi]), rlzi)
+                     for rlzi in rlzs])
+                for e in ok.any(axis=0).nonzero()[0]:
+                    sig_eps.append(tuple([eids[e], rlzis[e]] + list(sig[:, e])
+                                         + list(eps[:, e])))
+            # nonzero on the (E, N) matrix returns the indices ordered
+            # by event and then by site
+            eidx, sidx = ok.T.nonzero()
+            d = numpy.zeros(len(eidx), gmf_dt)
+            d['sid'] = sids[sidx]
+            d['eid'] = eids[eidx]
+            d['gmv'] = array[sidx, :, eidx]
+            data.append(d)
+        d = numpy.concatenate(data) if data else numpy.zeros(0, gmf_dt)
         return d, time.time() - t0
 
     def compute(self, gsim, num_events):
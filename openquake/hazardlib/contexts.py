@@ -26,16 +26,20 @@ import numpy
 from scipy.interpolate import interp1d
 
 
-from openquake.baselib.general import AccumDict, DictArray
+from openquake.baselib.general import AccumDict, DictArray, block_splitter
 from openquake.baselib.performance import Monitor
 from openquake.hazardlib import imt as imt_module
 from openquake.hazardlib.gsim import base
 from openquake.hazardlib.calc.filters import IntegrationDistance, getdefault
 from openquake.hazardlib.probability_map import ProbabilityMap
 from openquake.hazardlib.geo.surface import PlanarSurface
+from openquake.hazardlib.geo.surface.planar import (
+    PLANAR_DISTANCES, MAX_DISTANCES, get_planar_distances)
+from openquake.hazardlib.geo.geodetic import spherical_to_cartesian
 
 I16 = numpy.int16
 F32 = numpy.float32
+MAX_BLOCK_SIZE = 10 ** 7  # max number of PoEs computed together
 KNOWN_DISTANCES = frozenset(
     'rrup rx ry0 rjb rhypo repi rcdpp azimuth azimuth_cp rvolc'.split())
 
@@ -88,6 +92,67 @@ def get_num_distances(gsims):
     return len(dists)
 
 
+def stack_contexts(ctxs, gsims):
+    """
+    :param ctxs: a list of triples (rctx, sctx, dctx)
+    :param gsims: a list of GSIMs
+    :returns:
+        a single triple (rctx, sctx, dctx) where the rupture parameters,
+        the site parameters and the distances required by the GSIMs are
+        arrays aligned with the flattened (rupture, site) axis
+    """
+    nsites = [len(ctx[1].sids) for ctx in ctxs]
+    rparams, sparams, dparams = set(), set(), set()
+    for gsim in gsims:
+        rparams.update(gsim.REQUIRES_RUPTURE_PARAMETERS)
+        sparams.update(gsim.REQUIRES_SITES_PARAMETERS)
+        dparams.update(gsim.REQUIRES_DISTANCES)
+    rctx = RuptureContext(
+        (par, numpy.repeat([getattr(ctx[0], par) for ctx in ctxs], nsites))
+        for par in rparams)
+    sctx = SitesContext(sorted(sparams))
+    sctx.sids = numpy.concatenate([ctx[1].sids for ctx in ctxs])
+    for par in sparams:
+        setattr(sctx, par, numpy.concatenate(
+            [getattr(ctx[1], par) for ctx in ctxs]))
+    dctx = DistancesContext(
+        (par, numpy.concatenate([getattr(ctx[2], par) for ctx in ctxs]))
+        for par in dparams)
+    return rctx, sctx, dctx
+
+
+def get_mean_stds(ctxs, imts, gsims):
+    """
+    Compute means and stddevs for a list of contexts. The GSIMs with
+    a true ``vectorized`` flag are called once on the stacked contexts,
+    the others are called once per rupture.
+
+    :param ctxs: a list of triples (rctx, sctx, dctx)
+    :param imts: a list of M IMTs
+    :param gsims: a list of G GSIMs
+    :returns:
+        an array of shape (2, N, M, G) with means and stddevs, N being
+        the total number of sites affected by the ruptures
+    """
+    vec = [g for g, gsim in enumerate(gsims) if gsim.vectorized]
+    if len(ctxs) == 1 or not vec:
+        return numpy.concatenate([
+            base.get_mean_std(sctx, rctx, dctx, imts, gsims)
+            for rctx, sctx, dctx in ctxs], axis=1)
+    N = sum(len(ctx[1].sids) for ctx in ctxs)
+    arr = numpy.zeros((2, N, len(imts), len(gsims)))
+    vgsims = [gsims[g] for g in vec]
+    rctx, sctx, dctx = stack_contexts(ctxs, vgsims)
+    arr[:, :, :, vec] = base.get_mean_std(sctx, rctx, dctx, imts, vgsims)
+    other = [g for g in range(len(gsims)) if g not in vec]
+    if other:  # fallback for the non-vectorized GSIMs
+        ogsims = [gsims[g] for g in other]
+        arr[:, :, :, other] = numpy.concatenate([
+            base.get_mean_std(sctx, rctx, dctx, imts, ogsims)
+            for rctx, sctx, dctx in ctxs], axis=1)
+    return arr
+
+
 class RupData(object):
     """
     A class to collect rupture information into an array
@@ -144,6 +209,7 @@ class ContextMaker(object):
         self.maximum_distance = (
             param.get('maximum_distance') or IntegrationDistance({}))
         self.trunclevel = param.get('truncation_level')
+        self.truncnorm_table = param.get('truncnorm_table', False)
         self.effect = param.get('effect')
         for req in self.REQUIRES:
             reqset = set()
@@ -266,6 +332,14 @@ class ContextMaker(object):
         """
         :returns: a list of triples (rctx, sctx, dctx)
         """
+        if not self.reqv and all(
+                isinstance(rup.surface, PlanarSurface) for rup in ruptures):
+            # compute the distances of blocks of ruptures with a single call
+            ctxs = []
+            blocksize = max(MAX_DISTANCES // len(sites), 1)
+            for block in block_splitter(ruptures, blocksize):
+                ctxs.extend(self._make_planar_ctxs(block, sites))
+            return ctxs
         ctxs = []
         for rup in ruptures:
             try:
@@ -275,6 +349,40 @@ class ContextMaker(object):
             ctxs.append((rup, sctx, dctx))
         return ctxs
 
+    def _make_planar_ctxs(self, ruptures, sites):
+        # same as make_contexts, but for many planar ruptures at once
+        corners = numpy.array([  # shape (R, 4, 3)
+            numpy.column_stack([rup.surface.corner_lons,
+                                rup.surface.corner_lats,
+                                rup.surface.corner_depths])
+            for rup in ruptures])
+        strikes = numpy.array([rup.surface.strike for rup in ruptures])
+        params = self.REQUIRES_DISTANCES | {self.filter_distance}
+        dists = get_planar_distances(
+            corners, strikes, sites, params & PLANAR_DISTANCES)
+        ctxs = []
+        for r, rup in enumerate(ruptures):
+            if self.filter_distance in dists:
+                distances = dists[self.filter_distance][r]
+            else:
+                distances = get_distances(rup, sites, self.filter_distance)
+            mask = distances <= self.maximum_distance(
+                rup.tectonic_region_type, rup.mag)
+            if not mask.any():
+                continue
+            r_sites = sites.filter(mask)
+            dctx = DistancesContext()
+            for param in params:
+                if param in dists:
+                    dist = dists[param][r, mask]
+                    dist.flags.writeable = False
+                else:
+                    dist = get_distances(rup, r_sites, param)
+                setattr(dctx, param, dist)
+            self.add_rup_params(rup)
+            ctxs.append((rup, r_sites, dctx))
+        return ctxs
+
     def max_intensity(self, onesite, mags, dists):
         """
         :param onesite: a SiteCollection instance with a single site
@@ -336,7 +444,7 @@ class ContextMaker(object):
 
         rdata = {k: numpy.array(v) for k, v in rup_data.items()}
         rdata['grp_id'] = numpy.uint16(rup_data['grp_id'])
-        extra = dict(totrups=totrups)
+        extra = dict(totrups=totrups, avoided=pmaker.avoided)
         return pmap, rdata, calc_times, extra
 
 
@@ -371,23 +479,48 @@ class PmapMaker(object):
         self.poe_mon = cmaker.mon('get_poes', measuremem=False)
         self.pne_mon = cmaker.mon('composing pnes', measuremem=False)
         self.gmf_mon = cmaker.mon('computing mean_std', measuremem=False)
+        self.avoided = 0  # number of rupture-site distances not computed
 
-    def _sids_poes(self, rup, r_sites, dctx, srcid):
-        # return sids and poes of shape (N, L, G)
+    def _sids_poes(self, ctxs):
+        # return sids and poes of shape (N, L, G) for a block of contexts,
+        # N being the total number of sites affected by the ruptures
         # NB: this must be fast since it is inside an inner loop
         with self.gmf_mon:
-            mean_std = base.get_mean_std(  # shape (2, N, M, G)
-                r_sites, rup, dctx, self.imts, self.gsims)
+            mean_std = get_mean_stds(  # shape (2, N, M, G)
+                ctxs, self.imts, self.gsims)
+            sids = numpy.concatenate([ctx[1].sids for ctx in ctxs])
         with self.poe_mon:
             ll = self.loglevels
-            poes = base.get_poes(mean_std, ll, self.trunclevel, self.gsims)
+            poes = base.get_poes(mean_std, ll, self.trunclevel, self.gsims,
+                                 self.truncnorm_table)
             for g, gsim in enumerate(self.gsims):
                 for m, imt in enumerate(ll):
                     if hasattr(gsim, 'weight') and gsim.weight[imt] == 0:
                         # set by the engine when parsing the gsim logictree;
                         # when 0 ignore the gsim: see _build_trts_branches
                         poes[:, ll(imt), g] = 0
-            return r_sites.sids, poes
+            return sids, poes
+
+    def _get_pnes(self, ctxs, poes):
+        # return the probabilities of no exceedence for a block of contexts,
+        # computed with a single call when the ruptures are parametric
+        rups = [ctx[0] for ctx in ctxs]
+        nsites = [len(ctx[1].sids) for ctx in ctxs]
+        rates = numpy.repeat([rup.occurrence_rate for rup in rups], nsites)
+        toms = set(getattr(rup, 'temporal_occurrence_model', None)
+                   for rup in rups)
+        if len(toms) == 1 and None not in toms and not numpy.isnan(
+                rates).any():
+            [tom] = toms
+            return tom.get_probability_no_exceedance(
+                rates[:, None, None], poes)
+        pnes = numpy.zeros_like(poes)
+        start = 0
+        for rup, n in zip(rups, nsites):
+            slc = slice(start, start + n)
+            pnes[slc] = rup.get_probability_no_exceedance(poes[slc])
+            start += n
+        return pnes
 
     def _update(self, pmap, pm, src):
         if self.rup_indep:
@@ -409,14 +542,24 @@ class PmapMaker(object):
         :returns: the probability map generated by the source
         """
         with self.cmaker.mon('iter_ruptures', measuremem=False):
-            self.mag_rups = [
-                (mag, list(rups)) for mag, rups in itertools.groupby(
-                    src.iter_ruptures(shift_hypo=self.shift_hypo),
-                    key=operator.attrgetter('mag'))]
+            if hasattr(src, 'get_planar'):  # point-like source
+                # the ruptures are kept in an array and instantiated
+                # only if they are close to the sites, see _close_sites
+                planar = src.get_planar(self.shift_hypo)
+                cuts = numpy.flatnonzero(numpy.diff(planar['mag'])) + 1
+                self.mag_rups = [(arr['mag'][0], arr) for arr in
+                                 numpy.split(planar, cuts) if len(arr)]
+            else:
+                self.mag_rups = [
+                    (mag, list(rups)) for mag, rups in itertools.groupby(
+                        src.iter_ruptures(shift_hypo=self.shift_hypo),
+                        key=operator.attrgetter('mag'))]
         rupdata = RupData(self.cmaker)
         totrups, numrups, nsites = 0, 0, 0
         L, G = len(self.imtls.array), len(self.gsims)
         poemap = ProbabilityMap(L, G)
+        # max number of rupture-site pairs per block
+        maxsize = max(MAX_BLOCK_SIZE // (L * G), 1)
         for rups, sites in self._gen_rups_sites(src, sites):
             with self.ctx_mon:
                 ctxs = self.cmaker.make_ctxs(rups, sites)
@@ -424,19 +567,24 @@ class PmapMaker(object):
                     totrups += len(ctxs)
                     ctxs = self.collapse(ctxs)
                     numrups += len(ctxs)
-            for rup, r_sites, dctx in ctxs:
-                if self.fewsites:  # store rupdata
+            if self.fewsites:  # store rupdata
+                for rup, r_sites, dctx in ctxs:
                     rupdata.add(rup, r_sites, dctx)
-                sids, poes = self._sids_poes(rup, r_sites, dctx, src.id)
+            # all the ruptures in the same magnitude bin are managed together
+            for block in block_splitter(
+                    ctxs, maxsize, lambda ctx: len(ctx[1].sids)):
+                sids, poes = self._sids_poes(block)
                 with self.pne_mon:
-                    pnes = rup.get_probability_no_exceedance(poes)
+                    pnes = self._get_pnes(block, poes)
                     if self.rup_indep:
-                        for sid, pne in zip(sids, pnes):
-                            poemap.setdefault(sid, self.rup_indep).array *= pne
+                        poemap.update_at(sids, pnes, numpy.multiply, 1.)
                     else:
-                        for sid, pne in zip(sids, pnes):
-                            poemap.setdefault(sid, self.rup_indep).array += (
-                                1.-pne) * rup.weight
+                        weights = numpy.repeat(
+                            [ctx[0].weight for ctx in block],
+                            [len(ctx[1].sids) for ctx in block])
+                        poemap.update_at(
+                            sids, (1. - pnes) * weights[:, None, None],
+                            numpy.add, 0.)
                 nsites += len(sids)
         poemap.totrups = totrups
         poemap.numrups = numrups
@@ -478,31 +626,89 @@ class PmapMaker(object):
             new_ctxs.extend(_collapse_ctxs(vals))
         return new_ctxs
 
+    def _close_sites(self, src, mag, rups, sites):
+        # magnitude-dependent prefiltering with the KD-tree of the sites:
+        # a site within the maximum distance from a planar rupture is
+        # within the maximum distance plus the size of the rupture from
+        # its hypocenter; returns the close ruptures (instantiating them
+        # if they are in a planar array) and the close sites, or None
+        from openquake.hazardlib.source.point import (
+            planar_dt, planar_ruptures)  # avoid a circular import
+        sitecol = self.srcfilter.sitecol
+        if isinstance(rups, numpy.ndarray):  # planar_dt records
+            planar = rups
+        elif sitecol is not None and all(
+                isinstance(rup.surface, PlanarSurface) for rup in rups):
+            planar = numpy.zeros(len(rups), planar_dt)
+            for rec, rup in zip(planar, rups):
+                hypo = rup.hypocenter
+                surface = rup.surface
+                rec['hypo'] = hypo.longitude, hypo.latitude, hypo.depth
+                rec['corners'] = numpy.column_stack(
+                    [surface.corner_lons, surface.corner_lats,
+                     surface.corner_depths])
+        else:
+            return rups, sites
+        if sitecol is None:
+            ok_rups = numpy.ones(len(planar), bool)
+        else:
+            mdist = self.maximum_distance(src.tectonic_region_type, mag)
+            hxyz = spherical_to_cartesian(*planar['hypo'].T)  # shape (R, 3)
+            cxyz = spherical_to_cartesian(  # shape (R, 4, 3)
+                *planar['corners'].transpose(2, 0, 1))
+            sizes = numpy.sqrt(((cxyz - hxyz[:, None]) ** 2).sum(axis=2))
+            # 1% + 1 km of tolerance for the approximations in the distances
+            radii = (mdist + sizes.max(axis=1)) * 1.01 + 1.
+            idxs = sitecol.kdtree('xyz').query_ball_point(hxyz, radii)
+            flat = numpy.concatenate(idxs).astype(int)
+            ridx = numpy.repeat(numpy.arange(len(planar)),
+                                [len(idx) for idx in idxs])
+            inside = numpy.zeros(len(sitecol), bool)
+            inside[numpy.searchsorted(sitecol.sids, sites.sids)] = True
+            hit = inside[flat]
+            ok_rups = numpy.bincount(ridx[hit], minlength=len(planar)) > 0
+            close = numpy.unique(flat[hit])
+            self.avoided += (len(sites) * len(planar) -
+                             len(close) * ok_rups.sum())
+            if not ok_rups.any():
+                return None
+            sites = sites.filtered(
+                numpy.searchsorted(sites.sids, sitecol.sids[close]))
+        if planar is rups:
+            rups = list(planar_ruptures(
+                planar[ok_rups], src.tectonic_region_type,
+                src.temporal_occurrence_model))
+        else:
+            rups = [rup for rup, ok in zip(rups, ok_rups) if ok]
+        return rups, sites
+
     def _gen_rups_sites(self, src, sites):
         loc = getattr(src, 'location', None)
-        rupsites = ((rups, sites) for mag, rups in self.mag_rups)
-        if loc:
-            # implements pointsource_distance: finite site effects
-            # are ignored for sites over that distance, if any
-            simple = src.count_nphc() == 1  # no nodal plane/hypocenter distrib
-            if simple or not self.pointsource_distance:
-                yield from rupsites  # there is nothing to collapse
-            else:
-                weights, depths = zip(*src.hypocenter_distribution.data)
-                loc = copy.copy(loc)  # average hypocenter used in sites.split
-                loc.depth = numpy.average(depths, weights=weights)
-                for mag, rups in self.mag_rups:
-                    pdist = self.pointsource_distance.get('%.3f' % mag)
-                    close, far = sites.split(loc, pdist)
-                    if close is None:  # all is far
-                        yield _collapse(rups), far
-                    elif far is None:  # all is close
-                        yield rups, close
-                    else:  # some sites are far, some are close
-                        yield _collapse(rups), far
-                        yield rups, close
-        else:  # no point source or site-specific analysis
-            yield from rupsites
+        # implements pointsource_distance: finite site effects
+        # are ignored for sites over that distance, if any
+        collapse = (loc and self.pointsource_distance and
+                    src.count_nphc() > 1)  # nodal plane/hypocenter distrib
+        if collapse:
+            weights, depths = zip(*src.hypocenter_distribution.data)
+            loc = copy.copy(loc)  # average hypocenter used in sites.split
+            loc.depth = numpy.average(depths, weights=weights)
+        for mag, rups in self.mag_rups:
+            close = self._close_sites(src, mag, rups, sites)
+            if close is None:  # all sites are too distant
+                continue
+            rups, close_sites = close
+            if not collapse:  # there is nothing to collapse
+                yield rups, close_sites
+                continue
+            pdist = self.pointsource_distance.get('%.3f' % mag)
+            close, far = close_sites.split(loc, pdist)
+            if close is None:  # all is far
+                yield _collapse(rups), far
+            elif far is None:  # all is close
+                yield rups, close
+            else:  # some sites are far, some are close
+                yield _collapse(rups), far
+                yield rups, close
 
 
 class BaseContext(metaclass=abc.ABCMeta):
@@ -609,7 +815,8 @@ class RuptureContext(BaseContext):
     GSIM class is required to declare what :attr:`rupture parameters
     <GroundShakingIntensityModel.REQUIRES_RUPTURE_PARAMETERS>` does it need.
     Only those required parameters are made available in a result context
-    object.
+    object. For the GSIMs with a true ``vectorized`` flag the parameters
+    can also be arrays aligned with the sites, see :func:`stack_contexts`.
     """
     _slots_ = (
         'mag', 'strike', 'dip', 'rake', 'ztor', 'hypo_lon', 'hypo_lat',
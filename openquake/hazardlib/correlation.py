@@ -18,7 +18,108 @@ Module :mod:`openquake.hazardlib.correlation` defines correlation models for
 spatially-distributed ground-shaking intensities.
 """
 import abc
+import logging
 import numpy
+from scipy import sparse
+from scipy.spatial import cKDTree
+from scipy.sparse.linalg import spsolve
+from openquake.hazardlib.geo import geodetic
+
+#: default number of neighbours used by :class:`NearestNeighboursFactor`
+NUM_NEIGHBOURS = 40
+#: max number of correlations computed together when building the factor
+MAX_BLOCK_SIZE = 10 ** 6
+#: max number of NearestNeighboursFactors cached per IMT
+MAX_CACHED_FACTORS = 100
+
+
+def _arc(xyz1, xyz2):
+    # great circle distances from the chords between points on the surface
+    chords = numpy.sqrt(((xyz1 - xyz2) ** 2).sum(axis=-1))
+    return 2 * geodetic.EARTH_RADIUS * numpy.arcsin(
+        numpy.minimum(chords / (2 * geodetic.EARTH_RADIUS), 1))
+
+
+def _previous_neighbours(xyz, m):
+    # returns the indices of the m nearest neighbours of each point among
+    # the points preceding it, with a mask of the valid indices; the points
+    # having not enough previous ones among their 2m + 1 nearest neighbours
+    # are searched again in a tree containing only the points up to them
+    n = len(xyz)
+    nbrs = numpy.zeros((n, m), int)
+    valid = numpy.zeros((n, m), bool)
+    need = numpy.arange(n)
+    while len(need):
+        size = need[-1] + 1
+        k = min(2 * m + 1, size)
+        _, idx = cKDTree(xyz[:size]).query(xyz[need], k)
+        idx = idx.reshape(len(need), k)
+        prev = idx < need[:, None]
+        done = (prev.sum(axis=1) >= numpy.minimum(m, need)) | (k == size)
+        # the previous points first, in order of distance
+        first = numpy.argsort(~prev[done], axis=1, kind='stable')[:, :m]
+        nbrs[need[done]] = numpy.take_along_axis(idx[done], first, 1)
+        valid[need[done]] = numpy.take_along_axis(prev[done], first, 1)
+        need = need[~done]
+    nbrs[~valid] = 0
+    return nbrs, valid
+
+
+class NearestNeighboursFactor(object):
+    """
+    Sparse approximation of the lower triangular factor of a correlation
+    matrix, obtained by conditioning the residual of each site on the
+    residuals of its `num_neighbours` nearest neighbours among the preceding
+    sites (Vecchia approximation). The sites are taken in a fixed random
+    order, the memory and the time are linear in the number of sites and
+    the approximation is exact if `num_neighbours` >= number of sites - 1.
+
+    :param lons: longitudes of the sites
+    :param lats: latitudes of the sites
+    :param correlation: a function distances -> correlation coefficients
+    :param num_neighbours: the number of neighbours for each site
+    """
+    def __init__(self, lons, lats, correlation,
+                 num_neighbours=NUM_NEIGHBOURS):
+        n = len(lons)
+        m = min(num_neighbours, n - 1)
+        self.order = numpy.random.RandomState(42).permutation(n)
+        xyz = geodetic.spherical_to_cartesian(
+            lons[self.order], lats[self.order])
+        nbrs, valid = _previous_neighbours(xyz, m)
+        coeffs = numpy.zeros((n, m))
+        self.stds = numpy.ones(n)
+        blocksize = max(MAX_BLOCK_SIZE // (m * m + 1), 1)
+        for start in range(0, n, blocksize):
+            slc = slice(start, start + blocksize)
+            nxyz, val = xyz[nbrs[slc]], valid[slc]
+            # correlations between the neighbours, with an identity block
+            # for the missing ones, which then get a zero coefficient
+            cnn = correlation(_arc(nxyz[:, :, None], nxyz[:, None, :]))
+            cnn[~(val[:, :, None] & val[:, None, :])] = 0
+            cnn[:, numpy.arange(m), numpy.arange(m)] = 1
+            # correlations between the sites and their neighbours
+            csn = correlation(_arc(xyz[slc, None], nxyz))
+            csn[~val] = 0
+            if m:
+                coeffs[slc] = numpy.linalg.solve(cnn, csn[:, :, None])[..., 0]
+            self.stds[slc] = numpy.sqrt(numpy.maximum(
+                1. - (coeffs[slc] * csn).sum(axis=1), 0))
+        rows = numpy.repeat(numpy.arange(n), m)[valid.flatten()]
+        self.matrix = sparse.identity(n, format='csc') - sparse.csc_matrix(
+            (coeffs[valid], (rows, nbrs[valid])), (n, n))
+
+    def __matmul__(self, residuals):
+        """
+        :param residuals: an array of shape (N, S) in the original order
+        :returns: the correlated residuals, an array of shape (N, S)
+        """
+        res = residuals.reshape(len(self.order), -1)[self.order]
+        corr = spsolve(self.matrix, self.stds[:, None] * res,
+                       permc_spec='NATURAL').reshape(res.shape)
+        out = numpy.empty_like(corr)
+        out[self.order] = corr
+        return out.reshape(residuals.shape)
 
 
 class BaseCorrelationModel(metaclass=abc.ABCMeta):
@@ -49,7 +150,13 @@ class BaseCorrelationModel(metaclass=abc.ABCMeta):
         NB: the correlation matrix is cached. It is computed only once
         per IMT for the complete site collection and then the portion
         corresponding to the sites is multiplied by the residuals.
+        If the model has a nonzero `num_neighbours` the Cholesky factor
+        is replaced by a :class:`NearestNeighboursFactor`, which is an
+        approximation built on the given sites only and cached per IMT
+        and site IDs.
         """
+        if self.num_neighbours:
+            return self._apply_sparse_factor(sites, imt, residuals)
         # intra-event residual for a single relization is a product
         # of lower-triangle decomposed correlation matrix and vector
         # of N random numbers (where N is equal to number of sites).
@@ -73,6 +180,28 @@ class BaseCorrelationModel(metaclass=abc.ABCMeta):
         else:  # complete site collection
             return corma @ residuals  # shape (N, s)
 
+    def _apply_sparse_factor(self, sites, imt, residuals):
+        # multiply the residuals by the NearestNeighboursFactor of the
+        # given sites, so that the cost scales with the affected sites and
+        # not with the complete site collection; the factors are cached
+        # per IMT and site IDs, keeping the MAX_CACHED_FACTORS most recent
+        factors = self.cache.setdefault((imt, 'sparse'), {})
+        key = sites.sids.tobytes()
+        try:
+            factor = factors.pop(key)
+        except KeyError:
+            logging.debug('Approximating the correlation of %d sites for %s '
+                          'with %d neighbours', len(sites), imt,
+                          self.num_neighbours)
+            factor = NearestNeighboursFactor(
+                sites.lons, sites.lats,
+                lambda dists: self._get_correlation_matrix(dists, imt),
+                self.num_neighbours)
+            if len(factors) >= MAX_CACHED_FACTORS:  # discard the oldest
+                del factors[next(iter(factors))]
+        factors[key] = factor  # now the most recent
+        return factor @ residuals
+
 
 class JB2009CorrelationModel(BaseCorrelationModel):
     """
@@ -84,9 +213,13 @@ class JB2009CorrelationModel(BaseCorrelationModel):
         Boolean value to indicate whether "Case 1" or "Case 2" from page 1700
         should be applied. ``True`` value means that Vs 30 values show or are
         expected to show clustering ("Case 2"), ``False`` means otherwise.
+    :param num_neighbours:
+        If nonzero, approximate the correlation with a
+        :class:`NearestNeighboursFactor` with that number of neighbours
     """
-    def __init__(self, vs30_clustering):
+    def __init__(self, vs30_clustering, num_neighbours=0):
         self.vs30_clustering = vs30_clustering
+        self.num_neighbours = num_neighbours
         self.cache = {}  # imt -> correlation model
 
     def _get_correlation_matrix(self, sites, imt):
@@ -159,9 +292,13 @@ class HM2018CorrelationModel(BaseCorrelationModel):
         Value to be multiplied by the uncertainty in the correlation parameter
         beta. If uncertainty_multiplier = 0 (default), the median value is
         used as a constant value.
+    :param num_neighbours:
+        If nonzero and there is no uncertainty, approximate the correlation
+        with a :class:`NearestNeighboursFactor` with that number of neighbours
     """
-    def __init__(self, uncertainty_multiplier=0):
+    def __init__(self, uncertainty_multiplier=0, num_neighbours=0):
         self.uncertainty_multiplier = uncertainty_multiplier
+        self.num_neighbours = num_neighbours
         self.distance_matrix = {}
         self.cache = {}
 
@@ -191,6 +328,11 @@ class HM2018CorrelationModel(BaseCorrelationModel):
             # For this, every row of 'residuals' (every site) is divided by its
             # corresponding standard deviation element.
             residuals_norm = residuals / stddev_intra[sites.sids, None]
+            if self.num_neighbours:
+                # the Cholesky factor of diag(std) @ corma @ diag(std)
+                # is diag(std) @ cholesky(corma)
+                return stddev_intra[sites.sids, None] * (
+                    self._apply_sparse_factor(sites, imt, residuals_norm))
 
             # Lower diagonal of the Cholesky decomposition from/to cache
             try:
@@ -31,6 +31,113 @@ from openquake.hazardlib.geo.nodalplane import NodalPlane
 from openquake.hazardlib.geo import utils as geo_utils
 from openquake.baselib.slots import with_slots
 
+MAX_DISTANCES = 10 ** 6  # max number of rupture-site distances per block
+PLANAR_DISTANCES = frozenset(['rrup', 'rjb', 'rx', 'ry0'])
+
+
+def _rrup(corners, xyz):
+    # vectorized version of PlanarSurface.get_min_distance
+    tl, tr, bl, br = geo_utils.spherical_to_cartesian(
+        corners[:, :, 0], corners[:, :, 1], corners[:, :, 2]).transpose(
+            1, 0, 2)  # each one of shape (R, 3)
+    normal = geo_utils.normalized(numpy.cross(tl - tr, tl - bl))
+    d = - (normal * tl).sum(axis=-1)
+    uv1 = geo_utils.normalized(tr - tl)
+    uv2 = numpy.cross(normal, uv1)
+
+    def project(points):  # points of shape (R, N, 3)
+        dists = (normal[:, None] * points).sum(axis=-1) + d[:, None]
+        vectors2d = points - normal[:, None] * dists[:, :, None] - tl[:, None]
+        return (dists, (vectors2d * uv1[:, None]).sum(axis=-1),
+                (vectors2d * uv2[:, None]).sum(axis=-1))
+    _, xx, yy = project(numpy.stack([tl, tr, bl, br], axis=1))
+    length = ((xx[:, 1] - xx[:, 0] + xx[:, 3] - xx[:, 2]) / 2.)[:, None]
+    width = ((yy[:, 2] - yy[:, 0] + yy[:, 3] - yy[:, 1]) / 2.)[:, None]
+    dists, xx, yy = project(numpy.broadcast_to(xyz, (len(tl),) + xyz.shape))
+    mxx = numpy.where(xx < 0, xx, numpy.where(xx > length, xx - length, 0))
+    myy = numpy.where(yy < 0, yy, numpy.where(yy > width, yy - width, 0))
+    return numpy.sqrt(dists ** 2 + mxx ** 2 + myy ** 2)
+
+
+def _arc(corners, corner, azimuths, lons, lats):
+    # distances to the great circle arcs passing through a corner
+    return geodetic.distance_to_arc(
+        corners[:, corner, 0:1], corners[:, corner, 1:2],
+        azimuths[:, None], lons, lats)
+
+
+def _rjb(corners, strikes, lons, lats, xyz):
+    # vectorized version of PlanarSurface.get_joyner_boore_distance
+    downdip = (strikes + 90) % 360
+    ds1, ds2, ds3, ds4 = arcs = [
+        _arc(corners, 0, strikes, lons, lats),
+        _arc(corners, 2, strikes, lons, lats),
+        _arc(corners, 0, downdip, lons, lats),
+        _arc(corners, 1, downdip, lons, lats)]
+    cxyz = geo_utils.spherical_to_cartesian(
+        corners[:, :, 0], corners[:, :, 1])  # shape (R, 4, 3)
+    dists_to_corners = numpy.min([
+        numpy.sqrt(((cxyz[:, c, None] - xyz) ** 2).sum(axis=-1))
+        for c in range(4)], axis=0)
+    same12 = numpy.sign(ds1) == numpy.sign(ds2)
+    same34 = numpy.sign(ds3) == numpy.sign(ds4)
+    return numpy.select(
+        [same12 & same34, same12, same34],
+        [dists_to_corners,
+         numpy.fmin(numpy.abs(arcs[0]), numpy.abs(arcs[1])),
+         numpy.fmin(numpy.abs(arcs[2]), numpy.abs(arcs[3]))], default=0)
+
+
+def _ry0(corners, strikes, lons, lats):
+    # vectorized version of PlanarSurface.get_ry0_distance
+    downdip = (strikes + 90.) % 360
+    dst1 = _arc(corners, 0, downdip, lons, lats)
+    dst2 = _arc(corners, 1, downdip, lons, lats)
+    return numpy.where(numpy.sign(dst1) == numpy.sign(dst2),
+                       numpy.fmin(numpy.abs(dst1), numpy.abs(dst2)), 0)
+
+
+def get_planar_distances(corners, strikes, mesh, params):
+    """
+    Compute the distances between many planar surfaces and many sites
+    at once, by processing blocks of at most MAX_DISTANCES pairs.
+
+    :param corners:
+        an array of shape (R, 4, 3) with the longitudes, latitudes and
+        depths of the corners top left, top right, bottom left, bottom right
+    :param strikes:
+        an array of R strikes
+    :param mesh:
+        a :class:`openquake.hazardlib.geo.mesh.Mesh` or a site collection
+        with N points
+    :param params:
+        a subset of PLANAR_DISTANCES
+    :returns:
+        a dictionary param -> array of shape (R, N)
+    """
+    lons = mesh.lons.flatten()
+    lats = mesh.lats.flatten()
+    xyz = mesh.xyz
+    R, N = len(corners), len(lons)
+    out = {param: numpy.zeros((R, N)) for param in params}
+    blocksize = max(MAX_DISTANCES // max(N, 1), 1)
+    for start in range(0, R, blocksize):
+        slc = slice(start, start + blocksize)
+        crn, stk = corners[slc], strikes[slc]
+        for param in params:
+            if param == 'rrup':
+                dist = _rrup(crn, xyz)
+            elif param == 'rjb':
+                dist = _rjb(crn, stk, lons, lats, xyz)
+            elif param == 'rx':
+                dist = _arc(crn, 0, stk, lons, lats)
+            elif param == 'ry0':
+                dist = _ry0(crn, stk, lons, lats)
+            else:
+                raise ValueError('Unknown planar distance %r' % param)
+            out[param][slc] = dist
+    return out
+
 
 @with_slots
 class PlanarSurface(BaseSurface):
@@ -22,7 +22,6 @@ to several geographical primitives and some other low-level spatial operations.
 """
 import math
 import logging
-import operator
 import collections
 
 import numpy
@@ -142,7 +141,7 @@ class _GeographicObjects(object):
         Associated a list of assets by site to the site collection used
         to instantiate GeographicObjects.
 
-        :param assets_by_sites: a list of lists of assets
+        :param assets_by_sites: a list of arrays of assets
         :param assoc_dist: the maximum distance for association
         :param mode: 'strict', 'warn' or 'filter'
         :param asset_ref: ID of the assets are a list of strings
@@ -155,27 +154,29 @@ class _GeographicObjects(object):
         assets_by_sid = collections.defaultdict(list)
         discarded = []
         for assets in assets_by_site:
-            lon, lat = assets[0].location
+            lon, lat = assets[0]['lon'], assets[0]['lat']
             obj, distance = self.get_closest(lon, lat)
             if distance <= assoc_dist:
                 # keep the assets, otherwise discard them
-                assets_by_sid[obj['sids']].extend(assets)
+                assets_by_sid[obj['sids']].append(assets)
             elif mode == 'strict':
                 raise SiteAssociationError(
                     'There is nothing closer than %s km '
                     'to site (%s %s)' % (assoc_dist, lon, lat))
             else:
-                discarded.extend(assets)
+                discarded.append(assets)
         sids = sorted(assets_by_sid)
         if not sids:
             raise SiteAssociationError(
                 'Could not associate any site to any assets within the '
                 'asset_hazard_distance of %s km' % assoc_dist)
-        assets_by_site = [
-            sorted(assets_by_sid[sid], key=operator.attrgetter('ordinal'))
-            for sid in sids]
-        data = [(asset_refs[asset.ordinal],) + asset.location
-                for asset in discarded]
+        assets_by_site = []
+        for sid in sids:
+            assets = numpy.concatenate(assets_by_sid[sid])
+            assets_by_site.append(
+                assets[numpy.argsort(assets['ordinal'], kind='stable')])
+        data = [(asset_refs[asset['ordinal']], asset['lon'], asset['lat'])
+                for assets in discarded for asset in assets]
         discarded = numpy.array(data, asset_dt)
         return self.objects.filtered(sids), assets_by_site, discarded
 
@@ -185,8 +186,8 @@ def assoc(objects, sitecol, assoc_dist, mode, asset_refs=()):
     Associate geographic objects to a site collection.
 
     :param objects:
-        something with .lons, .lats or ['lon'] ['lat'], or a list of lists
-        of objects with a .location attribute (i.e. assets_by_site)
+        something with .lons, .lats or ['lon'] ['lat'], or a list of arrays
+        with fields ordinal, lon, lat (i.e. assets_by_site)
     :param assoc_dist:
         the maximum distance for association
     :param mode:
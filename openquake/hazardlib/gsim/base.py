@@ -46,6 +46,9 @@ ADMITTED_SET_PARAMETERS = ['DEFINED_FOR_INTENSITY_MEASURE_TYPES',
                            'REQUIRES_SITES_PARAMETERS',
                            'REQUIRES_RUPTURE_PARAMETERS']
 
+TRUNCNORM_STEP = 1E-3  # step of the tabulated survival function
+TRUNCNORM_MAX = 10.  # tabulation range for the untruncated case
+
 registry = {}  # GSIM name -> GSIM class
 gsim_aliases = {}  # populated for instance in nbcc2015_AA13.py
 
@@ -94,19 +97,16 @@ def get_mean_std(sctx, rctx, dctx, imts, gsims):
     num_tables = CoeffsTable.num_instances
     for g, gsim in enumerate(gsims):
         d = dctx.roundup(gsim.minimum_distance)
-        for m, imt in enumerate(imts):
-            mean, [std] = gsim.get_mean_and_stddevs(sctx, rctx, d, imt,
-                                                    [const.StdDev.TOTAL])
-            arr[0, :, m, g] = mean
-            arr[1, :, m, g] = std
-            if CoeffsTable.num_instances > num_tables:
-                raise RuntimeError('Instantiating CoeffsTable inside '
-                                   '%s.get_mean_and_stddevs' %
-                                   gsim.__class__.__name__)
+        arr[:, :, :, g] = gsim.get_mean_stds(sctx, rctx, d, imts)
+        if CoeffsTable.num_instances > num_tables:
+            raise RuntimeError('Instantiating CoeffsTable inside '
+                               '%s.get_mean_and_stddevs' %
+                               gsim.__class__.__name__)
     return arr
 
 
-def get_poes(mean_std, loglevels, truncation_level, gsims=()):
+def get_poes(mean_std, loglevels, truncation_level, gsims=(),
+             tabulated=False):
     """
     Calculate and return probabilities of exceedance (PoEs) of one or more
     intensity measure levels (IMLs) of one intensity measure type (IMT)
@@ -136,6 +136,11 @@ def get_poes(mean_std, loglevels, truncation_level, gsims=()):
         value and is defined in units of sigmas. The resulting PoEs
         for that mode are values of complementary cumulative distribution
         function of that truncated Gaussian applied to IMLs.
+    :param gsims:
+        The list of G GSIMs corresponding to the last axis of mean_std
+    :param tabulated:
+        If True, use the approximated survival function
+        :func:`_truncnorm_sf_tab` instead of the exact one
 
     :returns:
         array of PoEs of shape (N, L, G)
@@ -164,22 +169,26 @@ def get_poes(mean_std, loglevels, truncation_level, gsims=()):
                     ms = numpy.array(mean_std[:, :, :, g])  # make a copy
                     for m in range(len(loglevels)):
                         ms[0, :, m] += s * gsim.adjustment
-                    outs.append(_get_poes(ms, loglevels, tl, squeeze=1))
+                    outs.append(_get_poes(ms, loglevels, tl, squeeze=1,
+                                          tabulated=tabulated))
                 arr[:, :, g] = numpy.average(outs, weights=weights, axis=0)
             else:
                 ms = mean_std[:, :, :, g]
-                arr[:, :, g] = _get_poes(ms, loglevels, tl, squeeze=1)
+                arr[:, :, g] = _get_poes(ms, loglevels, tl, squeeze=1,
+                                         tabulated=tabulated)
         return arr
     else:
         # regular case
-        return _get_poes(mean_std, loglevels, truncation_level)
+        return _get_poes(mean_std, loglevels, truncation_level,
+                         tabulated=tabulated)
 
 
 # this is the critical function for the performance of the classical calculator
 # it is dominated by memory allocations (i.e. _truncnorm_sf is ultra-fast)
 # the only way to speedup is to reduce the maximum_distance, then the array
 # will become shorted in the N dimension (number of affected sites)
-def _get_poes(mean_std, loglevels, truncation_level, squeeze=False):
+def _get_poes(mean_std, loglevels, truncation_level, squeeze=False,
+              tabulated=False):
     mean, stddev = mean_std  # shape (N, M, G) each
     N, L, G = len(mean), len(loglevels.array), mean.shape[-1]
     out = numpy.zeros((N, L) if squeeze else (N, L, G))
@@ -191,6 +200,8 @@ def _get_poes(mean_std, loglevels, truncation_level, squeeze=False):
             else:
                 out[:, lvl] = (iml - mean[:, m]) / stddev[:, m]
             lvl += 1
+    if tabulated:
+        return _truncnorm_sf_tab(truncation_level, out)
     return _truncnorm_sf(truncation_level, out)
 
 
@@ -310,6 +321,10 @@ class GroundShakingIntensityModel(metaclass=MetaGSIM):
     non_verified = False
     experimental = False
     adapted = False
+    #: True if :meth:`get_mean_and_stddevs` accepts rupture parameters
+    #: given as arrays aligned with the sites, see
+    #: :func:`openquake.hazardlib.contexts.stack_contexts`
+    vectorized = False
     get_poes = staticmethod(get_poes)
 
     @classmethod
@@ -398,6 +413,25 @@ class GroundShakingIntensityModel(metaclass=MetaGSIM):
         compute interim steps).
         """
 
+    def get_mean_stds(self, sctx, rctx, dctx, imts):
+        """
+        :returns:
+            an array of shape (2, N, M) with the means and the total
+            standard deviations for the given M IMTs
+
+        By default :meth:`get_mean_and_stddevs` is called once per IMT;
+        GSIMs sharing intermediate results between the IMTs can override
+        this method, for instance by reading all the coefficients at once
+        with :meth:`CoeffsTable.get_coeffs`.
+        """
+        arr = numpy.zeros((2, len(sctx.sids), len(imts)))
+        for m, imt in enumerate(imts):
+            mean, [std] = self.get_mean_and_stddevs(
+                sctx, rctx, dctx, imt, [const.StdDev.TOTAL])
+            arr[0, :, m] = mean
+            arr[1, :, m] = std
+        return arr
+
     def _check_imt(self, imt):
         """
         Make sure that ``imt`` is valid and is supported by this GSIM.
@@ -492,6 +526,50 @@ def _truncnorm_sf(truncation_level, values):
     return ((phi_b - ndtr(values)) / z).clip(0.0, 1.0)
 
 
+@functools.lru_cache()
+def _truncnorm_table(truncation_level):
+    # tabulate the survival function on a regular grid with step
+    # TRUNCNORM_STEP; returns the values, the increments and the range
+    tl = TRUNCNORM_MAX if truncation_level is None else truncation_level
+    n = int(numpy.ceil(2 * tl / TRUNCNORM_STEP))
+    sf = _truncnorm_sf(truncation_level, numpy.linspace(-tl, tl, n + 1))
+    return sf, numpy.diff(sf), tl
+
+
+def _truncnorm_sf_tab(truncation_level, values):
+    """
+    Approximated version of :func:`_truncnorm_sf`, performing a linear
+    interpolation on a precomputed table with step ``TRUNCNORM_STEP``.
+    Since the second derivative of the normal CDF is bounded by
+    ``phi(1) = 0.242``, the absolute error is bounded by
+    ``0.242 * TRUNCNORM_STEP ** 2 / 8 / Z`` with ``Z = CDF(b) - CDF(a)``,
+    i.e. 3E-8 for the default step and a truncation level of 3.
+    In the untruncated case the values are clipped at ``TRUNCNORM_MAX``,
+    which adds an error below 1E-23.
+
+    >>> x = numpy.linspace(-4, 4, 101)
+    >>> err = numpy.abs(_truncnorm_sf_tab(3, x) - _truncnorm_sf(3, x))
+    >>> bool(err.max() < 3.1E-8)
+    True
+    """
+    if truncation_level == 0:
+        return values
+    sf, dsf, tl = _truncnorm_table(truncation_level)
+    nsteps = len(dsf)
+    x = numpy.clip(values, -tl, tl)
+    nan = numpy.isnan(x)  # NaNs survive the clipping
+    x[nan] = 0
+    x += tl
+    x *= nsteps / (2 * tl)
+    idx = x.astype(numpy.int64)
+    numpy.minimum(idx, nsteps - 1, out=idx)
+    x -= idx  # fractional part
+    out = sf[idx]
+    out += dsf[idx] * x
+    out[nan] = numpy.nan  # propagate them, as in _truncnorm_sf
+    return out
+
+
 def to_distribution_values(vals, imt):
     """
     :returns: the logarithm of the values unless the IMT is MMI
@@ -642,6 +720,18 @@ class CoeffsTable(object):
         ...
     KeyError: SA(0.01)
 
+    The coefficients for several IMTs can be extracted at once, as a
+    structured array with a field for each coefficient; the array is cached
+    and can be used to compute all the IMTs in a single expression:
+
+    >>> arr = ct.get_coeffs((imt.PGA(), imt.SA(period=0.2, damping=5)))
+    >>> arr.dtype.names
+    ('a', 'b', 'c', 'd')
+    >>> print(arr['a'])
+    [1.         7.29073004]
+    >>> arr is ct.get_coeffs((imt.PGA(), imt.SA(period=0.2, damping=5)))
+    True
+
     It is also possible to instantiate a table from a tuple of dictionaries,
     corresponding to the SA coefficients and non-SA coefficients:
 
@@ -657,6 +747,7 @@ class CoeffsTable(object):
         if 'table' not in kwargs:
             raise TypeError('CoeffsTable requires "table" kwarg')
         self._coeffs = {}  # cache
+        self._arrays = {}  # cache imts -> structured array
         table = kwargs.pop('table')
         self.sa_coeffs = {}
         self.non_sa_coeffs = {}
@@ -755,3 +846,27 @@ class CoeffsTable(object):
             co: (min_above[co] - max_below[co]) * ratio + max_below[co]
             for co in max_below}
         return c
+
+    def get_coeffs(self, imts):
+        """
+        :param imts: a sequence of M IMTs
+        :returns:
+            a structured array of shape M with a field for each coefficient,
+            interpolated if needed and cached
+
+        :raises KeyError:
+            If one of the IMTs is not available in the table and no
+            interpolation can be done.
+        """
+        imts = tuple(imts)  # lists are accepted too
+        try:
+            return self._arrays[imts]
+        except KeyError:
+            pass
+        rows = [self[imt] for imt in imts]
+        dt = numpy.dtype([(name, float) for name in rows[0]])
+        arr = numpy.array([tuple(row[name] for name in dt.names)
+                           for row in rows], dt)
+        arr.flags.writeable = False
+        self._arrays[imts] = arr
+        return arr
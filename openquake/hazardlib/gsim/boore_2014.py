@@ -82,6 +82,8 @@ class BooreEtAl2014(GMPE):
     #: Required distance measure is Rjb
     REQUIRES_DISTANCES = {'rjb'}
 
+    vectorized = True
+
     def get_mean_and_stddevs(self, sites, rup, dists, imt, stddev_types):
         """
         See :meth:`superclass method
@@ -100,6 +102,27 @@ class BooreEtAl2014(GMPE):
         stddevs = self._get_stddevs(C, rup, dists, sites, stddev_types)
         return mean, stddevs
 
+    def get_mean_stds(self, sites, rup, dists, imts):
+        """
+        Same as :meth:`get_mean_and_stddevs` on all the IMTs, but the PGA
+        on rock is computed once and the coefficients are read in a single
+        cached lookup.
+        """
+        if (type(self).get_mean_and_stddevs is not
+                BooreEtAl2014.get_mean_and_stddevs):  # overridden formula
+            return super().get_mean_stds(sites, rup, dists, imts)
+        pga_rock = self._get_pga_on_rock(self.COEFFS[PGA()], rup, dists)
+        arr = np.zeros((2, len(sites.vs30), len(imts)))
+        for m, C in enumerate(self.COEFFS.get_coeffs(imts)):
+            imt_per = 0 if imts[m].name == 'PGV' else imts[m].period
+            arr[0, :, m] = (
+                self._get_magnitude_scaling_term(C, rup) +
+                self._get_path_scaling(C, dists, rup.mag) +
+                self._get_site_scaling(C, pga_rock, sites, imt_per, dists.rjb))
+            [arr[1, :, m]] = self._get_stddevs(
+                C, rup, dists, sites, [const.StdDev.TOTAL])
+        return arr
+
     def _get_pga_on_rock(self, C, rup, dists):
         """
         Returns the median PGA on rock, which is a sum of the
@@ -113,10 +136,9 @@ class BooreEtAl2014(GMPE):
         Returns the magnitude scling term defined in equation (2)
         """
         dmag = rup.mag - C["Mh"]
-        if rup.mag <= C["Mh"]:
-            mag_term = (C["e4"] * dmag) + (C["e5"] * (dmag ** 2.0))
-        else:
-            mag_term = C["e6"] * dmag
+        mag_term = np.where(rup.mag <= C["Mh"],
+                            (C["e4"] * dmag) + (C["e5"] * (dmag ** 2.0)),
+                            C["e6"] * dmag)
         return self._get_style_of_faulting_term(C, rup) + mag_term
 
     def _get_style_of_faulting_term(self, C, rup):
@@ -130,15 +152,10 @@ class BooreEtAl2014(GMPE):
         Note that the 'Unspecified' case is not considered here as
         rake is always given.
         """
-        if np.abs(rup.rake) <= 30.0 or (180.0 - np.abs(rup.rake)) <= 30.0:
-            # strike-slip
-            return C["e1"]
-        elif rup.rake > 30.0 and rup.rake < 150.0:
-            # reverse
-            return C["e3"]
-        else:
-            # normal
-            return C["e2"]
+        strike_slip = ((np.abs(rup.rake) <= 30.0) |
+                       ((180.0 - np.abs(rup.rake)) <= 30.0))
+        reverse = (rup.rake > 30.0) & (rup.rake < 150.0)
+        return np.select([strike_slip, reverse], [C["e1"], C["e3"]], C["e2"])
 
     def _get_path_scaling(self, C, dists, mag):
         """
@@ -215,27 +232,20 @@ class BooreEtAl2014(GMPE):
         Returns the inter-event standard deviation (tau), which is dependent
         on magnitude
         """
-        base_vals = np.zeros(num_sites)
-        if mag <= 4.5:
-            return base_vals + C["t1"]
-        elif mag >= 5.5:
-            return base_vals + C["t2"]
-        else:
-            return base_vals + C["t1"] + (C["t2"] - C["t1"]) * (mag - 4.5)
+        tau = np.where(mag <= 4.5, C["t1"], np.where(
+            mag >= 5.5, C["t2"], C["t1"] + (C["t2"] - C["t1"]) * (mag - 4.5)))
+        return np.zeros(num_sites) + tau
 
     def _get_intra_event_phi(self, C, mag, rjb, vs30, num_sites):
         """
         Returns the intra-event standard deviation (phi), dependent on
         magnitude, distance and vs30
         """
-        base_vals = np.zeros(num_sites)
         # Magnitude Dependent phi (Equation 17)
-        if mag <= 4.5:
-            base_vals += C["f1"]
-        elif mag >= 5.5:
-            base_vals += C["f2"]
-        else:
-            base_vals += (C["f1"] + (C["f2"] - C["f1"]) * (mag - 4.5))
+        base_vals = np.zeros(num_sites) + np.where(
+            mag <= 4.5, C["f1"], np.where(
+                mag >= 5.5, C["f2"],
+                C["f1"] + (C["f2"] - C["f1"]) * (mag - 4.5)))
         # Distance dependent phi (Equation 16)
         idx1 = rjb > C["R2"]
         base_vals[idx1] += C["DfR"]
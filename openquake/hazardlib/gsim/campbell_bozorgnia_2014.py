@@ -25,7 +25,7 @@ Module exports :class:`CampbellBozorgnia2014`
                :class:`CampbellBozorgnia2014LowQJapanSite`
 """
 import numpy as np
-from math import exp, radians, cos
+from math import exp
 from openquake.hazardlib.gsim.base import GMPE, CoeffsTable
 from openquake.hazardlib import const
 from openquake.hazardlib.imt import PGA, PGV, SA
@@ -88,6 +88,8 @@ class CampbellBozorgnia2014(GMPE):
     #: Required distance measures are Rrup, Rjb and Rx
     REQUIRES_DISTANCES = {'rrup', 'rjb', 'rx'}
 
+    vectorized = True
+
     def get_mean_and_stddevs(self, sites, rup, dists, imt, stddev_types):
         """
         See :meth:`superclass method
@@ -148,15 +150,14 @@ class CampbellBozorgnia2014(GMPE):
         Returns the magnitude scaling term defined in equation 2
         """
         f_mag = C["c0"] + C["c1"] * mag
-        if (mag > 4.5) and (mag <= 5.5):
-            return f_mag + (C["c2"] * (mag - 4.5))
-        elif (mag > 5.5) and (mag <= 6.5):
-            return f_mag + (C["c2"] * (mag - 4.5)) + (C["c3"] * (mag - 5.5))
-        elif mag > 6.5:
-            return f_mag + (C["c2"] * (mag - 4.5)) + (C["c3"] * (mag - 5.5)) +\
-                (C["c4"] * (mag - 6.5))
-        else:
-            return f_mag
+        return np.select(
+            [(mag > 4.5) & (mag <= 5.5), (mag > 5.5) & (mag <= 6.5),
+             mag > 6.5],
+            [f_mag + (C["c2"] * (mag - 4.5)),
+             f_mag + (C["c2"] * (mag - 4.5)) + (C["c3"] * (mag - 5.5)),
+             f_mag + (C["c2"] * (mag - 4.5)) + (C["c3"] * (mag - 5.5)) +
+             (C["c4"] * (mag - 6.5))],
+            f_mag)
 
     def _get_geometric_attenuation_term(self, C, mag, rrup):
         """
@@ -169,23 +170,12 @@ class CampbellBozorgnia2014(GMPE):
         """
         Returns the style-of-faulting scaling term defined in equations 4 to 6
         """
-        if (rup.rake > 30.0) and (rup.rake < 150.):
-            frv = 1.0
-            fnm = 0.0
-        elif (rup.rake > -150.0) and (rup.rake < -30.0):
-            fnm = 1.0
-            frv = 0.0
-        else:
-            fnm = 0.0
-            frv = 0.0
+        frv = np.where((rup.rake > 30.0) & (rup.rake < 150.), 1.0, 0.0)
+        fnm = np.where((rup.rake > -150.0) & (rup.rake < -30.0), 1.0, 0.0)
 
         fflt_f = (self.CONSTS["c8"] * frv) + (C["c9"] * fnm)
-        if rup.mag <= 4.5:
-            fflt_m = 0.0
-        elif rup.mag > 5.5:
-            fflt_m = 1.0
-        else:
-            fflt_m = rup.mag - 4.5
+        fflt_m = np.where(rup.mag <= 4.5, 0.0, np.where(
+            rup.mag > 5.5, 1.0, rup.mag - 4.5))
         return fflt_f * fflt_m
 
     def _get_hanging_wall_term(self, C, rup, dists):
@@ -204,15 +194,15 @@ class CampbellBozorgnia2014(GMPE):
         Returns the hanging wall r-x caling term defined in equation 7 to 12
         """
         # Define coefficients R1 and R2
-        r_1 = rup.width * cos(radians(rup.dip))
-        r_2 = 62.0 * rup.mag - 350.0
         fhngrx = np.zeros(len(r_x))
+        r_1 = rup.width * np.cos(np.radians(rup.dip)) + fhngrx
+        r_2 = 62.0 * rup.mag - 350.0 + fhngrx
         # Case when 0 <= Rx <= R1
         idx = np.logical_and(r_x >= 0., r_x < r_1)
-        fhngrx[idx] = self._get_f1rx(C, r_x[idx], r_1)
+        fhngrx[idx] = self._get_f1rx(C, r_x[idx], r_1[idx])
         # Case when Rx > R1
         idx = r_x >= r_1
-        f2rx = self._get_f2rx(C, r_x[idx], r_1, r_2)
+        f2rx = self._get_f2rx(C, r_x[idx], r_1[idx], r_2[idx])
         f2rx[f2rx < 0.0] = 0.0
         fhngrx[idx] = f2rx
         return fhngrx
@@ -244,21 +234,16 @@ class CampbellBozorgnia2014(GMPE):
         """
         Returns the hanging wall magnitude term defined in equation 14
         """
-        if mag < 5.5:
-            return 0.0
-        elif mag > 6.5:
-            return 1.0 + C["a2"] * (mag - 6.5)
-        else:
-            return (mag - 5.5) * (1.0 + C["a2"] * (mag - 6.5))
+        return np.select(
+            [mag < 5.5, mag > 6.5],
+            [0.0, 1.0 + C["a2"] * (mag - 6.5)],
+            (mag - 5.5) * (1.0 + C["a2"] * (mag - 6.5)))
 
     def _get_hanging_wall_coeffs_ztor(self, ztor):
         """
         Returns the hanging wall ztor term defined in equation 15
         """
-        if ztor <= 16.66:
-            return 1.0 - 0.06 * ztor
-        else:
-            return 0.0
+        return np.where(ztor <= 16.66, 1.0 - 0.06 * ztor, 0.0)
 
     def _get_hanging_wall_coeffs_dip(self, dip):
         """
@@ -270,31 +255,22 @@ class CampbellBozorgnia2014(GMPE):
         """
         Returns the hypocentral depth scaling term defined in equations 21 - 23
         """
-        if rup.hypo_depth <= 7.0:
-            fhyp_h = 0.0
-        elif rup.hypo_depth > 20.0:
-            fhyp_h = 13.0
-        else:
-            fhyp_h = rup.hypo_depth - 7.0
+        fhyp_h = np.where(rup.hypo_depth <= 7.0, 0.0, np.where(
+            rup.hypo_depth > 20.0, 13.0, rup.hypo_depth - 7.0))
 
-        if rup.mag <= 5.5:
-            fhyp_m = C["c17"]
-        elif rup.mag > 6.5:
-            fhyp_m = C["c18"]
-        else:
-            fhyp_m = C["c17"] + ((C["c18"] - C["c17"]) * (rup.mag - 5.5))
+        fhyp_m = np.where(rup.mag <= 5.5, C["c17"], np.where(
+            rup.mag > 6.5, C["c18"],
+            C["c17"] + ((C["c18"] - C["c17"]) * (rup.mag - 5.5))))
         return fhyp_h * fhyp_m
 
     def _get_fault_dip_term(self, C, rup):
         """
         Returns the fault dip term, defined in equation 24
         """
-        if rup.mag < 4.5:
-            return C["c19"] * rup.dip
-        elif rup.mag > 5.5:
-            return 0.0
-        else:
-            return C["c19"] * (5.5 - rup.mag) * rup.dip
+        return np.select(
+            [rup.mag < 4.5, rup.mag > 5.5],
+            [C["c19"] * rup.dip, 0.0],
+            C["c19"] * (5.5 - rup.mag) * rup.dip)
 
     def _get_anelastic_attenuation_term(self, C, rrup):
         """
@@ -420,24 +396,18 @@ class CampbellBozorgnia2014(GMPE):
         Returns the inter-event random effects coefficient (tau)
         Equation 28.
         """
-        if mag <= 4.5:
-            return C["tau1"]
-        elif mag >= 5.5:
-            return C["tau2"]
-        else:
-            return C["tau2"] + (C["tau1"] - C["tau2"]) * (5.5 - mag)
+        return np.where(mag <= 4.5, C["tau1"], np.where(
+            mag >= 5.5, C["tau2"],
+            C["tau2"] + (C["tau1"] - C["tau2"]) * (5.5 - mag)))
 
     def _get_philny(self, C, mag):
         """
         Returns the intra-event random effects coefficient (phi)
         Equation 28.
         """
-        if mag <= 4.5:
-            return C["phi1"]
-        elif mag >= 5.5:
-            return C["phi2"]
-        else:
-            return C["phi2"] + (C["phi1"] - C["phi2"]) * (5.5 - mag)
+        return np.where(mag <= 4.5, C["phi1"], np.where(
+            mag >= 5.5, C["phi2"],
+            C["phi2"] + (C["phi1"] - C["phi2"]) * (5.5 - mag)))
 
     def _get_alpha(self, C, vs30, pga_rock):
         """
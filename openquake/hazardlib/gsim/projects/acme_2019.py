@@ -17,7 +17,6 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import math
 import numpy as np
 from openquake.hazardlib import const
 from openquake.hazardlib.gsim.base import GMPE, registry, CoeffsTable
@@ -136,20 +135,17 @@ class ChiouYoungs2014ACME2019(ChiouYoungs2014):
         Implements eq. 13a.
         """
         # Reverse faulting flag
-        Frv = 1. if 30 <= rup.rake <= 150 else 0.
+        Frv = np.where((30 <= rup.rake) & (rup.rake <= 150), 1., 0.)
         # Normal faulting flag
-        Fnm = 1. if -120 <= rup.rake <= -60 else 0.
+        Fnm = np.where((-120 <= rup.rake) & (rup.rake <= -60), 1., 0.)
         # A part in eq. 11
-        mag_test1 = np.cosh(2. * max(rup.mag - 4.5, 0))
+        mag_test1 = np.cosh(2. * np.maximum(rup.mag - 4.5, 0))
         # Centered DPP
         centered_dpp = 0
         # Centered Ztor
         centered_ztor = 0
         #
-        dist_taper = np.fmax(1 - (np.fmax(dists.rrup - 40,
-                                  np.zeros_like(dists)) / 30.),
-                             np.zeros_like(dists))
-        dist_taper = dist_taper.astype(np.float64)
+        dist_taper = np.fmax(1 - (np.fmax(dists.rrup - 40, 0.) / 30.), 0.)
         ln_y_ref = (
             # first part of eq. 11
             C['c1']
@@ -157,7 +153,7 @@ class ChiouYoungs2014ACME2019(ChiouYoungs2014):
             + (C['c1b'] + C['c1d'] / mag_test1) * Fnm
             + (C['c7'] + C['c7b'] / mag_test1) * centered_ztor
             + (C['c11'] + C['c11b'] / mag_test1) *
-            np.cos(math.radians(rup.dip)) ** 2
+            np.cos(np.radians(rup.dip)) ** 2
             # second part
             + C['c2'] * (rup.mag - 6)
             + ((C['c2'] - C['c3']) / C['cn'])
@@ -165,18 +161,19 @@ class ChiouYoungs2014ACME2019(ChiouYoungs2014):
             # third part
             + C['c4']
             * np.log(dists.rrup + C['c5']
-                     * np.cosh(C['c6'] * max(rup.mag - C['chm'], 0)))
+                     * np.cosh(C['c6'] * np.maximum(rup.mag - C['chm'], 0)))
             + (C['c4a'] - C['c4'])
             * np.log(np.sqrt(dists.rrup ** 2 + C['crb'] ** 2))
             # forth part
-            + (C['cg1'] + C['cg2'] / (np.cosh(max(rup.mag - C['cg3'], 0))))
+            + (C['cg1'] + C['cg2'] /
+               np.cosh(np.maximum(rup.mag - C['cg3'], 0)))
             * dists.rrup
             # fifth part
             + C['c8'] * dist_taper
-            * min(max(rup.mag - 5.5, 0) / 0.8, 1.0)
+            * np.minimum(np.maximum(rup.mag - 5.5, 0) / 0.8, 1.0)
             * np.exp(-1 * C['c8a'] * (rup.mag - C['c8b']) ** 2) * centered_dpp
             # sixth part
-            # + C['c9'] * Fhw * np.cos(math.radians(rup.dip)) *
+            # + C['c9'] * Fhw * np.cos(np.radians(rup.dip)) *
             # (C['c9a'] + (1 - C['c9a']) * np.tanh(dists.rx / C['c9b']))
             # * (1 - np.sqrt(dists.rjb ** 2 + rup.ztor ** 2)
             #   / (dists.rrup + 1.0))
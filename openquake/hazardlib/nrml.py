@@ -76,6 +76,7 @@ import re
 import sys
 import logging
 import operator
+import itertools
 import collections.abc
 
 import numpy
@@ -224,6 +225,48 @@ def get_source_model_05(node, fname, converter=default):
     return SourceModel(sorted(groups), node.get('name'), itime, stime)
 
 
+def _is_source(ancestors, node):
+    # True for the children of a sourceModel (NRML 0.4) or of a
+    # sourceGroup inside a sourceModel (NRML 0.5)
+    return (1 < len(ancestors) < 4 and
+            striptag(ancestors[1].tag) == 'sourceModel' and
+            striptag(ancestors[-1].tag) in ('sourceModel', 'sourceGroup') and
+            striptag(node.tag) != 'sourceGroup')
+
+
+def _lazy_nodes(pairs, sm_node):
+    # yield the subnodes of the source model, with lazy sourceGroup nodes
+    for _, grp in itertools.groupby(pairs, lambda pair: id(pair[0][-1])):
+        ancestors, node = next(grp)
+        nodes = itertools.chain([node], (n for _, n in grp))
+        parent = ancestors[-1]
+        if parent is sm_node:
+            yield from nodes
+        else:
+            yield Node(parent.tag, parent.attrib, nodes=nodes,
+                       lineno=parent.lineno)
+
+
+def stream_source_model(fname, converter=default):
+    """
+    Convert a NRML file into a Python object, like :func:`to_python`, but
+    parsing and converting the sources one at the time, so that for source
+    models the memory occupation is bounded by the size of the largest
+    source and not by the size of the file.
+    """
+    pairs = iterparse(fname, _is_source)
+    ancestors, node = next(pairs)
+    if not ancestors:  # there are no sources, node is the nrml node
+        [node] = node
+        return node_to_obj(node, fname, converter)
+    sm_node = ancestors[1]
+    pairs = itertools.chain([(ancestors, node)], itertools.takewhile(
+        operator.itemgetter(0), pairs))  # discard the last pair
+    lazy = Node(sm_node.tag, sm_node.attrib, nodes=_lazy_nodes(pairs, sm_node),
+                lineno=sm_node.lineno)
+    return node_to_obj(lazy, fname, converter)
+
+
 validators = {
     'backarc': valid.boolean,
     'strike': valid.strike_range,
@@ -306,6 +349,33 @@ validators = {
 }
 
 
+def _get_key(cache, fname, converter):
+    # checksum of the file contents, of the conversion parameters and of
+    # the code of the converter
+    params = sorted((k, repr(v)) for k, v in vars(converter).items()
+                    if k not in ('fname', 'cache'))
+    return cache.get_key(params, fnames=[fname, __file__,
+                                         sourceconverter.__file__])
+
+
+def _read_source_model(fname, converter):
+    if fname.endswith(('.xml', '.nrml')):
+        sm = stream_source_model(fname, converter)
+    else:
+        raise ValueError('Unrecognized extension in %s' % fname)
+    sm.fname = fname
+
+    # check investigation time for NonParametricSeismicSources
+    cit = converter.investigation_time
+    np = [s for sg in sm.src_groups for s in sg if hasattr(s, 'data')]
+    if np and sm.investigation_time != cit:
+        raise ValueError(
+            'The source model %s contains an investigation_time '
+            'of %s, while the job.ini has %s' % (
+                fname, sm.investigation_time, cit))
+    return sm
+
+
 def read_source_models(fnames, converter):
     """
     :param fnames:
@@ -314,22 +384,29 @@ def read_source_models(fnames, converter):
         a :class:`openquake.hazardlib.sourceconverter.SourceConverter` instance
     :yields:
         SourceModel instances
+
+    If `converter.cache` is set, the converted source models are pickled
+    there, with a key depending on the file contents, on the parameters
+    and on the code of the converter; the attribute `.cached` of the
+    yielded source models is True if they were read from the cache.
     """
+    cache = getattr(converter, 'cache', None)  # None in old pickles
     for fname in fnames:
-        if fname.endswith(('.xml', '.nrml')):
-            sm = to_python(fname, converter)
-        else:
-            raise ValueError('Unrecognized extension in %s' % fname)
-        sm.fname = fname
-
-        # check investigation time for NonParametricSeismicSources
-        cit = converter.investigation_time
-        np = [s for sg in sm.src_groups for s in sg if hasattr(s, 'data')]
-        if np and sm.investigation_time != cit:
-            raise ValueError(
-                'The source model %s contains an investigation_time '
-                'of %s, while the job.ini has %s' % (
-                    fname, sm.investigation_time, cit))
+        if not cache:
+            sm = _read_source_model(fname, converter)
+            sm.cached = False
+            yield sm
+            continue
+        key = _get_key(cache, fname, converter)
+        sm = cache.get(key)
+        if sm is not None:
+            sm.fname = fname
+            sm.cached = True
+            yield sm
+            continue
+        sm = _read_source_model(fname, converter)
+        sm.cached = False
+        cache.put(key, sm)
         yield sm
 
 
@@ -353,6 +430,29 @@ def read(source, stop=None):
     return nrml
 
 
+def iterparse(source, select):
+    """
+    Parse a NRML file incrementally, yielding pairs (ancestors, node) for
+    the nodes satisfying `select(ancestors, node)`, which are not kept in
+    memory after being yielded. The last pair is ((), nrml_node).
+
+    :param source:
+        a file name or file object open for reading
+    :param select:
+        a function (ancestors, node) -> boolean
+    """
+    vparser = ValidatingXmlParser(validators)
+    for ancestors, node in vparser.parse_iter(source, select):
+        nrml = ancestors[0] if ancestors else node
+        if striptag(nrml.tag) != 'nrml':
+            raise ValueError('%s: expected a node of kind nrml, got %s' %
+                             (source, nrml.tag))
+        if not ancestors:
+            nrml['xmlns'] = nrml.tag.split('}')[0][1:]
+            nrml['xmlns:gml'] = GML_NAMESPACE
+        yield ancestors, node
+
+
 def write(nodes, output=sys.stdout, fmt='%.7E', gml=True, xmlns=None):
     """
     Convert nodes into a NRML file. output must be a file
@@ -15,9 +15,9 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
-from openquake.baselib.python3compat import zip
 import numpy
 
+U32 = numpy.uint32
 F32 = numpy.float32
 F64 = numpy.float64
 BYTES_PER_FLOAT = 8
@@ -106,9 +106,9 @@ class ProbabilityCurve(object):
         return curve[0]
 
 
-class ProbabilityMap(dict):
+class ProbabilityMap(object):
     """
-    A dictionary site_id -> ProbabilityCurve. It defines the complement
+    A mapping site_id -> ProbabilityCurve. It defines the complement
     operator `~`, performing the complement on each curve
 
     ~p = 1 - p
@@ -117,12 +117,27 @@ class ProbabilityMap(dict):
 
     m = m1 | m2 = {sid: m1[sid] | m2[sid] for sid in all_sids}
 
-    Such operators are implemented efficiently at the numpy level, by
-    dispatching on the underlying array. Moreover there is a classmethod
+    The map is stored as a sorted array of site IDs and a contiguous array
+    of shape (shape_x, shape_y, shape_z) = (N, L, I), where N is the number
+    of site IDs, L the total number of hazard levels and I the number of
+    GSIMs; all the operators are implemented as vectorized numpy operations
+    on such array. Moreover there is a classmethod
     .build(L, I, sids, initvalue) to build initialized instances of
-    :class:`ProbabilityMap`. The map can be represented as 3D array of shape
-    (shape_x, shape_y, shape_z) = (N, L, I), where N is the number of site IDs,
-    L the total number of hazard levels and I the number of GSIMs.
+    :class:`ProbabilityMap`.
+
+    The curves returned by `pmap[sid]` are views over the underlying
+    array, so that they can be modified in place. Curves added one at
+    the time with `pmap[sid] = pcurve` or `pmap.setdefault(sid, value)`
+    are kept aside and merged into the underlying array at the
+    first vectorized operation:
+
+    >>> pmap = ProbabilityMap.build(3, 1, sids=[0, 2])
+    >>> pmap[0].array[0] = .4
+    >>> pmap.setdefault(1, .1).array[2] = .5
+    >>> (pmap | pmap).array[:, :, 0]
+    array([[0.64, 0.  , 0.  ],
+           [0.19, 0.19, 0.75],
+           [0.  , 0.  , 0.  ]])
     """
     @classmethod
     def build(cls, shape_y, shape_z, sids, initvalue=0., dtype=F64):
@@ -133,9 +148,12 @@ class ProbabilityMap(dict):
         :param initvalue: the initial value of the probability (default 0)
         :returns: a ProbabilityMap dictionary
         """
+        if not isinstance(sids, numpy.ndarray):
+            sids = list(sids)
+        sids = numpy.unique(numpy.array(sids, U32))
         dic = cls(shape_y, shape_z)
-        for sid in sids:
-            dic.setdefault(sid, initvalue, dtype)
+        dic._init(sids, numpy.full((len(sids), shape_y, shape_z),
+                                   initvalue, dtype))
         return dic
 
     @classmethod
@@ -152,13 +170,59 @@ class ProbabilityMap(dict):
         if len(array.shape) == 2:  # shape (N, L) -> (N, L, 1)
             array = array.reshape(array.shape + (1,))
         self = cls(*array.shape[1:])
-        for sid, poes in zip(sids, array):
-            self[sid] = ProbabilityCurve(poes)
+        self._init(sids, array)
         return self
 
     def __init__(self, shape_y, shape_z=1):
         self.shape_y = shape_y
         self.shape_z = shape_z
+        self._init(numpy.zeros(0, U32), numpy.zeros((0, shape_y, shape_z)))
+
+    def _init(self, sids, array):
+        # set the underlying arrays, sorting them by site ID if needed
+        sids = numpy.array(sids, U32)
+        if len(sids) > 1 and (sids[1:] < sids[:-1]).any():
+            order = sids.argsort(kind='stable')
+            sids, array = sids[order], array[order]
+        self._sids = sids
+        self._array = array
+        self._pending = {}  # sid -> ProbabilityCurve not yet in the array
+
+    def _index(self, sids):
+        # returns the positions of the given sids in the underlying array
+        # and a boolean mask which is False for the missing sids
+        n = len(self._sids)
+        idx = numpy.searchsorted(self._sids, sids)
+        if n == 0:
+            return idx, numpy.zeros(idx.shape, bool)
+        found = self._sids[numpy.minimum(idx, n - 1)] == sids
+        return idx, found & (idx < n)
+
+    def _insert(self, sids, array):
+        # add new sids to the underlying array, keeping it sorted
+        if len(self._sids) == 0:
+            self._init(sids, array)
+            return
+        array = array.astype(self._array.dtype, copy=False)
+        sids = numpy.concatenate([self._sids, sids])
+        array = numpy.concatenate([self._array, array])
+        pending = self._pending
+        self._init(sids, array)
+        self._pending = pending
+
+    def _merge(self):
+        # move the curves added one at the time into the underlying array
+        if not self._pending:
+            return
+        shape = (self.shape_y, self.shape_z)
+        sids = numpy.fromiter(self._pending, U32, len(self._pending))
+        try:
+            array = numpy.array([pc.array.reshape(shape)
+                                 for pc in self._pending.values()])
+        except ValueError as exc:
+            raise ValueError('%s in %s' % (exc, self))
+        self._pending = {}
+        self._insert(sids, array)
 
     def setdefault(self, sid, value, dtype=F64):
         """
@@ -175,29 +239,135 @@ class ProbabilityMap(dict):
             array = numpy.empty((self.shape_y, self.shape_z), dtype)
             array.fill(value)
             pc = ProbabilityCurve(array)
-            self[sid] = pc
+            self._pending[sid] = pc
             return pc
 
+    def update_at(self, sids, arrays, ufunc, initvalue):
+        """
+        Compose the curves for the given site IDs with the given arrays
+        by using a binary ufunc, i.e. `numpy.multiply` for probabilities
+        of no exceedence or `numpy.add` for mutually exclusive probabilities.
+        The site IDs can be repeated, for instance when there are several
+        ruptures affecting the same sites; the missing curves are
+        initialized to `initvalue`.
+
+        :param sids: an array of K site IDs
+        :param arrays: an array of shape (K, L, I)
+        :param ufunc: a binary ufunc
+        :param initvalue: the initial value of the missing curves
+        """
+        if len(sids) == 0:
+            return
+        order = sids.argsort(kind='stable')
+        sids, arrays = sids[order], arrays[order]
+        starts, = numpy.where(numpy.diff(sids))
+        starts = numpy.concatenate([[0], starts + 1])
+        reduced = ufunc.reduceat(arrays, starts, axis=0)
+        usids = sids[starts]
+        self._merge()
+        idx, found = self._index(usids)
+        if not found.all():
+            missing = usids[~found]
+            self._insert(missing, numpy.full(
+                (len(missing),) + self._array.shape[1:], initvalue))
+            idx, found = self._index(usids)
+        self._array[idx] = ufunc(self._array[idx], reduced)
+
+    def __getitem__(self, sid):
+        try:
+            return self._pending[sid]
+        except KeyError:
+            idx, found = self._index(sid)
+            if not found:
+                raise KeyError(sid)
+            return ProbabilityCurve(self._array[idx])
+
+    def __setitem__(self, sid, pcurve):
+        idx, found = self._index(sid)
+        if found:
+            self._array[idx] = pcurve.array.reshape(self._array.shape[1:])
+        else:
+            self._pending[sid] = pcurve
+
+    def __contains__(self, sid):
+        return sid in self._pending or bool(self._index(sid)[1])
+
+    def __len__(self):
+        return len(self._sids) + len(self._pending)
+
+    def __iter__(self):
+        self._merge()
+        return iter(self._sids.tolist())
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def get(self, sid, default=None):
+        """
+        :returns: the ProbabilityCurve associated to the sid or the default
+        """
+        try:
+            return self[sid]
+        except KeyError:
+            return default
+
+    def keys(self):
+        """
+        :returns: the ordered list of site IDs
+        """
+        self._merge()
+        return self._sids.tolist()
+
+    def values(self):
+        """
+        :returns: the ProbabilityCurves, ordered by site ID
+        """
+        return [ProbabilityCurve(arr) for arr in self.array]
+
+    def items(self):
+        """
+        :returns: the pairs (sid, ProbabilityCurve), ordered by site ID
+        """
+        return list(zip(self.keys(), self.values()))
+
+    def update(self, other):
+        """
+        Replace or add the curves of another ProbabilityMap
+        """
+        other._merge()
+        self._merge()
+        idx, found = self._index(other._sids)
+        self._array[idx[found]] = other._array[found]
+        if not found.all():
+            self._insert(other._sids[~found], other._array[~found])
+
+    def copy(self):
+        """
+        :returns: a deep copy of the ProbabilityMap
+        """
+        self._merge()
+        new = self.__class__(self.shape_y, self.shape_z)
+        new._init(self._sids.copy(), self._array.copy())
+        return new
+
     @property
     def sids(self):
         """The ordered keys of the map as a numpy.uint32 array"""
-        return numpy.array(sorted(self), numpy.uint32)
+        self._merge()
+        return self._sids
 
     @property
     def array(self):
         """
         The underlying array of shape (N, L, I)
         """
-        return numpy.array([self[sid].array for sid in sorted(self)])
+        self._merge()
+        return self._array
 
     @property
     def nbytes(self):
         """The size of the underlying array"""
-        try:
-            N, L, I = get_shape([self])
-        except AllEmptyProbabilityMaps:
-            return 0
-        return BYTES_PER_FLOAT * N * L * I
+        return BYTES_PER_FLOAT * len(self) * self.shape_y * self.shape_z
 
     # used when exporting to HDF5
     def convert(self, imtls, nsites, idx=0):
@@ -212,23 +382,20 @@ class ProbabilityMap(dict):
         :param idx:
             index on the z-axis (default 0)
         """
+        self._merge()
         curves = numpy.zeros(nsites, imtls.dt)
         for imt in curves.dtype.names:
-            curves_by_imt = curves[imt]
-            for sid in self:
-                curves_by_imt[sid] = self[sid].array[imtls(imt), idx]
+            curves[imt][self._sids] = self._array[:, imtls(imt), idx]
         return curves
 
     def filter(self, sids):
         """
         Extracs a submap of self for the given sids.
         """
+        self._merge()
+        mask = numpy.isin(self._sids, numpy.array(list(sids), U32))
         dic = self.__class__(self.shape_y, self.shape_z)
-        for sid in sids:
-            try:
-                dic[sid] = self[sid]
-            except KeyError:
-                pass
+        dic._init(self._sids[mask], self._array[mask])
         return dic
 
     def extract(self, inner_idx):
@@ -236,11 +403,9 @@ class ProbabilityMap(dict):
         Extracts a component of the underlying ProbabilityCurves,
         specified by the index `inner_idx`.
         """
+        self._merge()
         out = self.__class__(self.shape_y, 1)
-        for sid in self:
-            curve = self[sid]
-            array = curve.array[:, inner_idx].reshape(-1, 1)
-            out[sid] = ProbabilityCurve(array)
+        out._init(self._sids.copy(), self._array[:, :, [inner_idx]])
         return out
 
     def __ior__(self, other):
@@ -249,103 +414,103 @@ class ProbabilityMap(dict):
         if (other.shape_y, other.shape_z) != (self.shape_y, self.shape_z):
             raise ValueError('%s has inconsistent shape with %s' %
                              (other, self))
-        self_sids = set(self)
-        other_sids = set(other)
-        for sid in self_sids & other_sids:
-            self[sid] = self[sid] | other[sid]
-        for sid in other_sids - self_sids:
-            self[sid] = other[sid]
+        other._merge()
+        self._merge()
+        idx, found = self._index(other._sids)
+        idx = idx[found]
+        self._array[idx] = 1. - (1. - self._array[idx]) * (
+            1. - other._array[found])
+        if not found.all():
+            self._insert(other._sids[~found], other._array[~found])
         return self
 
     def __or__(self, other):
-        new = self.__class__(self.shape_y, self.shape_z)
-        new.update(self)
+        new = self.copy()
         new |= other
         return new
 
     __ror__ = __or__
 
     def __add__(self, other):
-        try:
-            other.get
-            is_pmap = True
-            sids = set(self) | set(other)
-        except AttributeError:  # no .get method, assume a float
-            is_pmap = False
-            assert 0. <= other <= 1., other  # must be a probability
-            sids = set(self)
-        new = self.__class__(self.shape_y, self.shape_z)
-        for sid in sids:
-            prob = other.get(sid, 1) if is_pmap else other
-            new[sid] = self.get(sid, 1) + prob
+        new = self.copy()
+        new += other
         return new
 
     def __iadd__(self, other):
         # this is used when composing mutually exclusive probabilities
-        for sid in other:
-            pcurve = self.setdefault(sid, 0)
-            pcurve += other[sid]
+        self._merge()
+        if not isinstance(other, self.__class__):  # assume a float
+            assert 0. <= other <= 1., other  # must be a probability
+            self._array += other
+            return self
+        other._merge()
+        idx, found = self._index(other._sids)
+        self._array[idx[found]] += other._array[found]
+        if not found.all():
+            self._insert(other._sids[~found], other._array[~found])
         return self
 
     def __mul__(self, other):
-        try:
-            other.get
-            is_pmap = True
-            sids = set(self) | set(other)
-        except AttributeError:  # no .get method, assume a float
-            is_pmap = False
-            assert 0. <= other <= 1., other  # must be a probability
-            sids = set(self)
+        self._merge()
         new = self.__class__(self.shape_y, self.shape_z)
-        for sid in sids:
-            prob = other.get(sid, 1) if is_pmap else other
-            new[sid] = self.get(sid, 1) * prob
+        if not isinstance(other, self.__class__):  # assume a float
+            assert 0. <= other <= 1., other  # must be a probability
+            new._init(self._sids.copy(), self._array * other)
+            return new
+        # the missing curves are considered to be 1
+        other._merge()
+        sids = numpy.union1d(self._sids, other._sids)
+        array = numpy.ones((len(sids),) + self._array.shape[1:],
+                           numpy.result_type(self._array, other._array))
+        array[numpy.searchsorted(sids, self._sids)] = self._array
+        array[numpy.searchsorted(sids, other._sids)] *= other._array
+        new._init(sids, array)
         return new
 
+    __rmul__ = __mul__
+
     def __ipow__(self, n):
-        for sid, pcurve in self.items():
-            self[sid] = pcurve ** n
+        self._merge()
+        self._array **= n
         return self
 
     def __pow__(self, n):
+        self._merge()
         new = self.__class__(self.shape_y, self.shape_z)
-        for sid, pcurve in self.items():
-            new[sid] = pcurve ** n
+        new._init(self._sids.copy(), self._array ** n)
         return new
 
     def __invert__(self):
+        self._merge()
         new = self.__class__(self.shape_y, self.shape_z)
-        for sid in self:
-            if (self[sid].array != 1.).any():
-                new[sid] = ~self[sid]  # store only nonzero probabilities
+        # store only nonzero probabilities
+        ok = (self._array != 1.).any(axis=(1, 2))
+        new._init(self._sids[ok], 1. - self._array[ok])
         return new
 
     def __getstate__(self):
-        return dict(shape_y=self.shape_y, shape_z=self.shape_z)
+        # pickle the map as a single buffer
+        self._merge()
+        return dict(shape_y=self.shape_y, shape_z=self.shape_z,
+                    sids=self._sids, array=self._array)
+
+    def __setstate__(self, state):
+        self.shape_y = state['shape_y']
+        self.shape_z = state['shape_z']
+        self._init(state['sids'], state['array'])
 
     def __toh5__(self):
         # converts to an array of shape (num_sids, shape_y, shape_z)
-        size = len(self)
-        sids = self.sids
-        shape = (size, self.shape_y, self.shape_z)
-        array = numpy.zeros(shape, F64)
-        for i, sid in numpy.ndenumerate(sids):
-            try:
-                array[i] = self[sid].array
-            except ValueError as exc:
-                # this should never happen, but I got a could not broadcast
-                # input array once for Australia
-                raise ValueError('%s on site_id=%d' % (exc, sid))
-        return dict(array=array, sids=sids), {}
+        self._merge()
+        return dict(array=numpy.array(self._array, F64),
+                    sids=self._sids), {}
 
     def __fromh5__(self, dic, attrs):
         # rebuild the map from sids and probs arrays
         array = dic['array']
-        sids = dic['sids']
         self.shape_y = array.shape[1]
         self.shape_z = array.shape[2]
-        for sid, prob in zip(sids, array):
-            self[sid] = ProbabilityCurve(prob)
+        self._init(dic['sids'], array)
 
     def __repr__(self):
         return '<%s %d, %d, %d>' % (self.__class__.__name__, len(self),
@@ -359,11 +524,10 @@ def get_shape(pmaps):
     """
     for pmap in pmaps:
         if pmap:
-            sid = next(iter(pmap))
             break
     else:
         raise AllEmptyProbabilityMaps(pmaps)
-    return (len(pmap),) + pmap[sid].array.shape
+    return pmap.array.shape
 
 
 def combine(pmaps):
@@ -372,7 +536,11 @@ def combine(pmaps):
     :returns: the combined map
     """
     shape = get_shape(pmaps)
-    res = ProbabilityMap(shape[1], shape[2])
+    sids = numpy.unique(numpy.concatenate([pmap.sids for pmap in pmaps]))
+    # multiply the probabilities of no exceedence
+    pnes = numpy.ones((len(sids),) + shape[1:])
     for pmap in pmaps:
-        res |= pmap
+        pnes[numpy.searchsorted(sids, pmap.sids)] *= 1. - pmap.array
+    res = ProbabilityMap(shape[1], shape[2])
+    res._init(sids, 1. - pnes)
     return res
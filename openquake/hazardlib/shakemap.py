@@ -21,9 +21,10 @@ import math
 import json
 import zipfile
 import logging
+import functools
 import numpy
 from scipy.stats import truncnorm, norm
-from scipy import interpolate
+from scipy import sparse
 
 from openquake.hazardlib import geo, site, imt, correlation
 from openquake.hazardlib.shakemapconverter import get_shakemap_array
@@ -33,6 +34,10 @@ SHAKEMAP_URL = US_GOV + '/fdsnws/event/1/query?eventid={}&format=geojson'
 F32 = numpy.float32
 PCTG = 100  # percent of g, the gravity acceleration
 MAX_GMV = 5.  # 5 g
+AMP_GMVS = [0, 0.1, 0.2, 0.3, 0.4, 5]  # GMVs of the amplification factors
+#: max number of sites for the exact (dense) spatial factors; above it the
+#: correlation is approximated with correlation.NUM_NEIGHBOURS neighbours
+MAX_DENSE_SITES = 10000
 
 
 class DownloadFailed(Exception):
@@ -178,15 +183,52 @@ def spatial_covariance_array(stddev, corrmatrices):
     :returns: an array of shape (M, N, N)
     """
     # this depends on sPGA, sSa03, sSa10, sSa30
-    M, N = corrmatrices.shape[:2]
-    matrices = []
-    for i, std in enumerate(stddev):
-        covmatrix = numpy.zeros((N, N))
-        for j in range(N):
-            for k in range(N):
-                covmatrix[j, k] = corrmatrices[i, j, k] * std[j] * std[k]
-        matrices.append(covmatrix)
-    return numpy.array(matrices)
+    stddev = numpy.array(stddev)
+    return stddev[:, :, None] * corrmatrices * stddev[:, None, :]
+
+
+def spatial_factors(lons, lats, imts, correl='yes', vs30clustered=True,
+                    num_neighbours=0):
+    """
+    :param lons: longitudes of N sites
+    :param lats: latitudes of N sites
+    :param imts: M intensity measure types
+    :param correl: 'yes', 'no' or 'full'
+    :param vs30clustered: flag, True by default
+    :param num_neighbours: if nonzero, approximate the correlation
+    :returns:
+        M factors F such that F @ F.T is the spatial correlation matrix;
+        if `num_neighbours` is nonzero the factors are approximated with
+        :class:`openquake.hazardlib.correlation.NearestNeighboursFactor`,
+        so that the memory is linear in the number of sites
+
+    The exact factors are dense N x N Cholesky factors, so with
+    `correl='yes'` and more than MAX_DENSE_SITES sites the approximation
+    with NUM_NEIGHBOURS neighbours is used even if `num_neighbours` is 0.
+    """
+    assert correl in 'yes no full', correl
+    n = len(lons)
+    if correl == 'yes' and not num_neighbours and n > MAX_DENSE_SITES:
+        num_neighbours = correlation.NUM_NEIGHBOURS
+        logging.warning('The exact spatial correlation of %d sites requires '
+                        'matrices of %d x %d elements; approximating it '
+                        'with %d neighbours', n, n, n, num_neighbours)
+    if correl == 'no':
+        return [sparse.identity(n, format='csr')] * len(imts)
+    elif correl == 'full':  # all the sites get the first residual
+        ones = sparse.csr_matrix(
+            (numpy.ones(n), (numpy.arange(n), numpy.zeros(n, int))), (n, n))
+        return [ones] * len(imts)
+    elif num_neighbours:
+        return [correlation.NearestNeighboursFactor(
+            lons, lats, functools.partial(
+                correlation.jbcorrelation, imt=im,
+                vs30_clustering=vs30clustered), num_neighbours)
+                for im in imts]
+    dmatrix = geo.geodetic.distance_matrix(lons, lats)
+    return [numpy.linalg.cholesky(
+        correlation.jbcorrelation(dmatrix, im, vs30clustered))
+            for im in imts]
 
 
 def cross_correlation_matrix(imts, corr='yes'):
@@ -225,36 +267,27 @@ def amplify_gmfs(imts, vs30s, gmfs):
     Amplify the ground shaking depending on the vs30s
     """
     n = len(vs30s)
-    out = [amplify_ground_shaking(im.period, vs30s[i], gmfs[m * n + i])
-           for m, im in enumerate(imts) for i in range(n)]
-    return numpy.array(out)
+    out = [amplify_ground_shaking(im.period, vs30s[:, None],
+                                  gmfs[m * n:(m + 1) * n])
+           for m, im in enumerate(imts)]
+    return numpy.concatenate(out)
 
 
 def amplify_ground_shaking(T, vs30, gmvs):
     """
     :param T: period
-    :param vs30: velocity
+    :param vs30: velocity, a scalar or an array broadcastable with gmvs
     :param gmvs: ground motion values for the current site in units of g
     """
     gmvs[gmvs > MAX_GMV] = MAX_GMV  # accelerations > 5g are absurd
-    interpolator = interpolate.interp1d(
-        [0, 0.1, 0.2, 0.3, 0.4, 5],
-        [(760 / vs30)**0.35,
-         (760 / vs30)**0.35,
-         (760 / vs30)**0.25,
-         (760 / vs30)**0.10,
-         (760 / vs30)**-0.05,
-         (760 / vs30)**-0.05],
-    ) if T <= 0.3 else interpolate.interp1d(
-        [0, 0.1, 0.2, 0.3, 0.4, 5],
-        [(760 / vs30)**0.65,
-         (760 / vs30)**0.65,
-         (760 / vs30)**0.60,
-         (760 / vs30)**0.53,
-         (760 / vs30)**0.45,
-         (760 / vs30)**0.45],
-    )
-    return interpolator(gmvs) * gmvs
+    ratio = 760 / numpy.asarray(vs30)
+    exponents = [.35, .35, .25, .10, -.05, -.05] if T <= 0.3 else [
+        .65, .65, .60, .53, .45, .45]
+    # linear interpolation of the factors (760 / vs30) ** exponent
+    # at the points AMP_GMVS, as a sum over the hat functions
+    factors = sum(ratio ** exp * numpy.interp(gmvs, AMP_GMVS, hat)
+                  for exp, hat in zip(exponents, numpy.eye(len(AMP_GMVS))))
+    return factors * gmvs
 
 
 def cholesky(spatial_cov, cross_corr):
@@ -267,54 +300,77 @@ def cholesky(spatial_cov, cross_corr):
     """
     M, N = spatial_cov.shape[:2]
     L = numpy.array([numpy.linalg.cholesky(spatial_cov[i]) for i in range(M)])
-    LLT = []
-    for i in range(M):
-        row = [L[i] @ L[j].T * cross_corr[i, j] for j in range(M)]
-        for j in range(N):
-            singlerow = numpy.zeros(M * N)
-            for i in range(M):
-                singlerow[i * N:(i + 1) * N] = row[i][j]
-            LLT.append(singlerow)
-    return numpy.linalg.cholesky(numpy.array(LLT))
+    LLT = numpy.block([[L[i] @ L[j].T * cross_corr[i, j] for j in range(M)]
+                       for i in range(M)])
+    return numpy.linalg.cholesky(LLT)
 
 
-def to_gmfs(shakemap, spatialcorr, crosscorr, site_effects, trunclevel,
-            num_gmfs, seed, imts=None):
+def get_imts(shakemap, imts=None):
     """
-    :returns: (IMT-strings, array of GMFs of shape (R, N, E, M)
+    :param shakemap: a shakemap array
+    :param imts: the required IMT strings, or None for all of them
+    :returns: the IMT strings in the shakemap, checking their stddevs
     """
-    N = len(shakemap)  # number of sites
     std = shakemap['std']
     if imts is None or len(imts) == 0:
         imts = std.dtype.names
     else:
-        imts = [imt for imt in imts if imt in std.dtype.names]
-    val = {imt: numpy.log(shakemap['val'][imt]) for imt in imts}
-    imts_ = [imt.from_string(name) for name in imts]
-    M = len(imts_)
-    cross_corr = cross_correlation_matrix(imts_, crosscorr)
-    mu = numpy.array([numpy.ones(num_gmfs) * val[str(imt)][j]
-                      for imt in imts_ for j in range(N)])
-    dmatrix = geo.geodetic.distance_matrix(
-        shakemap['lon'], shakemap['lat'])
-    spatial_corr = spatial_correlation_array(dmatrix, imts_, spatialcorr)
-    stddev = [std[str(imt)] for imt in imts_]
-    for im, std in zip(imts_, stddev):
-        if std.sum() == 0:
+        imts = [im for im in imts if im in std.dtype.names]
+    for im in imts:
+        if std[im].sum() == 0:
             raise ValueError('Cannot decompose the spatial covariance '
                              'because stddev==0 for IMT=%s' % im)
-    spatial_cov = spatial_covariance_array(stddev, spatial_corr)
-    L = cholesky(spatial_cov, cross_corr)  # shape (M * N, M * N)
+    return imts
+
+
+def sample_gmfs(shakemap, imts, factors, cross_corr, site_effects,
+                trunclevel, num_gmfs, seed):
+    """
+    :param shakemap: a shakemap array with N sites
+    :param imts: M intensity measure types
+    :param factors: M spatial factors, as returned by `spatial_factors`
+    :param cross_corr: cross correlation matrix of shape (M, M)
+    :param site_effects: if True amplify the ground shaking
+    :param trunclevel: truncation level (or None)
+    :param num_gmfs: the number E of GMFs to generate
+    :param seed: random seed
+    :returns: array of GMFs of shape (N, E, M)
+    """
+    N, M = len(shakemap), len(imts)
     if trunclevel:
         Z = truncnorm.rvs(-trunclevel, trunclevel, loc=0, scale=1,
                           size=(M * N, num_gmfs), random_state=seed)
     else:
         Z = norm.rvs(loc=0, scale=1, size=(M * N, num_gmfs), random_state=seed)
-    # Z has shape (M * N, E)
-    gmfs = numpy.exp(L @ Z + mu) / PCTG
+    # the covariance matrix has blocks cross_corr[i, j] * L[i] @ L[j].T,
+    # where L[i] = diag(std[i]) @ factors[i], so its Cholesky factor is
+    # diag(L) @ kron(cholesky(cross_corr), I) and there is no need to
+    # build the full matrix of shape (M * N, M * N)
+    Z = (numpy.linalg.cholesky(cross_corr) @ Z.reshape(M, -1)).reshape(
+        M, N, num_gmfs)
+    gmfs = numpy.zeros((M, N, num_gmfs))
+    for m, im in enumerate(imts):
+        std = shakemap['std'][str(im)][:, None]
+        mu = numpy.log(shakemap['val'][str(im)])[:, None]
+        gmfs[m] = numpy.exp(std * (factors[m] @ Z[m]) + mu) / PCTG
     if site_effects:
-        gmfs = amplify_gmfs(imts_, shakemap['vs30'], gmfs)
+        gmfs = amplify_gmfs(imts, shakemap['vs30'], gmfs.reshape(M * N, -1))
     if gmfs.max() > MAX_GMV:
         logging.warning('There are suspiciously large GMVs of %.2fg',
                         gmfs.max())
-    return imts, gmfs.reshape((M, N, num_gmfs)).transpose(1, 2, 0)
+    return gmfs.reshape((M, N, num_gmfs)).transpose(1, 2, 0)
+
+
+def to_gmfs(shakemap, spatialcorr, crosscorr, site_effects, trunclevel,
+            num_gmfs, seed, imts=None, num_neighbours=0):
+    """
+    :returns: (IMT-strings, array of GMFs of shape (N, E, M))
+    """
+    imts = get_imts(shakemap, imts)
+    imts_ = [imt.from_string(name) for name in imts]
+    factors = spatial_factors(
+        shakemap['lon'], shakemap['lat'], imts_, spatialcorr,
+        num_neighbours=num_neighbours)
+    cross_corr = cross_correlation_matrix(imts_, crosscorr)
+    return imts, sample_gmfs(shakemap, imts_, factors, cross_corr,
+                             site_effects, trunclevel, num_gmfs, seed)
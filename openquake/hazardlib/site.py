@@ -20,14 +20,16 @@
 Module :mod:`openquake.hazardlib.site` defines :class:`Site`.
 """
 import numpy
+from scipy.spatial import cKDTree
 from shapely import geometry
 from openquake.baselib.general import (
     split_in_blocks, not_equal, get_duplicates)
 from openquake.hazardlib.geo.utils import (
-    fix_lon, cross_idl, _GeographicObjects, geohash)
+    fix_lon, _GeographicObjects, geohash)
 from openquake.hazardlib.geo.mesh import Mesh
 
 U32LIMIT = 2 ** 32
+KDT_QUERIES = 100  # bounding boxes queried before building a KD-tree
 ampcode_dt = (numpy.string_, 4)
 
 
@@ -451,6 +453,25 @@ class SiteCollection(object):
             for rec in self.array])
         return self.filter(mask)
 
+    def kdtree(self, kind):
+        """
+        :param kind: 'xyz', 'lonlat' or 'lonlat360'
+        :returns: a cKDTree on the sites, built lazily and cached
+        """
+        kdts = self.__dict__.get('_kdts')
+        if kdts is None or kdts['array'] is not self.array:
+            kdts = self.__dict__['_kdts'] = {'array': self.array}
+        if kind not in kdts:
+            if kind == 'xyz':
+                kdts[kind] = cKDTree(self.xyz)
+            else:
+                lons = self.array['lon']
+                if kind == 'lonlat360':
+                    lons = lons % 360
+                kdts[kind] = cKDTree(numpy.column_stack(
+                    [lons, self.array['lat']]))
+        return kdts[kind]
+
     def within_bbox(self, bbox):
         """
         :param bbox:
@@ -458,11 +479,53 @@ class SiteCollection(object):
         :returns:
             site IDs within the bounding box
         """
-        min_lon, min_lat, max_lon, max_lat = bbox
+        return self.within_bboxes([bbox])[0]
+
+    def within_bboxes(self, bboxes):
+        """
+        :param bboxes:
+            a sequence of B quartets (min_lon, min_lat, max_lon, max_lat)
+        :returns:
+            a list of B arrays of site IDs within the bounding boxes
+
+        After KDT_QUERIES boxes a KD-tree on the sites is built and used
+        to find the candidate sites; the result is the same.
+        """
+        bboxes = numpy.array(bboxes, float).reshape(-1, 4)
         lons, lats = self.array['lon'], self.array['lat']
-        if cross_idl(lons.min(), lons.max(), min_lon, max_lon):
-            lons = lons % 360
-            min_lon, max_lon = min_lon % 360, max_lon % 360
+        min_lon, max_lon = lons.min(), lons.max()
+        # NB: the logic is the same as cross_idl, but vectorized
+        l1 = numpy.minimum(numpy.minimum(bboxes[:, 0], bboxes[:, 2]), min_lon)
+        l2 = numpy.maximum(numpy.maximum(bboxes[:, 0], bboxes[:, 2]), max_lon)
+        idl = (l1 * l2 < 0) & (numpy.abs(l1 - l2) > 180)
+        bboxes[idl, 0] %= 360
+        bboxes[idl, 2] %= 360
+        nqueries = self.__dict__.get('_nqueries', 0) + len(bboxes)
+        self.__dict__['_nqueries'] = nqueries
+        if nqueries < KDT_QUERIES:
+            return [self._within(bbox, lons % 360 if cross else lons, lats)
+                    for bbox, cross in zip(bboxes, idl)]
+        out = [None] * len(bboxes)
+        for cross in (False, True):
+            idxs, = (idl == cross).nonzero()
+            if len(idxs) == 0:
+                continue
+            bbs = bboxes[idxs]
+            # centers and radii in the Chebyshev metric of the boxes
+            centers = (bbs[:, :2] + bbs[:, 2:]) / 2
+            radii = (bbs[:, 2:] - bbs[:, :2]).max(axis=1) / 2
+            kdt = self.kdtree('lonlat360' if cross else 'lonlat')
+            cands = kdt.query_ball_point(
+                centers, numpy.abs(radii) * (1 + 1E-9) + 1E-9, p=numpy.inf)
+            for idx, bbox, cand in zip(idxs, bbs, cands):
+                cand = numpy.array(sorted(cand), int)
+                clons = lons[cand] % 360 if cross else lons[cand]
+                out[idx] = cand[self._within(bbox, clons, lats[cand])]
+        return out
+
+    def _within(self, bbox, lons, lats):
+        # indices of the points strictly inside the bounding box
+        min_lon, min_lat, max_lon, max_lat = bbox
         mask = (min_lon < lons) * (lons < max_lon) * \
                (min_lat < lats) * (lats < max_lat)
         return mask.nonzero()[0]
@@ -18,8 +18,9 @@ Module :mod:`openquake.hazardlib.source.area` defines :class:`AreaSource`.
 """
 import math
 from copy import deepcopy
+import numpy
 from openquake.hazardlib import geo, mfd
-from openquake.hazardlib.source.point import PointSource
+from openquake.hazardlib.source.point import PointSource, build_planar
 from openquake.hazardlib.source.base import ParametricSeismicSource
 from openquake.hazardlib.source.rupture import ParametricProbabilisticRupture
 from openquake.baselib.slots import with_slots
@@ -131,6 +132,30 @@ class AreaSource(ParametricSeismicSource):
                     surface, occ_rate, self.temporal_occurrence_model)
                 yield rupture
 
+    def get_planar(self, shift_hypo=False):
+        """
+        :returns:
+            the ruptures of the underlying point sources as an array of
+            dtype :data:`openquake.hazardlib.source.point.planar_dt`
+
+        NB: as in :meth:`iter_ruptures`, with `shift_hypo` only the depth
+        of the hypocenters is shifted, while their longitude and latitude
+        stay on the polygon mesh.
+        """
+        polygon_mesh = self.polygon.discretize(self.area_discretization)
+        mag_rates = numpy.array(self.get_annual_occurrence_rates())
+        mags, rates = mag_rates.reshape(-1, 2).T
+        P, M = len(polygon_mesh), len(mags)
+        planar = build_planar(
+            self, numpy.repeat(polygon_mesh.lons, M),
+            numpy.repeat(polygon_mesh.lats, M), numpy.tile(mags, P),
+            numpy.tile(rates / P, P), shift_hypo=shift_hypo)
+        if shift_hypo:
+            n = len(planar) // P  # number of ruptures per point
+            planar['hypo'][:, 0] = numpy.repeat(polygon_mesh.lons, n)
+            planar['hypo'][:, 1] = numpy.repeat(polygon_mesh.lats, n)
+        return planar
+
     def count_ruptures(self):
         """
         See
@@ -23,7 +23,7 @@ from openquake.hazardlib.geo import utils, NodalPlane
 from openquake.hazardlib.geo.mesh import Mesh
 from openquake.hazardlib.pmf import PMF
 from openquake.hazardlib.valid import SCALEREL
-from openquake.hazardlib.source.point import PointSource
+from openquake.hazardlib.source.point import PointSource, build_planar
 
 F32 = numpy.float32
 npd_dt = numpy.dtype([('probability', F32),
@@ -95,6 +95,29 @@ class MultiPointSource(ParametricSeismicSource):
             for rupture in ps.iter_ruptures(**kwargs):
                 yield rupture
 
+    def get_planar(self, shift_hypo=False):
+        """
+        :returns:
+            the ruptures of the underlying point sources as an array of
+            dtype :data:`openquake.hazardlib.source.point.planar_dt`
+        """
+        idxs, mags, rates = [], [], []
+        for i, mfd in enumerate(self.mfd):
+            for mag, rate in mfd.get_annual_occurrence_rates():
+                if rate > 0:
+                    idxs.append(i)
+                    mags.append(mag)
+                    rates.append(rate)
+        idxs = numpy.array(idxs, int)
+
+        def expand(value):  # from one value per point to one per magnitude
+            return numpy.broadcast_to(value, len(self.mesh))[idxs]
+        return build_planar(
+            self, self.mesh.lons[idxs], self.mesh.lats[idxs], mags, rates,
+            expand(self.upper_seismogenic_depth),
+            expand(self.lower_seismogenic_depth),
+            expand(self.rupture_aspect_ratio), shift_hypo=shift_hypo)
+
     def count_ruptures(self):
         """
         See
@@ -17,6 +17,7 @@
 Module :mod:`openquake.hazardlib.source.point` defines :class:`PointSource`.
 """
 import math
+import numpy
 from openquake.baselib.slots import with_slots
 from openquake.hazardlib.scalerel import PointMSR
 from openquake.hazardlib.geo import Point, geodetic
@@ -26,6 +27,13 @@ from openquake.hazardlib.source.base import ParametricSeismicSource
 from openquake.hazardlib.source.rupture import ParametricProbabilisticRupture
 from openquake.hazardlib.geo.utils import get_bounding_box
 
+F64 = numpy.float64
+# compact representation of planar ruptures; the corners are in the order
+# top left, top right, bottom left, bottom right, as in PlanarSurface
+planar_dt = numpy.dtype([
+    ('mag', F64), ('strike', F64), ('dip', F64), ('rake', F64),
+    ('rate', F64), ('hypo', (F64, 3)), ('corners', (F64, (4, 3)))])
+
 
 def _get_rupture_dimensions(src, mag, rake, dip):
     """
@@ -68,6 +76,109 @@ def _get_rupture_dimensions(src, mag, rake, dip):
     return rup_length, rup_width
 
 
+def build_planar(src, lons, lats, mags, rates, usd=None, lsd=None, rar=None,
+                 shift_hypo=False):
+    """
+    Build the planar ruptures of a set of point sources sharing the magnitude
+    scaling relationship and the nodal plane and hypocenter distributions
+    of `src`, without instantiating any rupture object. The arrays `lons`,
+    `lats`, `mags`, `rates` (and optionally `usd`, `lsd`, `rar`) have
+    one element per point and magnitude. Mirrors
+    :meth:`PointSource._get_rupture_surface`.
+
+    :returns: an array of dtype `planar_dt` in the order point, magnitude,
+              nodal plane, hypocenter depth
+    """
+    nps = src.nodal_plane_distribution.data
+    hcs = src.hypocenter_distribution.data
+    U, NP, HC = len(mags), len(nps), len(hcs)
+    usd = src.upper_seismogenic_depth if usd is None else usd
+    lsd = src.lower_seismogenic_depth if lsd is None else lsd
+    rar = src.rupture_aspect_ratio if rar is None else rar
+
+    def expand(value):  # from shape U to shape (U, NP, HC)
+        return numpy.broadcast_to(
+            numpy.reshape(value, (-1, 1, 1)), (U, NP, HC)).flatten()
+    lons, lats, mags = expand(lons), expand(lats), expand(mags)
+    usd, lsd, rar = expand(usd), expand(lsd), expand(rar)
+    strike = numpy.tile(numpy.repeat([np.strike for _, np in nps], HC), U)
+    dip = numpy.tile(numpy.repeat([np.dip for _, np in nps], HC), U)
+    rake = numpy.tile(numpy.repeat([np.rake for _, np in nps], HC), U)
+    hdepth = numpy.tile([depth for _, depth in hcs], U * NP)
+    probs = numpy.outer([p for p, _ in nps], [p for p, _ in hcs]).flatten()
+    rate = expand(rates) * numpy.tile(probs, U)
+
+    # the median areas are computed once per magnitude and rake
+    msr = src.magnitude_scaling_relationship
+    areas = {}
+    for mag, rk in zip(mags, rake):
+        if (mag, rk) not in areas:
+            areas[mag, rk] = msr.get_median_area(mag, rk)
+    area = numpy.array([areas[mag, rk] for mag, rk in zip(mags, rake)])
+    rdip = numpy.radians(dip)
+    length = numpy.sqrt(area * rar)
+    width = area / length
+    max_width = (lsd - usd) / numpy.sin(rdip)
+    big = width > max_width
+    width[big] = max_width[big]
+    length[big] = area[big] / width[big]
+    proj_height = width * numpy.sin(rdip)
+    proj_width = width * numpy.cos(rdip)
+
+    # move the ruptures inside the seismogenic layer
+    hheight = proj_height / 2.
+    vshift = usd - hdepth + hheight
+    vshift = numpy.where(
+        vshift < 0, numpy.minimum(lsd - hdepth - hheight, 0), vshift)
+    clons, clats, cdepths = lons.copy(), lats.copy(), hdepth + vshift
+    shift = vshift != 0
+    if shift.any():
+        hshift = numpy.abs(vshift[shift] / numpy.tan(rdip[shift]))
+        azimuth = (strike[shift] + numpy.where(
+            vshift[shift] < 0, 270, 90)) % 360  # up or down
+        clons[shift], clats[shift] = geodetic.point_at(
+            lons[shift], lats[shift], azimuth, hshift)
+
+    # move from the rupture center along the diagonals
+    theta = numpy.degrees(numpy.arctan((proj_width / 2.) / (length / 2.)))
+    hor_dist = numpy.sqrt((length / 2.) ** 2 + (proj_width / 2.) ** 2)
+    out = numpy.zeros(len(mags), planar_dt)
+    for c, (azimuth, sign) in enumerate([
+            (strike + 180 + theta, -1), (strike - theta, -1),
+            (strike + 180 - theta, 1), (strike + theta, 1)]):
+        corners = out['corners'][:, c]
+        corners[:, 0], corners[:, 1] = geodetic.point_at(
+            clons, clats, azimuth % 360, hor_dist)
+        corners[:, 2] = cdepths + sign * proj_height / 2.
+    out['mag'] = mags
+    out['strike'] = strike
+    out['dip'] = dip
+    out['rake'] = rake
+    out['rate'] = rate
+    if shift_hypo:
+        out['hypo'] = numpy.column_stack([clons, clats, cdepths])
+    else:
+        out['hypo'] = numpy.column_stack([lons, lats, hdepth])
+    return out
+
+
+def planar_ruptures(planar, trt, tom):
+    """
+    :param planar: an array of dtype `planar_dt`
+    :param trt: the tectonic region type of the ruptures
+    :param tom: the temporal occurrence model of the ruptures
+    :yields: ParametricProbabilisticRupture instances
+    """
+    for rec in planar:
+        tl, tr, bl, br = [Point(*corner) for corner in rec['corners']]
+        # the geometry is correct by construction, so it is not checked
+        surface = PlanarSurface(
+            rec['strike'], rec['dip'], tl, tr, br, bl, check=False)
+        yield ParametricProbabilisticRupture(
+            rec['mag'], rec['rake'], trt, Point(*rec['hypo']), surface,
+            rec['rate'], tom)
+
+
 @with_slots
 class PointSource(ParametricSeismicSource):
     """
@@ -177,6 +288,16 @@ class PointSource(ParametricSeismicSource):
                         surface, occurrence_rate,
                         self.temporal_occurrence_model)
 
+    def get_planar(self, shift_hypo=False):
+        """
+        :returns: the ruptures of the source as an array of dtype `planar_dt`
+        """
+        mag_rates = numpy.array(self.get_annual_occurrence_rates(), F64)
+        mags, rates = mag_rates.reshape(-1, 2).T
+        loc = self.location
+        return build_planar(self, loc.longitude, loc.latitude, mags, rates,
+                            shift_hypo=shift_hypo)
+
     def count_nphc(self):
         """
         :returns: the number of nodal planes times the number of hypocenters
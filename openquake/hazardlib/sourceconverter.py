@@ -555,7 +555,7 @@ class SourceConverter(RuptureConverter):
                  area_source_discretization=None,
                  minimum_magnitude={'default': 0},
                  spinning_floating=True, source_id=None,
-                 discard_trts=''):
+                 discard_trts='', cache=None):
         self.investigation_time = investigation_time
         self.area_source_discretization = area_source_discretization
         self.minimum_magnitude = minimum_magnitude
@@ -566,6 +566,7 @@ class SourceConverter(RuptureConverter):
         self.spinning_floating = spinning_floating
         self.source_id = source_id
         self.discard_trts = discard_trts
+        self.cache = cache  # DiskCache used in nrml.read_source_models
 
     def convert_node(self, node):
         """
@@ -906,7 +907,9 @@ class SourceConverter(RuptureConverter):
             if isinstance(tom, PoissonTOM):
                 assert hasattr(sg, 'occurrence_rate')
         #
+        num_nodes = 0  # node can be lazy, see nrml.stream_source_model
         for src_node in node:
+            num_nodes += 1
             src = self.convert_node(src_node)
             if src is None:  # filtered out by source_id
                 continue
@@ -925,10 +928,10 @@ class SourceConverter(RuptureConverter):
                     setattr(src, attr, node[attr])
             sg.update(src)
         if srcs_weights is not None:
-            if len(node) and len(srcs_weights) != len(node):
+            if num_nodes and len(srcs_weights) != num_nodes:
                 raise ValueError(
                     'There are %d srcs_weights but %d source(s) in %s'
-                    % (len(srcs_weights), len(node), self.fname))
+                    % (len(srcs_weights), num_nodes, self.fname))
             for src, sw in zip(sg, srcs_weights):
                 src.mutex_weight = sw
         # check that, when the cluster option is set, the group has a temporal
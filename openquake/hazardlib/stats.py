@@ -73,6 +73,195 @@ def quantile_curve(quantile, curves, weights=None):
     return result
 
 
+class QuantileSketch(object):
+    """
+    Streaming estimator of weighted quantiles with relative accuracy
+    (a DDSketch, Masson et al., 2019). The values are accumulated in
+    logarithmic buckets (gamma^(k-1), gamma^k] with
+    gamma = (1 + relerr) / (1 - relerr); values below `vmin` go in a
+    zero bucket and values above `vmax` in the last bucket. The memory
+    is proportional to log(vmax / vmin) / relerr and independent from the
+    number of values. For each bucket the sketch keeps the total weight
+    and the weight of the smallest value, so that the quantiles are
+    interpolated on the cumulative weights as in :func:`quantile_curve`.
+    If x_a <= x_b are the neighbouring values between which
+    :func:`quantile_curve` interpolates the quantile x_q, the estimated
+    quantile v satisfies |v - x_q| <= relerr * x_b, the values below
+    `vmin` being counted as zeros.
+
+    :param shape: the shape of a single set of values (for instance L)
+    :param relerr: the relative accuracy of the quantiles
+    :param vmin: values below this threshold are considered zero
+    :param vmax: maximum expected value (1 for PoEs)
+
+    >>> sketch = QuantileSketch((), relerr=.01)
+    >>> sketch.update(numpy.array([.1, .2, .3, .4]))
+    >>> round(float(sketch.quantile(.5)), 4)
+    0.1999
+    >>> round(float(sketch.quantile(.4)), 4)
+    0.1596
+    """
+    def __init__(self, shape, relerr, vmin=1E-12, vmax=1.):
+        assert 0 < relerr < 1, relerr
+        self.shape = shape
+        self.relerr = relerr
+        self.vmin = vmin
+        self.loggamma = numpy.log((1 + relerr) / (1 - relerr))
+        self.kmin = int(numpy.floor(numpy.log(vmin) / self.loggamma))
+        kmax = int(numpy.ceil(numpy.log(vmax) / self.loggamma))
+        # bucket 0 is the zero bucket, bucket i > 0 has key kmin + i
+        self.num_buckets = kmax - self.kmin + 1
+        self.size = int(numpy.prod(shape))
+        self.counts = numpy.zeros((self.num_buckets, self.size))
+        # smallest value in each bucket and its weight
+        self.firstval = numpy.full((self.num_buckets, self.size), numpy.inf)
+        self.firstw = numpy.zeros((self.num_buckets, self.size))
+
+    def update(self, values, weights=None):
+        """
+        :param values: an array of shape (C,) + shape
+        :param weights: None or an array broadcastable to the values
+        """
+        values = numpy.asarray(values, float)
+        if weights is None:
+            weights = numpy.ones_like(values)
+        else:
+            weights = numpy.asarray(weights, float)
+            if weights.ndim == 1:  # one weight per set of values
+                weights = weights.reshape(
+                    (len(weights),) + (1,) * len(self.shape))
+            weights = numpy.broadcast_to(weights, values.shape)
+        values = values.reshape(len(values), -1)
+        weights = weights.reshape(len(values), -1)
+        idx = numpy.zeros(values.shape, int)
+        ok = values >= self.vmin
+        idx[ok] = numpy.clip(
+            numpy.ceil(numpy.log(values[ok]) / self.loggamma) - self.kmin,
+            1, self.num_buckets - 1)
+        flat = idx * self.size + numpy.arange(self.size)
+        self.counts += numpy.bincount(
+            flat.ravel(), weights.ravel(), self.counts.size).reshape(
+                self.counts.shape)
+        # update the smallest value of the buckets, ignoring zero weights
+        pos = weights.ravel() > 0
+        flat, vals, ws = flat.ravel()[pos], values.ravel()[pos], \
+            weights.ravel()[pos]
+        order = numpy.lexsort((vals, flat))
+        keys, first = numpy.unique(flat[order], return_index=True)
+        vals, ws = vals[order[first]], ws[order[first]]
+        firstval, firstw = self.firstval.ravel(), self.firstw.ravel()  # views
+        new = vals < firstval[keys]
+        firstval[keys[new]] = vals[new]
+        firstw[keys[new]] = ws[new]
+
+    def quantile(self, q):
+        """
+        :param q: a quantile in the range [0, 1]
+        :returns: an array of the given shape with the estimated quantiles
+        """
+        B = self.num_buckets
+        cols = numpy.arange(self.size)
+        cum = numpy.cumsum(self.counts, axis=0)
+        tot = cum[-1]
+        target = q * tot
+        # first nonempty bucket with a cumulative weight >= q * total weight
+        nonempty = self.counts > 0
+        nxt = numpy.minimum.accumulate(numpy.where(
+            nonempty, numpy.arange(B)[:, None], B - 1)[::-1], axis=0)[::-1]
+        b = (cum < target * (1 - 1E-12)).sum(axis=0)
+        b = nxt[numpy.minimum(b, B - 1), cols]
+        gamma = numpy.exp(self.loggamma)
+        vals = 2 * gamma ** (numpy.arange(B) + self.kmin) / (gamma + 1)
+        vals[0] = 0
+        res = vals[b]
+        # as in quantile_curve, the value rises linearly from the previous
+        # nonempty bucket a to the bucket b while the cumulative weight
+        # goes from cum[a] to cum[a] + the weight of the smallest value in b
+        last = numpy.maximum.accumulate(numpy.where(
+            nonempty, numpy.arange(B)[:, None], -1), axis=0)
+        a = numpy.where(b > 0, last[b - 1, cols], -1)
+        start = cum[b, cols] - self.counts[b, cols]
+        wfirst = self.firstw[b, cols]
+        rise = (a >= 0) & (target < start + wfirst)
+        frac = numpy.clip((target - start)[rise] / wfirst[rise], 0, 1)
+        va = vals[a[rise]]
+        res[rise] = va + (res[rise] - va) * frac
+        res[tot == 0] = 0
+        return res.reshape(self.shape)
+
+
+class StreamingStats(object):
+    """
+    Compute the statistics of a set of weighted realizations which are
+    consumed in blocks, without keeping all of them in memory. The mean,
+    the standard deviation and the maximum are exact, while the quantiles
+    are estimated with a :class:`QuantileSketch` having the given relative
+    accuracy.
+
+    :param statnames: a list of names like 'mean', 'std', 'quantile-0.15'
+    :param shape: the shape of a single realization (for instance L)
+    :param relerr: the relative accuracy of the quantiles
+    """
+    def __init__(self, statnames, shape, relerr):
+        self.statnames = statnames
+        self.shape = shape
+        self.sumw = numpy.zeros(shape)
+        self.mean = numpy.zeros(shape)
+        self.m2 = numpy.zeros(shape)  # sum of the weighted squared deviations
+        self.max = numpy.full(shape, -numpy.inf)
+        if any(name.startswith('quantile-') for name in statnames):
+            self.sketch = QuantileSketch(shape, relerr)
+        else:
+            self.sketch = None
+
+    def update(self, values, weights):
+        """
+        :param values: an array of shape (C,) + shape
+        :param weights: an array of C weights or of shape (C,) + shape
+        """
+        values = numpy.asarray(values, float)
+        weights = numpy.asarray(weights, float)
+        if weights.ndim == 1:
+            weights = weights.reshape((len(weights),) + (1,) * len(self.shape))
+        # merge the moments of the block with the accumulated ones
+        # (Chan et al.), which is stable also for values with small variance
+        wb = weights.sum(axis=0) + numpy.zeros(self.shape)
+        ok = wb > 0
+        mb = numpy.zeros(self.shape)
+        mb[ok] = (weights * values).sum(axis=0)[ok] / wb[ok]
+        m2b = (weights * (values - mb) ** 2).sum(axis=0)
+        sumw = self.sumw + wb
+        delta = mb - self.mean
+        self.mean[ok] += delta[ok] * wb[ok] / sumw[ok]
+        self.m2[ok] += m2b[ok] + delta[ok] ** 2 * (
+            self.sumw[ok] * wb[ok] / sumw[ok])
+        self.sumw = sumw
+        self.max = numpy.maximum(self.max, values.max(axis=0))
+        if self.sketch:
+            self.sketch.update(values, weights)
+
+    def result(self):
+        """
+        :returns: an array of shape (S,) + shape; the statistics are zero
+                  where the total weight is zero
+        """
+        ok = self.sumw > 0
+        out = numpy.zeros((len(self.statnames),) + self.shape)
+        for s, name in enumerate(self.statnames):
+            if name == 'mean':
+                out[s] = self.mean
+            elif name == 'std':
+                out[s] = numpy.sqrt(self.m2)
+            elif name == 'max':
+                out[s] = self.max
+            elif name.startswith('quantile-'):
+                out[s] = self.sketch.quantile(float(name[9:]))
+            else:
+                raise ValueError('Unknown statistic %s' % name)
+            out[s][~ok] = 0
+        return out
+
+
 def max_curve(values, weights=None):
     """
     Compute the maximum curve by taking the upper limits of the values;
@@ -98,21 +287,18 @@ def compute_pmap_stats(pmaps, stats, weights, imtls):
     :returns:
         a probability map with S internal values
     """
-    sids = set()
     p0 = next(iter(pmaps))
     L = p0.shape_y
     for pmap in pmaps:
-        sids.update(pmap)
         assert pmap.shape_y == L, (pmap.shape_y, L)
+    sids = numpy.unique(numpy.concatenate([pmap.sids for pmap in pmaps]))
     if len(sids) == 0:
         raise ValueError('All empty probability maps!')
-    sids = numpy.array(sorted(sids), numpy.uint32)
     nstats = len(stats)
     curves = numpy.zeros((len(pmaps), len(sids), L), numpy.float64)
     for i, pmap in enumerate(pmaps):
-        for j, sid in enumerate(sids):
-            if sid in pmap:
-                curves[i, j] = pmap[sid].array[:, 0]
+        idx = numpy.searchsorted(sids, pmap.sids)
+        curves[i, idx] = pmap.array[:, :, 0]
     out = p0.__class__.build(L, nstats, sids)
     for imt in imtls:
         slc = imtls(imt)
@@ -121,8 +307,7 @@ def compute_pmap_stats(pmaps, stats, weights, imtls):
         if sum(w) == 0:  # expect no data for this IMT
             continue
         for i, array in enumerate(compute_stats(curves[:, :, slc], stats, w)):
-            for j, sid in numpy.ndenumerate(sids):
-                out[sid].array[slc, i] = array[j]
+            out.array[:, slc, i] = array
     return out
 
 
@@ -82,6 +82,59 @@ class DigitizeLonsTestCase(unittest.TestCase):
         numpy.testing.assert_equal(idx, expected)
 
 
+class DisaggregatePoesTestCase(unittest.TestCase):
+    def test(self):
+        eps3 = disagg._eps3(truncation_level=2, n_epsilons=4)
+        tn, eps, eps_bands = eps3
+        mean_std = numpy.array([[[0.], [1.]]])  # shape (U, 2, M) = (1, 2, 1)
+        # levels below, inside the second band and above the truncation
+        imls = numpy.array([[-3., -0.5, 2.5]])  # shape (M, P) = (1, 3)
+        poes = disagg._disaggregate_poes(mean_std, imls, *eps3)
+        self.assertEqual(poes.shape, (1, 1, 3, 4))
+        numpy.testing.assert_allclose(poes[0, 0, 0], eps_bands)
+        numpy.testing.assert_allclose(
+            poes[0, 0, 1], [0, tn.sf(-0.5) - eps_bands[2:].sum(),
+                            eps_bands[2], eps_bands[3]])
+        numpy.testing.assert_allclose(poes[0, 0, 2], numpy.zeros(4))
+
+    def test_tabulated(self):
+        eps3 = disagg._eps3(truncation_level=3, n_epsilons=6)
+        mean_std = numpy.array([[[0., .5], [1., 0.]]])  # shape (1, 2, 2)
+        imls = numpy.array([[-3.5, -1.2, 0., .7, 3.5],
+                            [-1., .5, .5, 1., 2.]])  # shape (2, 5)
+        exact = disagg._disaggregate_poes(mean_std, imls, *eps3)
+        approx = disagg._disaggregate_poes(
+            mean_std, imls, *eps3, tabulated=True)
+        numpy.testing.assert_allclose(approx, exact, atol=1E-7)
+
+    def test_zero_std(self):
+        # levels below, equal to and above the mean, as the old algorithm
+        eps3 = disagg._eps3(truncation_level=2, n_epsilons=4)
+        mean_std = numpy.array([[[0.], [0.]]])
+        imls = numpy.array([[-1., 0., 1.]])
+        poes = disagg._disaggregate_poes(mean_std, imls, *eps3)
+        numpy.testing.assert_allclose(poes[0, 0, 0], eps3[2])
+        numpy.testing.assert_allclose(poes[0, 0, 1], numpy.zeros(4))
+        numpy.testing.assert_allclose(poes[0, 0, 2], numpy.zeros(4))
+
+
+class CooPmfTestCase(unittest.TestCase):
+    def test(self):
+        # the PMFs computed from the nonzero bins are the same as the
+        # PMFs computed from the full matrix of shape (T, Ma, D, Lo, La, E)
+        rng = numpy.random.RandomState(42)
+        shape = (2, 4, 3, 5, 6, 3)
+        coords = numpy.array([rng.randint(0, n, 20) for n in shape[:5]]).T
+        coords, pnes = disagg.reduce_coo(coords, rng.uniform(.9, 1, (20, 3)))
+        matrix = numpy.zeros(shape)
+        matrix[tuple(coords.T)] = 1. - pnes
+        aggmatrix = 1. - numpy.prod(1. - matrix, axis=0)
+        for key, fn in disagg.pmf_map.items():
+            expected = fn(matrix if key.endswith('TRT') else aggmatrix)
+            pmf = disagg.coo_pmf(coords, pnes, shape, disagg.pmf_axes[key])
+            numpy.testing.assert_allclose(pmf, expected, atol=1E-15)
+
+
 class DisaggregateTestCase(unittest.TestCase):
     def setUp(self):
         d = os.path.dirname(os.path.dirname(__file__))
@@ -17,8 +17,30 @@
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
 import unittest
+from unittest import mock
 import numpy
-from openquake.hazardlib.contexts import Effect
+from openquake.baselib.general import DictArray
+from openquake.hazardlib.imt import PGA, PGV, SA
+from openquake.hazardlib.contexts import (
+    Effect, RuptureContext, SitesContext, DistancesContext, get_mean_stds,
+    ContextMaker, PmapMaker)
+from openquake.hazardlib.calc.filters import SourceFilter, IntegrationDistance
+from openquake.hazardlib.geo.point import Point
+from openquake.hazardlib.geo.nodalplane import NodalPlane
+from openquake.hazardlib.mfd import TruncatedGRMFD
+from openquake.hazardlib.pmf import PMF
+from openquake.hazardlib.scalerel.wc1994 import WC1994
+from openquake.hazardlib.site import Site, SiteCollection
+from openquake.hazardlib.source.point import PointSource, planar_ruptures
+from openquake.hazardlib.tom import PoissonTOM
+from openquake.hazardlib.gsim.base import GMPE, get_mean_std
+from openquake.hazardlib.gsim.abrahamson_2014 import AbrahamsonEtAl2014
+from openquake.hazardlib.gsim.boore_2014 import (
+    BooreEtAl2014, BooreEtAl2014LowQJapanBasin)
+from openquake.hazardlib.gsim.boore_atkinson_2008 import BooreAtkinson2008
+from openquake.hazardlib.gsim.campbell_bozorgnia_2014 import (
+    CampbellBozorgnia2014)
+from openquake.hazardlib.gsim.chiou_youngs_2014 import ChiouYoungs2014
 
 dists = numpy.array([0, 10, 20, 30, 40, 50])
 intensities = {
@@ -39,3 +61,89 @@ class EffectTestCase(unittest.TestCase):
 
         dist = list(effect.dist_by_mag(1.1).values())
         numpy.testing.assert_allclose(dist, [0, 10, 13.225806, 16.666667])
+
+
+def _ctx(mag, rake, dip, ztor, hypo_depth, n):
+    # build a fake triple (rctx, sctx, dctx) with n sites
+    rctx = RuptureContext([('mag', mag), ('rake', rake), ('dip', dip),
+                           ('ztor', ztor), ('hypo_depth', hypo_depth),
+                           ('width', 10.)])
+    sctx = SitesContext()
+    sctx.sids = numpy.arange(n)
+    sctx.vs30 = numpy.linspace(180., 1200., n)
+    sctx.vs30measured = numpy.arange(n) % 2 == 0
+    sctx.z1pt0 = numpy.linspace(10., 800., n)
+    sctx.z2pt5 = numpy.linspace(.5, 5., n)
+    rrup = numpy.linspace(1., 250., n)
+    dctx = DistancesContext([('rrup', rrup), ('rjb', rrup * .9),
+                             ('rx', numpy.linspace(-30., 60., n)),
+                             ('ry0', numpy.linspace(0., 20., n))])
+    return rctx, sctx, dctx
+
+
+class VectorizedTestCase(unittest.TestCase):
+    def test_get_mean_stds(self):
+        ctxs = [_ctx(4.2, 0., 90., 0., 5., 7),
+                _ctx(5.1, 90., 45., 3., 10., 5),
+                _ctx(6.0, -90., 25., 12., 15., 6),
+                _ctx(7.3, 170., 60., 25., 22., 4)]
+        imts = [PGA(), SA(0.2), SA(1.0)]
+        gsims = [BooreEtAl2014(), AbrahamsonEtAl2014(),
+                 CampbellBozorgnia2014(), ChiouYoungs2014(),
+                 BooreAtkinson2008()]
+        self.assertFalse(gsims[-1].vectorized)
+        expected = numpy.concatenate([
+            get_mean_std(sctx, rctx, dctx, imts, gsims)
+            for rctx, sctx, dctx in ctxs], axis=1)
+        numpy.testing.assert_allclose(
+            get_mean_stds(ctxs, imts, gsims), expected)
+
+    def test_all_imts(self):
+        # the GSIMs computing all the IMTs at once agree with the
+        # default implementation calling get_mean_and_stddevs per IMT
+        rctx, sctx, dctx = _ctx(6.0, -90., 25., 12., 15., 6)
+        imts = [PGA(), PGV(), SA(0.2), SA(0.25), SA(1.0)]
+        for gsim in [BooreEtAl2014(), BooreEtAl2014LowQJapanBasin()]:
+            numpy.testing.assert_allclose(
+                gsim.get_mean_stds(sctx, rctx, dctx, imts),
+                GMPE.get_mean_stds(gsim, sctx, rctx, dctx, imts))
+
+
+def no_prefilter(self, src, mag, planar, sites):
+    rups = planar_ruptures(planar, src.tectonic_region_type,
+                           src.temporal_occurrence_model)
+    return list(rups), sites
+
+
+class PrefilterTestCase(unittest.TestCase):
+    def test_magnitude_dependent(self):
+        # the sites far from the small magnitudes are discarded
+        # before computing the distances, with the same hazard
+        trt = 'Active Shallow Crust'
+        sitecol = SiteCollection([
+            Site(Point(lon, lat), 760., 1.0, 1.0)
+            for lon in numpy.arange(29., 31.01, .25)
+            for lat in numpy.arange(29., 31.01, .25)])
+        src = PointSource('001', 'Point1', trt,
+                          TruncatedGRMFD(4.5, 7.5, 0.5, 4.0, 1.0),
+                          1.0, WC1994(), 1.0, PoissonTOM(50.0),
+                          0.0, 30.0, Point(30.0, 30.),
+                          PMF([(1.0, NodalPlane(0.0, 90.0, 0.0))]),
+                          PMF([(1.0, 10.0)]))
+        src.src_group_id = 0
+        mags = [mag for mag, rate in src.get_annual_occurrence_rates()]
+        maxdist = IntegrationDistance(
+            {trt: [(mag, 20 * mag - 50) for mag in mags]})
+        param = dict(imtls=DictArray({'PGA': [0.01, 0.1, 0.2, 0.5, 0.8]}),
+                     maximum_distance=maxdist)
+        cmaker = ContextMaker(trt, [BooreAtkinson2008()], param)
+        srcfilter = SourceFilter(sitecol, maxdist)
+        pmap, _, _, extra = cmaker.get_pmap_by_grp(srcfilter, [src])
+        self.assertGreater(extra['avoided'], 0)
+        with mock.patch.object(PmapMaker, '_close_sites', no_prefilter):
+            pmap0, _, _, extra0 = cmaker.get_pmap_by_grp(srcfilter, [src])
+        self.assertEqual(extra0['avoided'], 0)
+        self.assertEqual(sorted(pmap[0]), sorted(pmap0[0]))
+        for sid in pmap0[0]:
+            numpy.testing.assert_allclose(
+                pmap[0][sid].array, pmap0[0][sid].array)
@@ -19,7 +19,7 @@ import numpy
 
 from openquake.hazardlib.imt import SA, PGA
 from openquake.hazardlib.correlation import JB2009CorrelationModel, \
-                                            HM2018CorrelationModel
+    HM2018CorrelationModel, NearestNeighboursFactor, jbcorrelation
 from openquake.hazardlib.site import Site, SiteCollection
 from openquake.hazardlib.geo import Point
 
@@ -298,3 +298,59 @@ class HM2018ApplyCorrelationTestCase(unittest.TestCase):
              [[1.        , 0.3807, 0.5066],
               [0.3807, 1.        , 0.3075],
               [0.5066, 0.3075, 1.        ]], 2)
+
+
+class NearestNeighboursFactorTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(42)
+        self.lons = rng.uniform(10, 10.5, 60)
+        self.lats = rng.uniform(45, 45.5, 60)
+        sitecol = SiteCollection.from_points(self.lons, self.lats)
+        self.corma = jbcorrelation(sitecol, PGA())
+
+    def get_error(self, num_neighbours):
+        # max difference between the implied and the exact correlations
+        factor = NearestNeighboursFactor(
+            self.lons, self.lats, lambda dists: jbcorrelation(dists, PGA()),
+            num_neighbours)
+        lt = factor @ numpy.eye(len(self.lons))
+        return numpy.abs(lt @ lt.T - self.corma).max()
+
+    def test_convergence(self):
+        errors = [self.get_error(m) for m in (5, 10, 20)]
+        self.assertGreater(errors[0], errors[1])
+        self.assertGreater(errors[1], errors[2])
+        self.assertLess(errors[2], .05)
+
+    def test_exact(self):
+        self.assertLess(self.get_error(59), 1E-8)
+
+    def test_apply_correlation(self):
+        sitecol = SiteCollection.from_points(self.lons, self.lats)
+        filtered = sitecol.filtered(numpy.arange(0, 60, 2))
+        residuals = numpy.random.RandomState(13).normal(size=(30, 4))
+        cormo = JB2009CorrelationModel(vs30_clustering=False,
+                                       num_neighbours=60)
+        corr = cormo.apply_correlation(filtered, PGA(), residuals)
+        self.assertEqual(corr.shape, (30, 4))
+        # the factor is built on the filtered sites only and it is
+        # exact for 30 sites and 60 neighbours
+        [factor] = cormo.cache[PGA(), 'sparse'].values()
+        lt = factor @ numpy.eye(30)
+        aaae(lt @ lt.T, self.corma[::2, ::2])
+        aaae(corr, factor @ residuals)
+        # the factor is not rebuilt for the same sites
+        cormo.apply_correlation(sitecol.filtered(numpy.arange(0, 60, 2)),
+                                PGA(), residuals)
+        self.assertEqual(list(cormo.cache[PGA(), 'sparse'].values()),
+                         [factor])
+        # a different filtered collection gets its own factor
+        cormo.apply_correlation(sitecol.filtered([1, 2]), PGA(),
+                                residuals[:2])
+        self.assertEqual(len(cormo.cache[PGA(), 'sparse']), 2)
+
+    def test_exact_by_default(self):
+        cormo = JB2009CorrelationModel(vs30_clustering=False)
+        sitecol = SiteCollection.from_points(self.lons, self.lats)
+        cormo.apply_correlation(sitecol, PGA(), numpy.zeros((60, 1)))
+        self.assertEqual(list(cormo.cache), [PGA()])
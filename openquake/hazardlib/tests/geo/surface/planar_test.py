@@ -14,11 +14,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import unittest
+from unittest import mock
 import numpy
 
 from openquake.hazardlib.geo import Point
 from openquake.hazardlib.geo.mesh import Mesh
 from openquake.hazardlib.geo import utils as geo_utils
+from openquake.hazardlib.geo.surface import planar
 from openquake.hazardlib.geo.surface.planar import PlanarSurface
 from openquake.hazardlib.tests.geo.surface import _planar_test_data as tdata
 
@@ -459,6 +461,39 @@ class PlanarSurfaceGetRy0DistanceTestCase(unittest.TestCase):
         numpy.testing.assert_allclose(dists, 5.55974422 * numpy.ones(2))
 
 
+class GetPlanarDistancesTestCase(unittest.TestCase):
+    def test_same_as_surface_methods(self):
+        surfaces = []
+        for strike, dip, lon in [(0, 90, 0), (45, 30, 0.2), (300, 60, -0.3),
+                                 (180, 15, 0.1)]:
+            tl = Point(lon, 0.1, 2.)
+            tr = tl.point_at(20, 0, strike)
+            dx, dz = 10 * numpy.cos(numpy.radians(dip)), 10 * numpy.sin(
+                numpy.radians(dip))
+            bl = tl.point_at(dx, dz, strike + 90)
+            br = tr.point_at(dx, dz, strike + 90)
+            surfaces.append(PlanarSurface(strike, dip, tl, tr, br, bl))
+        lons, lats = numpy.meshgrid(numpy.linspace(-1, 1, 21),
+                                    numpy.linspace(-1, 1, 21))
+        mesh = Mesh(lons.flatten(), lats.flatten(),
+                    numpy.linspace(-1, 0, lons.size))
+        corners = numpy.array([
+            numpy.column_stack([s.corner_lons, s.corner_lats,
+                                s.corner_depths]) for s in surfaces])
+        strikes = numpy.array([s.strike for s in surfaces])
+        methods = dict(rrup='get_min_distance',
+                       rjb='get_joyner_boore_distance',
+                       rx='get_rx_distance', ry0='get_ry0_distance')
+        # use blocks of 3 ruptures to check the blocking
+        with mock.patch.object(planar, 'MAX_DISTANCES', 3 * len(mesh)):
+            dists = planar.get_planar_distances(
+                corners, strikes, mesh, methods)
+        for param, method in methods.items():
+            self.assertEqual(dists[param].shape, (4, len(mesh)))
+            for surface, dist in zip(surfaces, dists[param]):
+                aac(dist, getattr(surface, method)(mesh), atol=1E-9)
+
+
 class PlanarSurfaceGetTopEdgeDepthTestCase(unittest.TestCase):
     def test(self):
         corners = [Point(-0.05, -0.05, 8), Point(0.05, 0.05, 8),
@@ -21,12 +21,14 @@ import collections
 import unittest.mock as mock
 
 import numpy
+from scipy.special import ndtr
 from copy import deepcopy
 
 from openquake.hazardlib import const
 from openquake.hazardlib.gsim.base import (
     GMPE, CoeffsTable, SitesContext, RuptureContext,
-    NotVerifiedWarning, DeprecationWarning)
+    NotVerifiedWarning, DeprecationWarning, TRUNCNORM_STEP,
+    _truncnorm_sf, _truncnorm_sf_tab)
 from openquake.hazardlib.geo.point import Point
 from openquake.hazardlib.imt import PGA, PGV, SA
 from openquake.hazardlib.site import Site, SiteCollection
@@ -350,6 +352,21 @@ class CoeffsTableTestCase(unittest.TestCase):
         self.assertDictEqual(table1.sa_coeffs, table2.sa_coeffs)
         self.assertDictEqual(table1.non_sa_coeffs, table2.non_sa_coeffs)
 
+    def test_get_coeffs(self):
+        table = CoeffsTable(sa_damping=5, table=self.coefficient_string)
+        imts = (PGA(), SA(0.1), SA(0.5), PGV())
+        arr = table.get_coeffs(imts)
+        self.assertEqual(arr.dtype.names, ('a', 'b'))
+        for imt, row in zip(imts, arr):
+            self.assertAlmostEqual(row['a'], table[imt]['a'])
+            self.assertAlmostEqual(row['b'], table[imt]['b'])
+        # the array is cached and read-only
+        self.assertIs(table.get_coeffs(imts), arr)
+        self.assertIs(table.get_coeffs(list(imts)), arr)
+        self.assertFalse(arr.flags.writeable)
+        with self.assertRaises(KeyError):
+            table.get_coeffs((PGA(), SA(20.)))
+
     def test_table_bad_instantiation(self):
         # If instantiated with anything other than string or tuple should
         # raise a TypeError
@@ -358,3 +375,29 @@ class CoeffsTableTestCase(unittest.TestCase):
         self.assertEqual(str(te.exception),
                          "CoeffsTable cannot be constructed with "
                          "inputs of the form 'int'")
+
+
+class TruncnormTableTestCase(unittest.TestCase):
+    def test_error_bound(self):
+        x = numpy.linspace(-12, 12, 100001)
+        for tl in (None, 0.5, 2, 3):
+            exact = _truncnorm_sf(tl, x)
+            approx = _truncnorm_sf_tab(tl, x)
+            if tl is None:
+                z = 1.
+            else:
+                z = ndtr(tl) * 2 - 1
+            bound = 0.242 * TRUNCNORM_STEP ** 2 / 8 / z
+            self.assertLess(numpy.abs(approx - exact).max(), bound)
+            self.assertEqual(approx.shape, x.shape)
+
+    def test_zero_truncation(self):
+        values = numpy.array([0., 1., 1., 0.])
+        self.assertIs(_truncnorm_sf_tab(0, values), values)
+
+    def test_nan(self):
+        # NaNs propagate as in _truncnorm_sf, the infinities are clipped
+        x = numpy.array([numpy.nan, -numpy.inf, 0., numpy.inf])
+        for tl in (None, 3):
+            numpy.testing.assert_allclose(
+                _truncnorm_sf_tab(tl, x), _truncnorm_sf(tl, x), atol=1E-7)
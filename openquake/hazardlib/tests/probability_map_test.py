@@ -16,9 +16,10 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
+import pickle
 import unittest
 import numpy
-from openquake.hazardlib.probability_map import ProbabilityMap
+from openquake.hazardlib.probability_map import ProbabilityMap, combine
 
 
 class ProbabilityMapTestCase(unittest.TestCase):
@@ -40,3 +41,63 @@ class ProbabilityMapTestCase(unittest.TestCase):
         # test pmap power
         pmap = pmap1 ** 2
         numpy.testing.assert_almost_equal(pmap[0].array, [[.16], [0], [0]])
+
+    def test_pending(self):
+        pmap = ProbabilityMap(3, 2)
+        for sid in (5, 1, 3):  # added in disorder
+            pmap.setdefault(sid, 1.).array[0] = .1 * sid
+        self.assertEqual(len(pmap), 3)
+        self.assertIn(3, pmap)
+        numpy.testing.assert_equal(pmap.sids, [1, 3, 5])
+        numpy.testing.assert_almost_equal(
+            pmap.array[:, 0, 0], [.1, .3, .5])
+        # after the merge the curves are views over the array
+        pmap[3].array[1] = .7
+        self.assertEqual(pmap.array[1, 1, 1], .7)
+
+    def test_operators(self):
+        pmap1 = ProbabilityMap.build(2, 1, sids=[0, 1])
+        pmap1[1].array[:] = .5
+        pmap2 = ProbabilityMap.build(2, 1, sids=[1, 2])
+        pmap2[1].array[:] = .5
+        pmap2[2].array[:] = .2
+
+        pmap = pmap1 | pmap2
+        numpy.testing.assert_equal(pmap.sids, [0, 1, 2])
+        numpy.testing.assert_almost_equal(
+            pmap.array[:, :, 0], [[0, 0], [.75, .75], [.2, .2]])
+
+        inv = ~pmap
+        numpy.testing.assert_equal(inv.sids, [0, 1, 2])
+        inv = ~(pmap1 * 0 + 1.)  # all ones are discarded
+        self.assertEqual(len(inv), 0)
+
+        pmap1 += pmap2
+        numpy.testing.assert_almost_equal(
+            pmap1.array[:, :, 0], [[0, 0], [1, 1], [.2, .2]])
+
+        comb = combine([pmap, pmap2])
+        numpy.testing.assert_almost_equal(
+            comb.array[:, :, 0], [[0, 0], [.875, .875], [.36, .36]])
+
+    def test_serialization(self):
+        pmap = ProbabilityMap.build(3, 2, sids=[4, 2], initvalue=.1)
+        pmap.setdefault(0, .5)
+        new = pickle.loads(pickle.dumps(pmap))
+        numpy.testing.assert_equal(new.sids, [0, 2, 4])
+        numpy.testing.assert_equal(new.array, pmap.array)
+
+        dic, attrs = pmap.__toh5__()
+        new = object.__new__(ProbabilityMap)
+        new.__fromh5__(dic, attrs)
+        self.assertEqual((new.shape_y, new.shape_z), (3, 2))
+        numpy.testing.assert_equal(new[0].array, numpy.full((3, 2), .5))
+
+    def test_update_at(self):
+        pmap = ProbabilityMap.build(2, 1, sids=[1], initvalue=.5)
+        sids = numpy.array([3, 1, 3])
+        pnes = numpy.array([[[.5], [.5]], [[.2], [.2]], [[.4], [.4]]])
+        pmap.update_at(sids, pnes, numpy.multiply, 1.)
+        numpy.testing.assert_equal(pmap.sids, [1, 3])
+        numpy.testing.assert_almost_equal(
+            pmap.array[:, :, 0], [[.1, .1], [.2, .2]])
@@ -1,11 +1,12 @@
 import os.path
 import unittest
+from unittest import mock
 import numpy
-from openquake.hazardlib import geo, imt
+from openquake.hazardlib import geo, imt, correlation
 from openquake.hazardlib.shakemap import (
     get_shakemap_array, get_sitecol_shakemap, to_gmfs, amplify_ground_shaking,
     spatial_correlation_array, spatial_covariance_array,
-    cross_correlation_matrix, cholesky)
+    cross_correlation_matrix, cholesky, spatial_factors)
 
 aae = numpy.testing.assert_almost_equal
 F64 = numpy.float64
@@ -114,6 +115,35 @@ class ShakemapTestCase(unittest.TestCase):
                     trunclevel=3, num_gmfs=2, seed=42)
         self.assertIn('stddev==0 for IMT=PGA', str(ctx.exception))
 
+    def test_spatial_factors(self):
+        lons = numpy.array([84., 84., 84., 85.5, 85.5, 85.5, 87., 87., 87.])
+        lats = numpy.array([26., 27.5, 29., 26., 27.5, 29., 26., 27.5, 29.])
+        dmatrix = geo.geodetic.distance_matrix(lons, lats)
+        for correl in ('yes', 'no', 'full'):
+            corr = spatial_correlation_array(dmatrix, imts, correl)
+            dense = spatial_factors(lons, lats, imts, correl)
+            # with num_neighbours the factors are sparse, and exact
+            # with 9 sites, since they have less than 40 neighbours
+            sparse = spatial_factors(lons, lats, imts, correl,
+                                     num_neighbours=40)
+            for m in range(len(imts)):
+                for factor in (dense[m], sparse[m]):
+                    ff = factor @ numpy.eye(9)
+                    aae(ff @ ff.T, corr[m])
+
+    def test_max_dense_sites(self):
+        # above MAX_DENSE_SITES the factors are sparse even without
+        # num_neighbours
+        lons = numpy.array([84., 84., 84., 85.5, 85.5, 85.5, 87., 87., 87.])
+        lats = numpy.array([26., 27.5, 29., 26., 27.5, 29., 26., 27.5, 29.])
+        with mock.patch('openquake.hazardlib.shakemap.MAX_DENSE_SITES', 8):
+            [factor] = spatial_factors(lons, lats, imts[:1])
+        self.assertIsInstance(factor, correlation.NearestNeighboursFactor)
+        [dense] = spatial_factors(lons, lats, imts[:1])
+        self.assertIsInstance(dense, numpy.ndarray)
+        ff = factor @ numpy.eye(9)
+        aae(ff @ ff.T, dense @ dense.T)
+
     def test_from_files(self):
         # files provided by Vitor Silva, without site amplification
         f1 = os.path.join(CDIR, 'test_shaking.xml')
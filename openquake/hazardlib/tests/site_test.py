@@ -17,6 +17,7 @@ import os
 import pickle
 import unittest
 import tempfile
+from unittest import mock
 
 import numpy
 from shapely import wkt
@@ -264,6 +265,28 @@ class WithinBBoxTestCase(unittest.TestCase):
     def test1(self):
         assert_eq(self.sites.within_bbox((-182, -28, -178, -26)), [0])
 
+    def test_kdtree(self):
+        # the KD-tree gives the same sites as the numpy masks, even across
+        # the international date line
+        rng = numpy.random.RandomState(42)
+        lons = rng.uniform(160, 200, 2000)
+        lons[lons > 180] -= 360
+        sites = SiteCollection.from_points(lons, rng.uniform(-40, 0, 2000))
+        lon = rng.uniform(150, 210, 300)
+        lat = rng.uniform(-50, 10, 300)
+        bboxes = numpy.column_stack(
+            [lon, lat, lon + rng.uniform(0, 20, 300),
+             lat + rng.uniform(0, 20, 300)])
+        bboxes[bboxes > 180] -= 360
+        with mock.patch('openquake.hazardlib.site.KDT_QUERIES', 1E9):
+            expected = sites.within_bboxes(bboxes)
+        self.assertFalse(hasattr(sites, '_kdts'))
+        computed = sites.within_bboxes(bboxes)
+        self.assertIn('lonlat360', sites._kdts)
+        self.assertGreater(sum(len(sids) for sids in computed), 0)
+        for exp, got in zip(expected, computed):
+            assert_eq(got, exp)
+
 
 class SiteCollectionIterTestCase(unittest.TestCase):
 
@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import unittest
+import numpy
 
 from openquake.hazardlib.const import TRT
 from openquake.hazardlib.scalerel.peer import PeerMSR
@@ -100,3 +101,32 @@ class AreaSourceIterRupturesTestCase(unittest.TestCase):
         for rupture in ruptures:
             self.assertNotEqual(rupture.occurrence_rate, 3)
             self.assertEqual(rupture.occurrence_rate, 3.0 / 8.0)
+
+    def test_get_planar(self):
+        # the planar ruptures are the ones of the implied point sources
+        source = self.make_area_source(Polygon([Point(-2, -2), Point(0, -2),
+                                                Point(0, 0), Point(-2, 0)]),
+                                       discretization=66.7)
+        planar = source.get_planar()
+        self.assertEqual(len(planar), source.count_ruptures())
+        expected = numpy.concatenate([ps.get_planar() for ps in source])
+        for name in planar.dtype.names:
+            numpy.testing.assert_allclose(planar[name], expected[name])
+
+    def test_shift_hypo(self):
+        # with shift_hypo an unsplit area source moves only the depth of
+        # the hypocenters, both in iter_ruptures and in get_planar
+        source = self.make_area_source(
+            Polygon([Point(-2, -2), Point(0, -2), Point(0, 0), Point(-2, 0)]),
+            discretization=66.7,
+            nodal_plane_distribution=PMF([(1, NodalPlane(30, 45, 90))]))
+        rups = list(source.iter_ruptures(shift_hypo=True))
+        hypos = numpy.array([(rup.hypocenter.x, rup.hypocenter.y,
+                              rup.hypocenter.z) for rup in rups])
+        epis = numpy.array([(rup.hypocenter.x, rup.hypocenter.y)
+                            for rup in source.iter_ruptures()])
+        self.assertGreater(numpy.abs(hypos[:, 2] - numpy.tile(
+            [4., 8.], len(rups) // 2)).max(), 0)  # some were shifted
+        numpy.testing.assert_equal(hypos[:, :2], epis)
+        numpy.testing.assert_allclose(
+            source.get_planar(shift_hypo=True)['hypo'], hypos)
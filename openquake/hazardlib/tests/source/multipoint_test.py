@@ -83,3 +83,10 @@ multiPointSource{id='mp1', name='multi point source', tectonicRegion='Active Sha
         numpy.testing.assert_almost_equal(
             (-0.8994569916564479, -0.39932, 1.8994569916564479, 1.89932),
             bbox)
+
+        # test the planar ruptures, in the same order as iter_ruptures
+        planar = mps.get_planar()
+        self.assertEqual(len(planar), 10)
+        expected = numpy.concatenate([ps.get_planar() for ps in splits])
+        for name in planar.dtype.names:
+            numpy.testing.assert_allclose(planar[name], expected[name])
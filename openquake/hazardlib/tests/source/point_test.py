@@ -14,8 +14,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import unittest
+import numpy
 from openquake.hazardlib.const import TRT
-from openquake.hazardlib.source.point import PointSource
+from openquake.hazardlib.source.point import PointSource, planar_ruptures
 from openquake.hazardlib.source.rupture import ParametricProbabilisticRupture
 from openquake.hazardlib.mfd import TruncatedGRMFD, EvenlyDiscretizedMFD
 from openquake.hazardlib.scalerel.peer import PeerMSR
@@ -404,6 +405,34 @@ class PointSourceIterRupturesTestCase(unittest.TestCase):
         self.assertEqual(len(ruptures), 1)
 
 
+class PointSourceGetPlanarTestCase(unittest.TestCase):
+    def test_same_as_iter_ruptures(self):
+        # ruptures shifted up, shifted down and fitting in the layer
+        npd = PMF([(.5, NodalPlane(0, 90, 0)), (.3, NodalPlane(45, 30, 90)),
+                   (.2, NodalPlane(300, 60, -90))])
+        hdd = PMF([(.6, 5.), (.4, 20.)])
+        src = make_point_source(
+            lon=179.9, lat=45., mfd=TruncatedGRMFD(
+                a_val=4, b_val=1, min_mag=4.5, max_mag=8, bin_width=.5),
+            nodal_plane_distribution=npd, hypocenter_distribution=hdd,
+            upper_seismogenic_depth=2., lower_seismogenic_depth=25.,
+            magnitude_scaling_relationship=WC1994())
+        for shift_hypo in (False, True):
+            planar = src.get_planar(shift_hypo)
+            self.assertEqual(len(planar), src.count_ruptures())
+            expected = list(src.iter_ruptures(shift_hypo=shift_hypo))
+            got = planar_ruptures(planar, src.tectonic_region_type,
+                                  src.temporal_occurrence_model)
+            for exp, rup in zip(expected, got):
+                self.assertEqual(rup.mag, exp.mag)
+                self.assertEqual(rup.rake, exp.rake)
+                self.assertEqual(rup.hypocenter, exp.hypocenter)
+                self.assertAlmostEqual(rup.occurrence_rate,
+                                       exp.occurrence_rate)
+                numpy.testing.assert_allclose(
+                    rup.surface.mesh.xyz, exp.surface.mesh.xyz, atol=1E-9)
+
+
 class PointSourceMaxRupProjRadiusTestCase(unittest.TestCase):
     def test(self):
         mfd = TruncatedGRMFD(a_val=1, b_val=2, min_mag=3,
@@ -17,9 +17,10 @@
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 import os
 import io
+import tempfile
 import unittest.mock
 import numpy
-from openquake.baselib import hdf5
+from openquake.baselib import hdf5, general
 from openquake.hazardlib import nrml
 from openquake.hazardlib.sourceconverter import update_source_model, \
     SourceConverter
@@ -272,3 +273,59 @@ class SourceGroupHDF5TestCase(unittest.TestCase):
             f['grp'] = grp
         with hdf5.File(f.path, 'r') as f:
             print(f['grp'])
+
+
+class SourceCacheTestCase(unittest.TestCase):
+    def test_cache(self):
+        testfile = os.path.join(testdir, 'mixed.xml')
+        cachedir = tempfile.mkdtemp()
+        sc = SourceConverter(area_source_discretization=10.,
+                             cache=general.DiskCache(cachedir, 10 ** 8))
+        [sm] = nrml.read_source_models([testfile], sc)
+        self.assertFalse(sm.cached)
+        [sm2] = nrml.read_source_models([testfile], sc)
+        self.assertTrue(sm2.cached)
+        self.assertEqual(
+            [src.source_id for grp in sm2 for src in grp],
+            [src.source_id for grp in sm for src in grp])
+        self.assertEqual(
+            [src.num_ruptures for grp in sm2 for src in grp],
+            [src.num_ruptures for grp in sm for src in grp])
+
+        # changing the conversion parameters the file is read again
+        sc.width_of_mfd_bin = 0.5
+        [sm3] = nrml.read_source_models([testfile], sc)
+        self.assertFalse(sm3.cached)
+        self.assertEqual(len(os.listdir(cachedir)), 2)
+
+        # the least recently used entry is evicted
+        sc.cache.maxsize = max(os.path.getsize(os.path.join(cachedir, f))
+                               for f in os.listdir(cachedir))
+        self.assertEqual(sc.cache.evict(), 1)
+        [sm4] = nrml.read_source_models([testfile], sc)
+        self.assertTrue(sm4.cached)
+
+
+class StreamSourceModelTestCase(unittest.TestCase):
+    def test_same_as_to_python(self):
+        sc = SourceConverter(area_source_discretization=10.)
+        for fname in ['mixed.xml', 'source_group_collection.xml',
+                      'nonparametric-source.xml']:
+            testfile = os.path.join(testdir, fname)
+            sm1 = nrml.to_python(testfile, sc)
+            sm2 = nrml.stream_source_model(testfile, sc)
+            self.assertEqual(len(sm2), len(sm1))
+            for grp1, grp2 in zip(sm1, sm2):
+                self.assertEqual(grp2.trt, grp1.trt)
+                self.assertEqual(
+                    [(src.source_id, src.num_ruptures) for src in grp2],
+                    [(src.source_id, src.num_ruptures) for src in grp1])
+
+    def test_wrong_srcs_weights(self):
+        testfile = os.path.join(testdir, 'source_group_collection.xml')
+        with open(testfile) as f:
+            xml = f.read().replace('srcs_weights="', 'srcs_weights="0.1 ', 1)
+        fname = general.gettemp(xml, suffix='.xml')
+        with self.assertRaises(ValueError) as ctx:
+            nrml.stream_source_model(fname)
+        self.assertIn('srcs_weights', str(ctx.exception))
@@ -1,7 +1,7 @@
 import unittest
 import numpy
 from openquake.hazardlib.stats import (
-    mean_curve, quantile_curve, std_curve)
+    mean_curve, quantile_curve, std_curve, max_curve, StreamingStats)
 
 aaae = numpy.testing.assert_array_almost_equal
 
@@ -124,3 +124,79 @@ class QuantileCurveTestCase(unittest.TestCase):
         actual_curve = quantile_curve(quantile, curves, weights)
 
         numpy.testing.assert_allclose(expected_curve, actual_curve)
+
+
+class StreamingStatsTestCase(unittest.TestCase):
+
+    def test_blocks(self):
+        # 2000 weighted realizations of 5 PoEs consumed in blocks of 300
+        rng = numpy.random.RandomState(42)
+        curves = 10 ** rng.uniform(-8, 0, (2000, 5))
+        curves[:, 4] = 0  # no hazard
+        weights = rng.uniform(size=2000)
+        weights /= weights.sum()
+        names = ['mean', 'std', 'quantile-0.15', 'quantile-0.85', 'max']
+        streaming = StreamingStats(names, (5,), .01)
+        for start in range(0, 2000, 300):
+            slc = slice(start, start + 300)
+            streaming.update(curves[slc], weights[slc])
+        mean, std, q15, q85, max_ = streaming.result()
+        aaae(mean, mean_curve(curves, weights))
+        aaae(std, std_curve(curves, weights))
+        aaae(max_, max_curve(curves))
+        numpy.testing.assert_allclose(
+            q15, quantile_curve(.15, curves, weights), rtol=.01)
+        numpy.testing.assert_allclose(
+            q85, quantile_curve(.85, curves, weights), rtol=.01)
+        self.assertEqual(q15[4], 0)
+
+    def test_error_bound(self):
+        # the sketch is within the relative error from the upper of the
+        # two values between which quantile_curve interpolates
+        rng = numpy.random.RandomState(42)
+        values = 10 ** rng.uniform(-6, 0, (50, 3))
+        weights = rng.uniform(size=50)
+        weights /= weights.sum()
+        streaming = StreamingStats(['quantile-0.5'], (3,), .005)
+        streaming.update(values, weights)
+        [q50] = streaming.result()
+        exact = quantile_curve(.5, values, weights)
+        for i in range(3):
+            idxs = numpy.argsort(values[:, i])
+            cum = numpy.cumsum(weights[idxs])
+            upper = values[idxs, i][numpy.searchsorted(cum, .5)]
+            self.assertLessEqual(abs(q50[i] - exact[i]), .005 * upper)
+
+    def test_interpolation(self):
+        # 7 equal-weight curves and a quantile between the cumulative
+        # weights 1/7 and 2/7: the lower quantile would be 1E-4
+        curves = numpy.array([[1E-4, 2E-4, 4E-4, 1E-3, .01, .02, .1]]).T
+        weights = numpy.ones(7) / 7
+        streaming = StreamingStats(['quantile-0.15'], (1,), .01)
+        streaming.update(curves, weights)
+        [q15] = streaming.result()
+        exact = quantile_curve(.15, curves, weights)
+        self.assertGreater(exact[0], 1.04E-4)
+        self.assertLessEqual(abs(q15[0] - exact[0]), .01 * 2E-4)
+
+    def test_std_precision(self):
+        # values with a large mean and a small spread, where the one-pass
+        # formula would lose all the digits
+        rng = numpy.random.RandomState(42)
+        values = 1E8 + rng.uniform(size=(1000, 2))
+        weights = rng.uniform(size=1000)
+        weights /= weights.sum()
+        streaming = StreamingStats(['mean', 'std'], (2,), .01)
+        for start in range(0, 1000, 70):
+            slc = slice(start, start + 70)
+            streaming.update(values[slc], weights[slc])
+        mean, std = streaming.result()
+        numpy.testing.assert_allclose(mean, mean_curve(values, weights))
+        numpy.testing.assert_allclose(
+            std, std_curve(values - 1E8, weights), rtol=1E-6)
+
+    def test_unknown(self):
+        streaming = StreamingStats(['median'], (2,), .01)
+        streaming.update(numpy.ones((3, 2)), numpy.ones(3))
+        with self.assertRaises(ValueError):
+            streaming.result()
@@ -21,7 +21,6 @@ Module :mod:`openquake.hazardlib.tom` contains implementations of probability
 density functions for earthquake temporal occurrence modeling.
 """
 import abc
-import math
 
 import numpy
 import scipy.stats
@@ -123,11 +122,11 @@ class PoissonTOM(BaseTOM):
         Calculates probability as ``1 - e ** (-occurrence_rate*time_span)``.
 
         :param occurrence_rate:
-            The average number of events per year.
+            The average number of events per year (or an array of rates).
         :return:
-            Float value between 0 and 1 inclusive.
+            Float value between 0 and 1 inclusive (or an array of them).
         """
-        return 1 - math.exp(- occurrence_rate * self.time_span)
+        return 1 - numpy.exp(- occurrence_rate * self.time_span)
 
     def get_probability_n_occurrences(self, occurrence_rate, num):
         """
@@ -180,7 +179,8 @@ class PoissonTOM(BaseTOM):
             (1 - e ** (-occurrence_rate * time_span)) ** poes
 
         :param occurrence_rate:
-            The average number of events per year.
+            The average number of events per year, or an array of rates
+            broadcastable with ``poes``, one per row
         :param poes:
             2D numpy array containing conditional probabilities that the
             rupture occurrence causes a ground shaking value exceeding a
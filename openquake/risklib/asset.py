@@ -15,16 +15,18 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+import io
+import os
 import operator
 import itertools
 import logging
-import csv
-import os
 import numpy
-from shapely import wkt, geometry
+import pandas
+from shapely import wkt
+from shapely.vectorized import contains
 
-from openquake.baselib import hdf5, general
-from openquake.baselib.node import Node, context
+from openquake.baselib import hdf5, general, parallel, datastore, config
+from openquake.baselib.node import Node, context, striptag
 from openquake.baselib.python3compat import encode, decode
 from openquake.hazardlib import valid, nrml, geo, InvalidFile
 from openquake.risklib import countries
@@ -200,7 +202,9 @@ class Asset(object):
 U8 = numpy.uint8
 U32 = numpy.uint32
 F32 = numpy.float32
+F64 = numpy.float64
 U64 = numpy.uint64
+MB = 1024 ** 2
 TWO32 = 2 ** 32
 by_taxonomy = operator.attrgetter('taxonomy')
 
@@ -248,6 +252,19 @@ class TagCollection(object):
                 raise InvalidFile('contains more then %d tags' % TWO32)
             return idx
 
+    def add_tagvalues(self, tagname, tagvalues):
+        """
+        :param tagname: the name of the tag
+        :param tagvalues: an array of tag values, one per asset
+        :returns: an array of tag indices, one per asset
+
+        The indices are assigned in order of first appearance, as in `add`.
+        """
+        codes, uniq = pandas.factorize(tagvalues)
+        idxs = numpy.array([self.add(tagname, tagvalue) for tagvalue in uniq],
+                           U32)
+        return idxs[codes]
+
     def add_tags(self, dic, prefix):
         """
         :param dic: a dictionary tagname -> tagvalue
@@ -342,7 +359,8 @@ class AssetCollection(object):
         self.time_event = time_event
         self.tot_sites = len(assets_by_site)
         self.array, self.occupancy_periods = build_asset_array(
-            assets_by_site, exposure.tagcol.tagnames, time_event)
+            assets_by_site, exposure.cost_calculator,
+            exposure.tagcol.tagnames, time_event)
         exp_periods = exposure.occupancy_periods
         if self.occupancy_periods and not exp_periods:
             logging.warning('Missing <occupancyPeriods>%s</occupancyPeriods> '
@@ -526,21 +544,25 @@ class AssetCollection(object):
         return '<%s with %d asset(s)>' % (self.__class__.__name__, len(self))
 
 
-def build_asset_array(assets_by_site, tagnames=(), time_event=None):
+def build_asset_array(assets_by_site, cost_calculator, tagnames=(),
+                      time_event=None):
     """
-    :param assets_by_site: a list of lists of assets
+    :param assets_by_site: a list of arrays of exposure assets
+    :param cost_calculator: a CostCalculator instance
     :param tagnames: a list of tag names
+    :param time_event: ignored
     :returns: an array `assetcol`
     """
-    for assets in assets_by_site:
-        if len(assets):
-            first_asset = assets[0]
-            break
-    else:  # no break
+    sizes = [len(assets) for assets in assets_by_site]
+    if sum(sizes) == 0:
         raise ValueError('There are no assets!')
+    assets = numpy.concatenate([a for a in assets_by_site if len(a)])
+    names = assets.dtype.names
     loss_types = []
     occupancy_periods = []
-    for name in sorted(first_asset.values):
+    for name in sorted(name[6:] if name.startswith('value-') else name
+                       for name in names
+                       if name.startswith(('value-', 'occupants_'))):
         if name.startswith('occupants_'):
             period = name.split('_', 1)[1]
             if period != 'None':
@@ -553,46 +575,30 @@ def build_asset_array(assets_by_site, tagnames=(), time_event=None):
     # loss_types can be ['value-business_interruption', 'value-contents',
     # 'value-nonstructural', 'occupants_None', 'occupants_day',
     # 'occupants_night', 'occupants_transit']
-    retro = ['retrofitted'] if first_asset._retrofitted else []
+    retro = (['retrofitted'] if 'retrofitted' in names and
+             assets['retrofitted'].any() else [])
     float_fields = loss_types + retro
     int_fields = [(str(name), U32) for name in tagnames]
-    tagi = {str(name): i for i, name in enumerate(tagnames)}
     asset_dt = numpy.dtype(
         [('ordinal', U32), ('lon', F32), ('lat', F32), ('site_id', U32),
          ('number', F32), ('area', F32)] + [
              (str(name), float) for name in float_fields] + int_fields)
-    num_assets = sum(len(assets) for assets in assets_by_site)
-    assetcol = numpy.zeros(num_assets, asset_dt)
-    asset_ordinal = 0
-    fields = set(asset_dt.fields)
-    for sid, assets_ in enumerate(assets_by_site):
-        for asset in assets_:
-            asset.ordinal = asset_ordinal
-            record = assetcol[asset_ordinal]
-            asset_ordinal += 1
-            for field in fields:
-                if field == 'ordinal':
-                    value = asset.ordinal
-                elif field == 'number':
-                    value = asset.number
-                elif field == 'area':
-                    value = asset.area
-                elif field == 'site_id':
-                    value = sid
-                elif field == 'lon':
-                    value = asset.location[0]
-                elif field == 'lat':
-                    value = asset.location[1]
-                elif field.startswith('occupants_'):
-                    value = asset.values[field]
-                elif field == 'retrofitted':
-                    value = asset.retrofitted()
-                elif field in tagnames:
-                    value = asset.tagidxs[tagi[field]]
-                else:
-                    name, lt = field.split('-')
-                    value = asset.value(lt, time_event)
-                record[field] = value
+    assetcol = numpy.zeros(len(assets), asset_dt)
+    assetcol['ordinal'] = numpy.arange(len(assets))
+    assetcol['site_id'] = numpy.repeat(numpy.arange(len(sizes)), sizes)
+    for field in ['lon', 'lat', 'number', 'area'] + list(tagnames):
+        assetcol[field] = assets[field]
+    area, number = assets['area'], assets['number']
+    for field in float_fields:
+        if field.startswith('occupants_'):
+            assetcol[field] = assets[field]
+        elif field == 'retrofitted':
+            assetcol[field] = cost_calculator(
+                'structural', {'structural': assets[field]}, area, number)
+        else:
+            lt = field[6:]
+            assetcol[field] = cost_calculator(
+                lt, {lt: assets[field]}, area, number)
     return assetcol, ' '.join(occupancy_periods)
 
 
@@ -601,6 +607,29 @@ def build_asset_array(assets_by_site, tagnames=(), time_event=None):
 cost_type_dt = numpy.dtype([('name', hdf5.vstr),
                             ('type', hdf5.vstr),
                             ('unit', hdf5.vstr)])
+CSV_BLOCK = 2 ** 26  # number of bytes of an exposure CSV parsed per task
+
+
+def read_assets_csv(fname, start, stop, names, floats, monitor):
+    """
+    :param fname: a CSV file with assets
+    :param start: byte offset of the first line to read
+    :param stop: byte offset after the last line to read
+    :param names: the field names in the header of the file
+    :param floats: the names of the float fields
+    :param monitor: Monitor instance
+    :returns: ((fname, start), DataFrame with the assets)
+    """
+    with open(fname, 'rb') as f:
+        f.seek(start)
+        data = f.read(stop - start)
+    dtype = {name: float if name in floats else str for name in names}
+    try:
+        df = pandas.read_csv(io.BytesIO(data), header=None, names=names,
+                             dtype=dtype, keep_default_na=False)
+    except ValueError as exc:
+        raise InvalidFile('%s: %s' % (fname, exc))
+    return (fname, start), df
 
 
 def _get_exposure(fname, stop=None):
@@ -702,11 +731,21 @@ def _minimal_tagcol(fnames, by_country):
     return TagCollection(alltags)
 
 
+def _is_asset(ancestors, node):
+    # True for the asset nodes inside the assets node
+    return len(ancestors) == 3 and striptag(node.tag) == 'asset'
+
+
 def assets2array(asset_nodes, fields, retrofitted, ignore_missing_costs):
     """
-    :returns: an array of assets from the asset nodes
+    :param asset_nodes: an iterable over asset nodes, possibly lazy
+    :returns: a DataFrame of assets from the asset nodes
     """
-    first_asset = asset_nodes[0]
+    asset_nodes = iter(asset_nodes)
+    try:
+        first_asset = next(asset_nodes)
+    except StopIteration:
+        raise ValueError('There are no assets!')
     for occ in getattr(first_asset, 'occupancies', []):
         name = 'occupants_' + occ['period']
         if name not in fields:
@@ -714,9 +753,10 @@ def assets2array(asset_nodes, fields, retrofitted, ignore_missing_costs):
     dtlist = [(f, object) for f in fields]
     if retrofitted:
         dtlist.append(('retrofitted', object))
-    nodes = list(asset_nodes)
-    array = numpy.zeros(len(nodes), dtlist)
-    for asset, rec in zip(nodes, array):
+    records = []
+    for asset in itertools.chain([first_asset], asset_nodes):
+        rec = {name: 0 for name, _ in dtlist}
+        records.append(rec)
         # fix asset.attrib
         for occ in getattr(asset, 'occupancies', []):
             asset.attrib['occupants_' + occ['period']] = occ['occupants']
@@ -744,7 +784,8 @@ def assets2array(asset_nodes, fields, retrofitted, ignore_missing_costs):
                         raise
             else:
                 rec[field] = asset.attrib.get(field, '?')
-    return array
+    array = numpy.array([tuple(rec.values()) for rec in records], dtlist)
+    return pandas.DataFrame({name: array[name] for name in array.dtype.names})
 
 
 class Exposure(object):
@@ -760,22 +801,48 @@ class Exposure(object):
     def check(fname):
         exp = Exposure.read([fname])
         err = []
-        for asset, aref in zip(exp.assets, exp.asset_refs):
-            if asset.number > 65535:
-                err.append('Asset %s has number %s > 65535' %
-                           (aref, asset.number))
+        for asset in exp.assets[exp.assets['number'] > 65535]:
+            err.append('Asset %s has number %s > 65535' %
+                       (exp.asset_refs[asset['ordinal']], asset['number']))
         return '\n'.join(err)
 
     @staticmethod
     def read(fnames, calculation_mode='', region_constraint='',
              ignore_missing_costs=(), asset_nodes=False, check_dupl=True,
-             tagcol=None, by_country=False):
+             tagcol=None, by_country=False, cache=False):
         """
         Call `Exposure.read(fname)` to get an :class:`Exposure` instance
-        keeping all the assets in memory or
-        `Exposure.read(fname, asset_nodes=True)` to get an iterator over
-        Node objects (one Node for each asset).
+        keeping all the assets in memory as a structured array.
+
+        If `cache` is true, the Exposure instance is stored in the
+        directory `exposure_cache` inside the oqdata directory, with a key
+        depending on the contents of the exposure files, on the arguments
+        and on the code of this module, so that the next calculations can
+        skip the parsing.
         """
+        if cache:
+            fnames = list(fnames)
+            allfnames = fnames + [f for exp in Exposure.read_headers(fnames)
+                                  for f in exp.datafiles]
+            maxsize = int(config.directory.get('exposure_cache_mb', 1000))
+            dcache = general.DiskCache(os.path.join(
+                datastore.get_datadir(), 'exposure_cache'), maxsize * MB)
+            key = dcache.get_key(
+                calculation_mode, region_constraint,
+                sorted(ignore_missing_costs), check_dupl, by_country,
+                fnames=allfnames + [__file__])  # invalidated by code changes
+            exp = dcache.get(key)
+            if exp is not None:
+                logging.info('Reading the exposure from %s',
+                             dcache.get_path(key))
+                return exp
+            exp = Exposure.read(
+                fnames, calculation_mode, region_constraint,
+                ignore_missing_costs, asset_nodes, check_dupl, tagcol,
+                by_country)
+            dcache.put(key, exp)
+            dcache.evict()
+            return exp
         if by_country:  # E??_ -> countrycode
             prefix2cc = countries.from_exposures(
                 os.path.basename(f) for f in fnames)
@@ -794,6 +861,7 @@ class Exposure(object):
                             ignore_missing_costs, asset_nodes, check_dupl,
                             prefix, tagcol))
         exp = None
+        arrays = []
         for exposure in itertools.starmap(Exposure.read_exp, allargs):
             if exp is None:  # first time
                 exp = exposure
@@ -803,9 +871,12 @@ class Exposure(object):
                 assert exposure.occupancy_periods == exp.occupancy_periods
                 assert exposure.retrofitted == exp.retrofitted
                 assert exposure.area == exp.area
-                exp.assets.extend(exposure.assets)
+                # the ordinals are indices in the list of asset_refs
+                exposure.assets['ordinal'] += len(exp.asset_refs)
                 exp.asset_refs.extend(exposure.asset_refs)
                 exp.tagcol.extend(exposure.tagcol)
+            arrays.append(exposure.assets)
+        exp.assets = numpy.concatenate(arrays)
         exp.exposures = [os.path.splitext(os.path.basename(f))[0]
                          for f in fnames]
         return exp
@@ -824,26 +895,28 @@ class Exposure(object):
             param['region'] = None
         param['fname'] = fname
         param['ignore_missing_costs'] = set(ignore_missing_costs)
-        exposure, assetnodes = _get_exposure(param['fname'])
+        exposure, _ = _get_exposure(param['fname'], stop='asset')
         if tagcol:
             exposure.tagcol = tagcol
-        if assetnodes:
-            array = assets2array(
+        if exposure.datafiles:
+            df = exposure._read_csv()
+        else:  # parse the asset nodes one at the time
+            assetnodes = (node for ancestors, node in
+                          nrml.iterparse(fname, _is_asset) if ancestors)
+            df = assets2array(
                 assetnodes, exposure._csv_header(),
                 exposure.retrofitted or calculation_mode == 'classical_bcr',
                 ignore_missing_costs)
-        else:
-            array = exposure._read_csv()
-        param['relevant_cost_types'] = set(exposure.cost_types['name']) - set(
-            ['occupants'])
-        exposure._populate_from(array, param, check_dupl)
+        exposure._populate_from(df, param, check_dupl)
         if param['region'] and param['out_of_region']:
             logging.info('Discarded %d assets outside the region',
                          param['out_of_region'])
         if len(exposure.assets) == 0:
             raise RuntimeError('Could not find any asset within the region!')
         # sanity checks
-        values = any(len(ass.values) + ass.number for ass in exposure.assets)
+        names = exposure.assets.dtype.names
+        values = any(name.startswith(('value-', 'occupants_'))
+                     for name in names) or exposure.assets['number'].any()
         assert values, 'Could not find any value??'
         exposure.param = param
         return exposure
@@ -881,116 +954,119 @@ class Exposure(object):
 
     def _read_csv(self):
         """
-        :yields: asset nodes
+        :returns: a DataFrame with the assets in the CSV files
         """
         expected_header = set(self._csv_header('', ''))
-        for fname in self.datafiles:
-            with open(fname, encoding='utf-8') as f:
-                fields = next(csv.reader(f))
-                header = set(fields)
-                missing = expected_header - header - {'exposure', 'country'}
-                if len(header) < len(fields):
-                    raise InvalidFile(
-                        '%s: The header %s contains a duplicated field' %
-                        (fname, header))
-                elif missing:
-                    msg = ('Unexpected header in %s\nExpected: %s\nGot: %s\n'
-                           'Missing: %s')
-                    raise InvalidFile(msg % (fname, sorted(expected_header),
-                                             sorted(header), missing))
-        conv = {'lon': float, 'lat': float, 'number': float, 'area': float,
-                'retrofitted': float, None: object}
+        floats = {'lon', 'lat', 'number', 'area', 'retrofitted'}
         rename = {}
         for field in self.cost_types['name']:
-            conv[field] = float
+            floats.add(field)
             rename[field] = 'value-' + field
         for field in self.occupancy_periods.split():
-            conv[field] = float
+            floats.add(field)
             rename[field] = 'occupants_' + field
+        allargs = []
         for fname in self.datafiles:
-            array = hdf5.read_csv(fname, conv, rename).array
-            array['lon'] = numpy.round(array['lon'], 5)
-            array['lat'] = numpy.round(array['lat'], 5)
-            yield from array
-
-    def _populate_from(self, asset_array, param, check_dupl):
-        asset_refs = set()
-        for idx, asset in enumerate(asset_array):
-            asset_id = asset['id']
-            # check_dupl is False only in oq prepare_site_model since
-            # in that case we are only interested in the asset locations
-            if check_dupl and asset_id in asset_refs:
-                raise nrml.DuplicatedID(asset_id)
-            asset_refs.add(param['asset_prefix'] + asset_id)
-            self._add_asset(idx, asset, param)
-
-    def _add_asset(self, idx, asset, param):
-        values = {}
-        try:
-            retrofitted = asset['retrofitted']
-        except ValueError:
-            retrofitted = None
-        asset_id = asset['id']
+            fields, slices = hdf5.split_csv(fname, CSV_BLOCK)
+            header = set(fields)
+            missing = expected_header - header - {'exposure', 'country'}
+            if len(header) < len(fields):
+                raise InvalidFile(
+                    '%s: The header %s contains a duplicated field' %
+                    (fname, header))
+            elif missing:
+                msg = ('Unexpected header in %s\nExpected: %s\nGot: %s\n'
+                       'Missing: %s')
+                raise InvalidFile(msg % (fname, sorted(expected_header),
+                                         sorted(header), missing))
+            for start, stop in slices:
+                allargs.append((fname, start, stop, fields, floats))
+        # the slices are returned in order of completion
+        dfs = dict(parallel.Starmap(read_assets_csv, allargs))
+        df = pandas.concat([dfs[args[:2]] for args in allargs],
+                           ignore_index=True, sort=False)
+        df.rename(columns=rename, inplace=True)
+        df['lon'] = numpy.round(df['lon'], 5)
+        df['lat'] = numpy.round(df['lat'], 5)
+        return df
+
+    def _populate_from(self, df, param, check_dupl):
+        """
+        Populate the .assets array, the list .asset_refs and the tag
+        collection from a DataFrame of assets, one column at the time
+        """
         prefix = param['asset_prefix']
-        # FIXME: in case of an exposure split in CSV files the line number
-        # is None because param['fname'] points to the .xml file :-(
-        self.asset_refs.append(prefix + asset_id)
-        taxonomy = asset['taxonomy']
-        number = asset['number']
-        location = asset['lon'], asset['lat']
-        if param['region'] and not geometry.Point(*location).within(
-                param['region']):
-            param['out_of_region'] += 1
-            return
-        dic = {tagname: asset[tagname] for tagname in self.tagcol.tagnames
-               if tagname not in ('country', 'exposure') and
-               asset[tagname] != '?'}
-        dic['taxonomy'] = taxonomy
-        dic['id'] = prefix + asset_id
-        idxs = self.tagcol.add_tags(dic, prefix)
-        tot_occupants = 0
-        num_occupancies = 0
-        for name in asset.dtype.names:
-            if name.startswith('value-'):
-                values[name[6:]] = asset[name]
-            elif name.startswith('occupants_'):
-                values[name] = occ = float(asset[name])
-                tot_occupants += occ
-                num_occupancies += 1
-        if num_occupancies:
-            # store average occupants
-            values['occupants_None'] = tot_occupants / num_occupancies
-
-        # check we are not missing a cost type
-        missing = param['relevant_cost_types'] - set(values)
-        if missing and missing <= param['ignore_missing_costs']:
-            logging.warning(
-                'Ignoring asset %s, missing cost type(s): %s',
-                asset_id, ', '.join(missing))
-            for cost_type in missing:
-                values[cost_type] = None
-        elif missing and 'damage' not in param['calculation_mode']:
-            # missing the costs is okay for damage calculators
-            raise ValueError("Invalid Exposure. "
-                             "Missing cost %s for asset %s" % (
-                                 missing, asset_id))
-        try:
-            area = asset['area']
-        except ValueError:
-            area = 1
-        ass = Asset(idx, idxs, number, location, values, area,
-                    retrofitted, self.cost_calculator)
-        self.assets.append(ass)
+        ids = prefix + df['id'].astype(str).to_numpy(object)
+        # check_dupl is False only in oq prepare_site_model since
+        # in that case we are only interested in the asset locations
+        if check_dupl:
+            dupl = pandas.Series(ids).duplicated().to_numpy()
+            if dupl.any():
+                raise nrml.DuplicatedID(ids[dupl][0][len(prefix):])
+        # NB: the asset_refs contain also the assets outside the region
+        ordinals = numpy.arange(len(ids), dtype=U32) + len(self.asset_refs)
+        self.asset_refs.extend(ids)
+        lons = df['lon'].to_numpy(float)
+        lats = df['lat'].to_numpy(float)
+        if param['region']:
+            ok = contains(param['region'], lons, lats)
+            param['out_of_region'] += len(ok) - ok.sum()
+            df = df[ok]
+            ids, ordinals = ids[ok], ordinals[ok]
+            lons, lats = lons[ok], lats[ok]
+        occupants = [name for name in df.columns
+                     if name.startswith('occupants_')]
+        floats = [name for name in df.columns
+                  if name.startswith('value-')] + occupants
+        if occupants:  # store average occupants
+            floats.append('occupants_None')
+        if 'retrofitted' in df.columns:
+            floats.append('retrofitted')
+        dtlist = [('ordinal', U32), ('lon', F64), ('lat', F64),
+                  ('number', F64), ('area', F64)] + [
+                      (name, F64) for name in floats] + [
+                      (name, U32) for name in self.tagcol.tagnames]
+        array = numpy.zeros(len(df), dtlist)
+        array['ordinal'] = ordinals
+        array['lon'] = lons
+        array['lat'] = lats
+        array['number'] = df['number']
+        array['area'] = df['area'] if 'area' in df.columns else 1
+        for name in floats:
+            if name == 'occupants_None':
+                array[name] = df[occupants].to_numpy(float).mean(axis=1)
+            else:
+                array[name] = df[name]
+        # fill missing tagvalues with "?", raise an error for invalid ones
+        for tagname in self.tagcol.tagnames:
+            if tagname in ('exposure', 'country'):
+                array[tagname] = self.tagcol.add(tagname, prefix)
+                continue
+            elif tagname == 'id':
+                tagvalues = ids
+            elif tagname in df.columns:
+                tagvalues = df[tagname].astype(str).to_numpy(object)
+            else:
+                tagvalues = numpy.array(['?'] * len(df), object)
+            for tagvalue in set(tagvalues) & {'', '*', '?*'}:
+                raise ValueError('Invalid tagvalue="%s"' % tagvalue)
+            array[tagname] = self.tagcol.add_tagvalues(tagname, tagvalues)
+        self.assets = array
 
     def get_mesh_assets_by_site(self):
         """
-        :returns: (Mesh instance, assets_by_site list)
+        :returns: (Mesh instance, assets_by_site list of arrays)
         """
-        assets_by_loc = general.groupby(self, key=lambda a: a.location)
-        mesh = geo.Mesh.from_coords(list(assets_by_loc))
-        assets_by_site = [
-            assets_by_loc[lonlat] for lonlat in zip(mesh.lons, mesh.lats)]
-        return mesh, assets_by_site
+        lonlats = numpy.zeros(len(self.assets), [('lon', F64), ('lat', F64)])
+        lonlats['lon'] = self.assets['lon']
+        lonlats['lat'] = self.assets['lat']
+        # the locations are sorted, while the order of the assets on the
+        # same location is preserved
+        locs, inv = numpy.unique(lonlats, return_inverse=True)
+        mesh = geo.Mesh(locs['lon'], locs['lat'])
+        assets = self.assets[numpy.argsort(inv, kind='stable')]
+        stops = numpy.cumsum(numpy.bincount(inv))
+        return mesh, numpy.split(assets, stops[:-1])
 
     def __iter__(self):
         return iter(self.assets)
@@ -1491,11 +1491,9 @@ class LossesByAsset(object):
         """
         for lt in out.loss_types:
             lratios = out[lt]  # shape (A, E)
-            losses = numpy.zeros_like(lratios)
             avalues = (out.assets['occupants_None'] if lt == 'occupants'
                        else out.assets['value-' + lt])
-            for a, avalue in enumerate(avalues):
-                losses[a] = avalue * lratios[a]
+            losses = avalues.astype(lratios.dtype)[:, None] * lratios
             yield self.lni[lt], losses  # shape (A, E)
             if lt in self.policy_dict:
                 ins_losses = numpy.zeros_like(lratios)
@@ -1505,28 +1503,52 @@ class LossesByAsset(object):
                         losses[a], ded * avalues[a], lim * avalues[a])
                 yield self.lni[lt + '_ins'], ins_losses
 
-    def aggregate(self, out, eidx, minimum_loss, tagidxs, ws):
+    def aggregate(self, out, eidx, minimum_loss, kidxs, ws):
         """
-        Populate .losses_by_A, .losses_by_E and .alt
+        Populate .losses_by_A, .losses_by_E and .alt; the latter is a list
+        of triples (keys, loss_name_index, losses) with keys of the form
+        kidx * E + eidx, to be reduced with .get_alt
+
+        :param out: an ArrayWrapper with the loss ratios of the assets
+        :param eidx: the event indices, of length E
+        :param minimum_loss: the minimum loss for each loss name index
+        :param kidxs: the aggregation key indices of the assets or None
+        :param ws: the event weights or None
+        :returns: the number of losses (kept, total)
         """
         numlosses = numpy.zeros(2, int)
+        E = len(self.losses_by_E)
         for lni, losses in self.gen_losses(out):
             if ws is not None:  # compute avg_losses, really fast
                 aids = out.assets['ordinal']
                 self.losses_by_A[aids, lni] += losses @ ws
             self.losses_by_E[eidx, lni] += losses.sum(axis=0)
-            if tagidxs is not None:
-                # this is the slow part, depending on minimum_loss
-                for a, asset in enumerate(out.assets):
-                    idx = ','.join(map(str, tagidxs[a]))
-                    kept = 0
-                    for loss, eid in zip(losses[a], out.eids):
-                        if loss >= minimum_loss[lni]:
-                            self.alt[idx][eid][lni] += loss
-                            kept += 1
-                    numlosses += numpy.array([kept, len(losses[a])])
+            if kidxs is not None:
+                ok = losses >= minimum_loss[lni]  # shape (A, E)
+                aidx, eix = ok.nonzero()
+                keys = kidxs[aidx].astype(numpy.int64) * E + eidx[eix]
+                self.alt.append((keys, lni, losses[ok]))
+                numlosses += [len(keys), losses.size]
         return numlosses
 
+    def get_alt(self):
+        """
+        Reduce the triples in .alt
+
+        :returns: the sorted unique keys and an array of losses (K, L)
+        """
+        L = len(self.loss_names)
+        if not self.alt:
+            return numpy.zeros(0, numpy.int64), numpy.zeros((0, L), F32)
+        keys = numpy.concatenate([keys for keys, _, _ in self.alt])
+        lnis = numpy.concatenate([numpy.full(len(keys), lni)
+                                  for keys, lni, _ in self.alt])
+        losses = numpy.concatenate([losses for _, _, losses in self.alt])
+        ukeys, inv = numpy.unique(keys, return_inverse=True)
+        K = len(ukeys)
+        alt = numpy.bincount(inv * L + lnis, losses, K * L).reshape(K, L)
+        return ukeys, alt.astype(F32)
+
 
 # ####################### Consequences ##################################### #
 
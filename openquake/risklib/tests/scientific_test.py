@@ -20,6 +20,7 @@ import unittest
 import pickle
 
 import numpy
+from openquake.baselib import hdf5
 from openquake.risklib import scientific
 
 aaae = numpy.testing.assert_array_almost_equal
@@ -705,3 +706,27 @@ class ClassicalDamageTestCase(unittest.TestCase):
             fragility_functions, hazard_imls, hazard_poes,
             investigation_time, risk_investigation_time)
         aaae(poos, [0.56652127, 0.12513401, 0.1709355, 0.06555033, 0.07185889])
+
+
+class LossesByAssetTestCase(unittest.TestCase):
+    def test_aggregate(self):
+        assets = numpy.zeros(3, [('ordinal', numpy.uint32),
+                                 ('value-structural', float)])
+        assets['ordinal'] = [0, 1, 2]
+        assets['value-structural'] = [100, 200, 300]
+        lratios = numpy.array([[.1, 0., .2], [.1, .3, 0.], [0., .1, .1]])
+        out = hdf5.ArrayWrapper((), dict(
+            assets=assets, loss_types=['structural'], structural=lratios))
+        lba = scientific.LossesByAsset(assets, ['structural'])
+        lba.losses_by_E = numpy.zeros((4, 1), numpy.float32)
+        lba.alt = []
+        eidx = numpy.array([0, 2, 3])
+        kidxs = numpy.array([1, 0, 1])  # assets 0 and 2 have the same key
+        numlosses = lba.aggregate(out, eidx, [15.], kidxs, None)
+        # 5 losses out of 9 are above the minimum loss
+        self.assertEqual(list(numlosses), [5, 9])
+        aaae(lba.losses_by_E[:, 0], [30, 0, 90, 50])
+        keys, losses = lba.get_alt()
+        # keys of the form kidx * E + eidx
+        self.assertEqual(list(keys), [0, 2, 6, 7])
+        aaae(losses[:, 0], [20, 60, 30, 50])